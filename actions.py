@@ -0,0 +1,46 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+from config import ACTION_STORE_SIZE, ACTION_STORE_TTL
+from sessions import SessionRecord
+from tokens import TokenStore
+
+STOP_STREAM = 'stop_stream'
+MAINTENANCE = 'maintenance'
+
+
+class PendingAction(NamedTuple):
+    """Lo que hará un botón de confirmación al pulsarlo, con todo lo necesario para hacerlo."""
+    kind: str
+    session: Optional[SessionRecord] = None
+    server_indices: Tuple[int, ...] = ()
+
+
+class ActionStore:
+    """Acciones pendientes guardadas bajo un token: el botón solo lleva el token en su callback_data.
+
+    La acción guarda la sesión tal como estaba al mostrar el botón, así que al
+    confirmar se detiene directamente sin volver a pedir las sesiones a Plex.
+    """
+
+    def __init__(self, maxsize: int = ACTION_STORE_SIZE, ttl: float = ACTION_STORE_TTL):
+        self._store: TokenStore[PendingAction] = TokenStore(maxsize, ttl)
+
+    def stop_stream(self, session: SessionRecord) -> str:
+        return self._store.put(PendingAction(STOP_STREAM, session=session))
+
+    def maintenance(self, server_indices: List[int]) -> str:
+        return self._store.put(PendingAction(MAINTENANCE, server_indices=tuple(server_indices)))
+
+    def get(self, token: str, kind: str) -> Optional[PendingAction]:
+        """La acción del token si sigue vigente y es del tipo esperado; None en otro caso."""
+        action = self._store.get(token)
+        return action if action is not None and action.kind == kind else None
+
+    def pop(self, token: str, kind: str) -> Optional[PendingAction]:
+        """Como get, pero la acción se consume: un segundo toque al mismo botón no la repite."""
+        if self.get(token, kind) is None:
+            return None
+        return self._store.pop(token)
+
+
+action_store = ActionStore()
@@ -0,0 +1,178 @@
+"""Prueba de carga de los botones del bot con Telegram y Plex simulados.
+
+Levanta dos servidores Plex falsos en local (el segundo puede ser lento a
+propósito), sustituye el bot de Telegram por uno que solo cuenta llamadas y
+lanza pulsaciones contra bot.button() con la misma concurrencia que el
+Application (BOT_CONCURRENT_UPDATES). Muestra las pulsaciones por segundo y la
+latencia de cada ruta, para comprobar que un servidor lento no retrasa los
+botones que no dependen de él.
+
+Uso (desde la raíz del repositorio):
+
+    python bench/button_load.py [--presses 2000] [--concurrency 64] [--plex-latency 0.05] [--slow-delay 3]
+"""
+import argparse
+import asyncio
+import http.server
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Chat autorizado en bot.AUTHORIZED_CHAT_IDS
+CHAT_ID = -1234567890
+
+
+def fake_sessions(count: int) -> bytes:
+    videos = b''.join(
+        b'<Video sessionKey="%d" type="movie" title="Pelicula %d" viewOffset="600000" duration="7200000">'
+        b'<Media videoResolution="1080" bitrate="8000"/><User id="%d" title="usuario%d"/>'
+        b'<Player title="TV %d" address="10.0.0.%d" product="Plex"/><Session id="s%d" location="wan"/>%s</Video>'
+        % (key, key, key % 7, key % 7, key, key % 250, key,
+           b'<TranscodeSession videoDecision="transcode" audioDecision="copy"/>' if key % 3 == 0 else b'')
+        for key in range(count))
+    return b'<MediaContainer size="%d">%s</MediaContainer>' % (count, videos)
+
+
+class FakePlex(http.server.ThreadingHTTPServer):
+    """Plex mínimo: identidad, sesiones y bibliotecas, con un retardo fijo por petición."""
+
+    daemon_threads = True
+
+    def __init__(self, delay: float, sessions: int):
+        self.delay = delay
+        self.sessions_xml = fake_sessions(sessions)
+        self.requests = 0
+        super().__init__(('127.0.0.1', 0), FakePlexHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class FakePlexHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server: FakePlex = self.server
+        server.requests += 1
+        path = self.path.split('?')[0]
+        if path == '/':
+            body = b'<MediaContainer friendlyName="fake" machineIdentifier="bench" version="1.0"/>'
+        else:
+            time.sleep(server.delay)
+            body = server.sessions_xml if path == '/status/sessions' else b'<MediaContainer size="0"/>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubBot:
+    """Bot de Telegram simulado: cada método espera `latency` segundos y cuenta la llamada."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            return types.SimpleNamespace(message_id=kwargs.get('message_id', 1), chat_id=kwargs.get('chat_id'),
+                                         photo=[types.SimpleNamespace(file_id='bench')])
+        return call
+
+
+def make_update(data: str, message_id: int):
+    async def answer(*args, **kwargs):
+        pass
+    return types.SimpleNamespace(
+        callback_query=types.SimpleNamespace(data=data, answer=answer),
+        effective_chat=types.SimpleNamespace(id=CHAT_ID),
+        effective_user=types.SimpleNamespace(username='bench'),
+        effective_message=types.SimpleNamespace(message_id=message_id))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(args, bot_module, routes: List[str]) -> None:
+    from config import BOT_IO_THREADS
+    # Igual que post_init: las llamadas bloqueantes van al ejecutor por defecto con BOT_IO_THREADS hilos
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=BOT_IO_THREADS))
+    stub = StubBot(args.telegram_latency)
+    context = types.SimpleNamespace(bot=stub, application=None, bot_data={}, chat_data={}, user_data={})
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+
+    async def press(number: int) -> None:
+        data = routes[number % len(routes)]
+        async with slots:
+            started = time.perf_counter()
+            # Cada pulsación edita un mensaje distinto, para que la cola no funda ediciones
+            await bot_module.button(make_update(data, number), context)
+            latencies[data].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(press(number) for number in range(args.presses)))
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.presses} pulsaciones en {elapsed:.2f} s: {args.presses / elapsed:.0f} pulsaciones/s "
+          f"({stub.calls} llamadas a Telegram)\n")
+    print(f"{'ruta':<20} {'n':>6} {'p50':>9} {'p95':>9} {'máx':>9}")
+    for data in routes:
+        values = latencies[data]
+        print(f"{data:<20} {len(values):>6} {statistics.median(values) * 1000:>7.0f}ms "
+              f"{percentile(values, 0.95) * 1000:>7.0f}ms {max(values) * 1000:>7.0f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--presses', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64, help="pulsaciones atendidas a la vez")
+    parser.add_argument('--sessions', type=int, default=20, help="reproducciones en cada servidor falso")
+    parser.add_argument('--plex-latency', type=float, default=0.05, help="segundos por petición al Plex rápido")
+    parser.add_argument('--slow-delay', type=float, default=3.0, help="segundos por petición al Plex lento")
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help="segundos por llamada a Telegram")
+    parser.add_argument('--cache-ttl', default='5', help="SESSION_CACHE_TTL en segundos")
+    args = parser.parse_args()
+
+    fast = FakePlex(args.plex_latency, args.sessions)
+    slow = FakePlex(args.slow_delay, args.sessions)
+    state_dir = tempfile.mkdtemp(prefix='bench-')
+    os.environ.update({
+        'PLEX_SERVER_1_URL': fast.url, 'PLEX_SERVER_1_TOKEN': 'bench', 'PLEX_SERVER_1_NAME': 'Rapido',
+        'PLEX_SERVER_2_URL': slow.url, 'PLEX_SERVER_2_TOKEN': 'bench', 'PLEX_SERVER_2_NAME': 'Lento',
+        'SESSION_CACHE_TTL': args.cache_ttl,
+        'PLEX_LIVE_SESSIONS': 'false',
+        'STATE_DIR': state_dir,
+        'REPORT_LOGO_PATH': os.path.join(ROOT, 'telegrambot.png'),
+        # Se mide el bot, no los límites de Telegram: la cola saliente no debe frenar la prueba
+        'TELEGRAM_GLOBAL_RATE': '1000000', 'TELEGRAM_CHAT_RATE': '1000000', 'TELEGRAM_GROUP_RATE': '60000000',
+    })
+    import logging
+    logging.disable(logging.CRITICAL)
+    import bot
+
+    # Rutas sin E/S, de un solo servidor (rápido o lento) y de todos los servidores a la vez
+    routes = ['main_menu', 'help', 'playing:1', 'playing:2', 'transcoding_users', 'multiple_streams']
+    asyncio.run(run(args, bot, routes))
+    print(f"\nPeticiones a Plex: rápido {fast.requests}, lento {slow.requests}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark del informe HTML de streams (html_generator.render_streams_report).
+
+Genera informes sintéticos de 1.000 a 32.000 sesiones repartidas entre varios
+servidores y mide el tiempo de renderizado. Si el coste es lineal, los
+microsegundos por sesión se mantienen casi constantes al crecer el informe.
+
+Uso (desde la raíz del repositorio):
+
+    python bench/report_render.py [--servers 4] [--repeat 5] [--sizes 1000,2000,4000,8000,16000,32000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# El logo se lee del repositorio: el benchmark no debe descargar nada
+os.environ.setdefault('REPORT_LOGO_PATH', os.path.join(ROOT, 'telegrambot.png'))
+
+from html_generator import render_streams_report  # noqa: E402
+
+
+def build_streams_data(sessions: int, servers: int) -> dict:
+    """Datos con la misma forma que construye show_current_streams; uno de cada cuatro transcodifica."""
+    streams_data = {}
+    for server in range(servers):
+        streams_data[f"Servidor {server + 1}"] = {
+            'sessions': [
+                {
+                    'username': f"usuario{number}",
+                    'title': f"Serie {number % 50} - Episodio {number} <Director's Cut>" if number % 7 == 0
+                    else f"Película {number}",
+                    'type': 'Episodio' if number % 2 else 'Película',
+                    'progress': number % 120,
+                    'player': f"Reproductor {number % 13}",
+                    'transcoding': number % 4 == 0,
+                }
+                for number in range(server, sessions, servers)
+            ]
+        }
+    return streams_data
+
+
+def time_render(streams_data: dict, repeat: int) -> float:
+    """Mediana de `repeat` renderizados, en segundos."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        report = render_streams_report(streams_data)
+        timings.append(time.perf_counter() - started)
+        report.close()
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', default='1000,2000,4000,8000,16000,32000')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    # Calentamiento: la cabecera estática se compone una vez y queda en caché
+    time_render(build_streams_data(100, args.servers), 1)
+
+    print(f"{'sesiones':>9} {'tamaño':>10} {'tiempo':>10} {'µs/sesión':>10}")
+    per_session = []
+    for size in sizes:
+        streams_data = build_streams_data(size, args.servers)
+        report_size = render_streams_report(streams_data).getbuffer().nbytes
+        elapsed = time_render(streams_data, args.repeat)
+        per_session.append(elapsed / size * 1e6)
+        print(f"{size:>9} {report_size / 1024:>8.0f}KB {elapsed * 1000:>8.1f}ms {per_session[-1]:>10.2f}")
+    # Con coste lineal la relación se queda cerca de 1; con += cuadrático crecería con el tamaño
+    print(f"\nµs/sesión con {sizes[-1]} frente a {sizes[0]} sesiones: x{per_session[-1] / per_session[0]:.2f}")
+
+
+if __name__ == '__main__':
+    main()
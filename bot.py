@@ -1,23 +1,40 @@
+import asyncio
 import logging
 import sys
-import requests
 import re
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
-from plexapi.server import PlexServer
-from config import TELEGRAM_BOT_TOKEN, PLEX_SERVERS, GLANCES_SERVERS
+from telegram.error import BadRequest
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from config import (TELEGRAM_BOT_TOKEN, PLEX_HEALTHCHECK_INTERVAL, METRICS_INTERVAL, METRICS_WINDOW_MINUTES,
+                    BOT_CONCURRENT_UPDATES, BOT_IO_THREADS, STATE_DIR, LIBRARY_PROGRESS_INTERVAL, LIBRARY_REFRESH_TIMEOUT,
+                    LIBRARY_STATS_INTERVAL, MAINTENANCE_PROGRESS_INTERVAL, WATCHDOG_INTERVAL, WATCHDOG_AUTO_STOP,
+                    WATCHDOG_ALERT_CHAT_ID, PLEX_LIVE_SESSIONS, SHARING_WINDOW_HOURS, SHARING_ALERTS,
+                    HISTORY_SAMPLE_INTERVAL, DASHBOARD_INTERVAL, DASHBOARD_MAX_LENGTH)
+from plex_pool import plex_pool
+from live_sessions import live_sessions
+from formatting import escape_markdown, session_block, transcode_summary, transcode_details, stream_origin
+from sessions import session_cache, stop_session, BulkStopJob, STOPPED, GONE, FAILED as STOP_FAILED
+from plexapi.exceptions import NotFound
 import os
-from html_generator import generate_streams_html
-import tempfile
-
-# Función de utilidad para escapar caracteres especiales de Markdown
-def escape_markdown(text):
-    """
-    Escapa solo los caracteres especiales de Markdown necesarios en el texto.
-    """
-    escape_chars = '_*[]()~`>#+-='
-    return ''.join(f'\\{char}' if char in escape_chars else char for char in str(text))
+from html_generator import render_streams_report, get_logo_base64
+from glances import get_glances_data
+from metrics import metrics_poller, RingBuffer
+from photo_cache import CachedPhoto
+from library_stats import library_stats
+from sharing import sharing_index, SharingIncident
+from history import history_store
+from transcode_watchdog import transcode_watchdog, Violation
+from library import (RefreshJob, start_refresh, start_smart_refresh, find_section_for_path,
+                     PENDING, SCANNING, DONE, FAILED)
+from router import CallbackRouter
+from telegram_queue import outbox
+from pages import PageItem, PagedView, paginate, page_cache
+from dashboard import live_dashboard
+from actions import action_store, STOP_STREAM, MAINTENANCE
+from servers import SERVERS, Server, server_by_id
 
 # Configuración de logging
 logging.basicConfig(
@@ -32,6 +49,8 @@ logger = logging.getLogger(__name__)
 # Configuración de seguridad
 AUTHORIZED_CHAT_IDS = [-1234567890, -9876543210]
 AUTHORIZED_USERNAME = "TuNombreDeUsuario"
+# Chat al que llegan los avisos del vigilante y de cuentas compartidas
+ALERT_CHAT_ID = int(WATCHDOG_ALERT_CHAT_ID) if WATCHDOG_ALERT_CHAT_ID else AUTHORIZED_CHAT_IDS[0]
 
 def is_authorized(update: Update) -> bool:
     """Verifica si el usuario está autorizado para usar el bot."""
@@ -41,345 +60,399 @@ def is_authorized(update: Update) -> bool:
         return True
     return False
 
-def send_message_with_image(update: Update, context: CallbackContext, text: str, reply_markup: InlineKeyboardMarkup) -> Message:
-    image_path = 'telegrambot.png'
+# Rutas de los botones; se registran al final del módulo, cuando ya existen los manejadores
+router = CallbackRouter()
+
+# Imagen del bot: se lee una vez al arrancar y tras la primera subida se reenvía por file_id
+bot_photo = CachedPhoto(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telegrambot.png'),
+                        os.path.join(STATE_DIR, 'telegrambot_file_id.json'))
+
+async def send_photo_with_cache(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup: InlineKeyboardMarkup) -> Message:
+    if bot_photo.payload is None:
+        raise FileNotFoundError("Imagen del bot no disponible")
+    try:
+        message = await outbox.send(
+            context.bot.send_photo,
+            chat_id=update.effective_chat.id,
+            photo=bot_photo.payload,
+            caption=text,
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+    except BadRequest as e:
+        if bot_photo.file_id is None or 'file' not in str(e).lower():
+            raise
+        logger.warning(f"file_id de la imagen rechazado, se vuelve a subir: {str(e)}")
+        bot_photo.forget()
+        return await send_photo_with_cache(update, context, text, reply_markup)
+    bot_photo.remember(message.photo[-1].file_id)
+    return message
+
+async def send_message_with_image(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup: InlineKeyboardMarkup) -> Message:
     try:
-        with open(image_path, 'rb') as photo:
-            return context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=photo,
-                caption=text,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
+        return await send_photo_with_cache(update, context, text, reply_markup)
     except Exception as e:
         logger.error(f"Error al enviar imagen: {str(e)}")
-        return context.bot.send_message(
+        return await outbox.send(
+            context.bot.send_message,
             chat_id=update.effective_chat.id,
             text=text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
 
-def edit_message_with_image(update: Update, context: CallbackContext, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+async def edit_message_with_image(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup: InlineKeyboardMarkup) -> None:
     try:
-        context.bot.edit_message_caption(
+        await outbox.edit(
+            context.bot.edit_message_caption,
             chat_id=update.effective_chat.id,
             message_id=update.effective_message.message_id,
             caption=text,
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
+    except BadRequest as e:
+        # Solo si el mensaje no se puede editar (borrado, sin imagen...) se manda uno nuevo; ante un 429
+        # o un fallo de red, mandar otra foto duplicaría el tráfico justo cuando Telegram nos frena
+        logger.error(f"Error al editar mensaje: {str(e)}")
+        await send_message_with_image(update, context, text, reply_markup)
     except Exception as e:
         logger.error(f"Error al editar mensaje: {str(e)}")
-        send_message_with_image(update, context, text, reply_markup)
 
-def start(update: Update, context: CallbackContext) -> None:
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Comando /start recibido")
     if not is_authorized(update):
-        update.message.reply_text("Lo siento, no estás autorizado para usar este bot.")
+        await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text="Lo siento, no estás autorizado para usar este bot.")
         return
-    show_main_menu(update, context)
+    await show_main_menu(update, context)
 
-def show_main_menu(update: Update, context: CallbackContext) -> None:
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Mostrando menú principal")
     if not is_authorized(update):
         return
-    keyboard = [
-        [InlineKeyboardButton("🖥️ Ver servidores", callback_data='view_servers')],
-        [InlineKeyboardButton("📊 Informe Streams", callback_data='current_streams')],
-        [InlineKeyboardButton("👥 Usuarios con múltiples streams", callback_data='multiple_streams')],
-        [InlineKeyboardButton("🔄 Usuarios transcodificando", callback_data='transcoding_users')],
-        [InlineKeyboardButton("🛠️ Modo Mantenimiento", callback_data='maintenance_mode')],
-        [InlineKeyboardButton("ℹ️ Obtener Ayuda", callback_data='help')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = MAIN_MENU_MARKUP
     
     welcome_text = ('¡Bienvenido a Dual Plex Control! 🎬✨\n\n'
                    'Tu bot de gestión integral para Plex, diseñado para ofrecerte una experiencia óptima, eficiente y sin complicaciones.\n\n'
                    '¿Listo para optimizar y tomar el control total de tu biblioteca multimedia? 🚀\n\n'
                    '¿Cómo puedo ayudarte hoy?')
     
-    edit_message_with_image(update, context, welcome_text, reply_markup)
+    await edit_message_with_image(update, context, welcome_text, reply_markup)
 
-def button(update: Update, context: CallbackContext) -> None:
+async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Botón presionado")
     if not is_authorized(update):
-        update.callback_query.answer("No estás autorizado para usar este bot, ponte en contacto con @SinCracK")
+        await update.callback_query.answer("No estás autorizado para usar este bot, ponte en contacto con @SinCracK")
         return
     query = update.callback_query
-    query.answer()
+    await query.answer()
 
     try:
-        if query.data == 'view_servers':
-            show_servers(update, context)
-        elif query.data == 'current_streams':
-            show_current_streams(update, context)
-        elif query.data.startswith('server_'):
-            server_index = int(query.data.split('_')[1])
-            show_server_options(update, context, PLEX_SERVERS[server_index])
-        elif query.data.startswith('update_'):
-            server_index = int(query.data.split('_')[1])
-            update_libraries(update, context, PLEX_SERVERS[server_index])
-        elif query.data.startswith('playing_'):
-            server_index = int(query.data.split('_')[1])
-            view_playing(update, context, PLEX_SERVERS[server_index])
-        elif query.data.startswith('status_'):
-            server_index = int(query.data.split('_')[1])
-            show_server_status(update, context, PLEX_SERVERS[server_index])
-        elif query.data.startswith('stats_'):
-            server_index = int(query.data.split('_')[1])
-            show_library_stats(update, context, PLEX_SERVERS[server_index])
-        elif query.data == 'help':
-            show_help(update, context)
-        elif query.data == 'main_menu':
-            show_main_menu(update, context)
-        elif query.data == 'transcoding_users':
-            show_transcoding_users(update, context)
-        elif query.data.startswith('confirm_stop_'):
-            parts = query.data.split('_')
-            server_index = int(parts[2])
-            session_key = '_'.join(parts[3:])
-            show_stream_details(update, context, server_index, session_key)
-        elif query.data.startswith('stop_stream_'):
-            parts = query.data.split('_')
-            server_index = int(parts[2])
-            session_key = '_'.join(parts[3:])
-            stop_user_stream(update, context, server_index, session_key)
-        elif query.data == 'maintenance_mode':
-            show_maintenance_options(update, context)
-        elif query.data == 'maintenance_1':
-            confirm_maintenance(update, context, [0])
-        elif query.data == 'maintenance_2':
-            confirm_maintenance(update, context, [1])
-        elif query.data == 'maintenance_all':
-            confirm_maintenance(update, context, [0, 1])
-        elif query.data.startswith('confirm_maintenance_'):
-            server_indices = [int(i) for i in query.data.split('_')[2:]]
-            perform_maintenance(update, context, server_indices)
-        elif query.data == 'multiple_streams':
-            show_users_with_multiple_streams(update, context)
+        if not await router.dispatch(query.data, update, context):
+            # Botón de un formato antiguo o desconocido: se vuelve al menú principal
+            await show_main_menu(update, context)
     except Exception as e:
         logger.error(f"Error en el manejo de botones: {str(e)}")
         error_message = f"Lo siento, ha ocurrido un error: {str(e)}"
-        keyboard = [[InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        edit_message_with_image(update, context, error_message, reply_markup)
+        reply_markup = HOME_MARKUP
+        await edit_message_with_image(update, context, error_message, reply_markup)
 
-def show_servers(update: Update, context: CallbackContext) -> None:
+async def show_paged_view(update: Update, context: ContextTypes.DEFAULT_TYPE, view: PagedView) -> None:
+    """Guarda la vista completa bajo un token y muestra su primera página."""
+    await show_page(update, context, page_cache.store(view), 0)
+
+async def show_page(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str, page: int) -> None:
+    if not is_authorized(update):
+        return
+    view = page_cache.get(token)
+    if view is None:
+        await edit_message_with_image(update, context, "⌛ Esta lista ha caducado. Vuelve a abrirla desde el menú.", HOME_MARKUP)
+        return
+    text, reply_markup = page_cache.render(view, page, lambda number: router.data('page', token, number))
+    await edit_message_with_image(update, context, text, reply_markup)
+
+async def show_servers(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Mostrando servidores")
     if not is_authorized(update):
         return
-    keyboard = [[InlineKeyboardButton(f"🏙️ {server['name']}", callback_data=f"server_{i}")] for i, server in enumerate(PLEX_SERVERS)]
-    keyboard.append([InlineKeyboardButton("🔙 Volver al Menú Principal", callback_data="main_menu")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, "¡Elige el servidor sobre el que operar!", reply_markup)
+    await edit_message_with_image(update, context, "¡Elige el servidor sobre el que operar!", SERVERS_MARKUP)
 
-def show_server_options(update: Update, context: CallbackContext, server: dict) -> None:
-    logger.info(f"Mostrando opciones para el servidor: {server['name']}")
+async def show_server_options(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server) -> None:
+    logger.info(f"Mostrando opciones para el servidor: {server.name}")
+    if not is_authorized(update):
+        return
+    await edit_message_with_image(update, context, f"¿Qué quieres hacer en {server.name}? ✨", server.options_markup)
+
+def format_refresh_progress(job: RefreshJob) -> str:
+    """Estado de cada sección de un escaneo, agrupado por servidor."""
+    icons = {PENDING: "🕓", SCANNING: "⏳", DONE: "✅", FAILED: "❌"}
+    message = ""
+    for index in job.indices:
+        server = SERVERS[index]
+        if index in job.server_errors:
+            message += f"⚠️ *{escape_markdown(server.name)}:* {escape_markdown(job.server_errors[index])}\n\n"
+            continue
+        message += f"*{escape_markdown(server.name)}*\n"
+        sections = [section for section in job.sections if section.server_index == index]
+        if not sections:
+            message += "💤 Sin cambios desde el último escaneo\n"
+        for section in sections:
+            line = f"{icons[section.state]} {escape_markdown(section.title)}"
+            if section.paths:
+                line += f" ({len(section.paths)} {'ruta' if len(section.paths) == 1 else 'rutas'})"
+            if section.state == SCANNING:
+                line += f": {section.progress}%"
+            elif section.state == FAILED:
+                line += f": {escape_markdown(section.error)}"
+            message += line + "\n"
+        message += "\n"
+    return message
+
+async def track_library_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE, server_indices: List[int],
+                                reply_markup: InlineKeyboardMarkup, start_job: Callable[[], RefreshJob]) -> None:
+    """Lanza el escaneo y va editando un mensaje aparte con el progreso hasta que termina."""
+    names = ", ".join(SERVERS[index].name for index in server_indices)
+    try:
+        job = await asyncio.to_thread(start_job)
+        header = f"🔄 *Actualizando bibliotecas en {escape_markdown(names)}...*\n\n"
+        text = header + format_refresh_progress(job)
+        message = await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text=text,
+                                    parse_mode='Markdown')
+
+        deadline = time.monotonic() + LIBRARY_REFRESH_TIMEOUT
+        while not job.done and time.monotonic() < deadline:
+            await asyncio.sleep(LIBRARY_PROGRESS_INTERVAL)
+            await asyncio.to_thread(job.poll)
+            new_text = header + format_refresh_progress(job)
+            # Telegram rechaza las ediciones que no cambian nada
+            if new_text != text:
+                text = new_text
+                await outbox.edit(context.bot.edit_message_text, chat_id=message.chat_id,
+                                  message_id=message.message_id, text=text, parse_mode='Markdown')
+
+        # Las estadísticas de biblioteca se ponen al día con lo que haya encontrado el escaneo
+        library_stats.refresh_in_background(server_indices)
+        if job.done and not job.server_errors:
+            header = f"¡Boom! 💥 Bibliotecas actualizadas en {escape_markdown(names)}. ¡Tu contenido está más fresco que nunca! 🌟\n\n"
+        elif job.done:
+            header = f"⚠️ *Actualización de bibliotecas terminada con errores en {escape_markdown(names)}:*\n\n"
+        else:
+            header = "⏱️ *Se dejó de seguir el escaneo; Plex continúa en segundo plano.*\n\n"
+        await outbox.edit(context.bot.edit_message_text, chat_id=message.chat_id, message_id=message.message_id,
+                          text=header + format_refresh_progress(job), reply_markup=reply_markup,
+                          parse_mode='Markdown')
+    except Exception as e:
+        logger.error(f"Error al actualizar bibliotecas: {str(e)}")
+        await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id,
+                          text=f"Error al actualizar bibliotecas en {names}: {str(e)}",
+                          reply_markup=HOME_MARKUP)
+
+async def start_library_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE, server_indices: List[int],
+                                reply_markup: InlineKeyboardMarkup, start_job: Callable[[], RefreshJob]) -> None:
+    # El escaneo y su seguimiento siguen en segundo plano; la pulsación termina aquí
+    context.application.create_task(track_library_refresh(update, context, server_indices, reply_markup, start_job),
+                                    update=update)
+    names = ", ".join(SERVERS[index].name for index in server_indices)
+    text = f"🔄 Escaneo solicitado en {names}. Te iré contando el progreso en un mensaje aparte."
+    if update.callback_query:
+        await edit_message_with_image(update, context, text, reply_markup)
+    else:
+        await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text=text)
+
+async def show_update_options(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server) -> None:
+    logger.info(f"Mostrando opciones de actualización para el servidor: {server.name}")
     if not is_authorized(update):
         return
     keyboard = [
-        [InlineKeyboardButton("🔄 Actualizar bibliotecas", callback_data=f"update_{PLEX_SERVERS.index(server)}")],
-        [InlineKeyboardButton("👀 Ver reproducciones", callback_data=f"playing_{PLEX_SERVERS.index(server)}")],
-        [InlineKeyboardButton("📊 Ver estado del servidor", callback_data=f"status_{PLEX_SERVERS.index(server)}")],
-        [InlineKeyboardButton("📚 Bibliotecas", callback_data=f"stats_{PLEX_SERVERS.index(server)}")],
-        [InlineKeyboardButton("🔙 Volver a Servidores", callback_data="view_servers")],
-        [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
+        [InlineKeyboardButton("🔄 Todas las secciones", callback_data=router.data('update_full', server.id))],
+        [InlineKeyboardButton("🧠 Solo lo que ha cambiado", callback_data=router.data('update_smart', server.id))],
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, f"¿Qué quieres hacer en {server['name']}? ✨", reply_markup)
+    try:
+        sections = await asyncio.to_thread(plex_pool.run, server.index,
+                                           lambda plex: [(str(section.key), section.title) for section in plex.library.sections()])
+        keyboard += [[InlineKeyboardButton(f"📁 {title}", callback_data=router.data('update_section', server.id, key))]
+                     for key, title in sections]
+        message = f"¿Qué bibliotecas quieres actualizar en {escape_markdown(server.name)}?"
+    except Exception as e:
+        logger.error(f"Error al obtener las secciones: {str(e)}")
+        message = f"¿Qué bibliotecas quieres actualizar en {escape_markdown(server.name)}?\n\n⚠️ No se pudieron cargar las secciones: {str(e)}"
+    keyboard += server.back_markup.inline_keyboard
+    await edit_message_with_image(update, context, message, InlineKeyboardMarkup(keyboard))
+
+async def update_libraries(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server) -> None:
+    logger.info(f"Actualizando bibliotecas en el servidor: {server.name}")
+    if not is_authorized(update):
+        return
+    await start_library_refresh(update, context, [server.index], server.back_markup,
+                                lambda: start_refresh([server.index]))
+
+async def update_libraries_smart(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server) -> None:
+    logger.info(f"Actualización inteligente de bibliotecas en el servidor: {server.name}")
+    if not is_authorized(update):
+        return
+    await start_library_refresh(update, context, [server.index], server.back_markup,
+                                lambda: start_smart_refresh([server.index]))
+
+async def update_library_section(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server, section_key: str) -> None:
+    logger.info(f"Actualizando la sección {section_key} del servidor: {server.name}")
+    if not is_authorized(update):
+        return
+    await start_library_refresh(update, context, [server.index], server.back_markup,
+                                lambda: start_refresh([server.index], {server.index: {section_key: None}}))
+
+async def show_update_all_options(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_authorized(update):
+        return
+    await edit_message_with_image(update, context, "¿Cómo quieres actualizar las bibliotecas de todos los servidores?",
+                                  UPDATE_ALL_MARKUP)
+
+async def update_all_libraries(update: Update, context: ContextTypes.DEFAULT_TYPE, smart: bool) -> None:
+    logger.info(f"Actualizando bibliotecas en todos los servidores (inteligente: {smart})")
+    if not is_authorized(update):
+        return
+    indices = [server.index for server in SERVERS]
+    start_job = (lambda: start_smart_refresh(indices)) if smart else (lambda: start_refresh(indices))
+    await start_library_refresh(update, context, indices, HOME_MARKUP, start_job)
 
-def update_libraries(update: Update, context: CallbackContext, server: dict) -> None:
-    logger.info(f"Actualizando bibliotecas en el servidor: {server['name']}")
+async def scan_path(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Comando /escanear <id del servidor> <ruta>: escaneo parcial de una carpeta concreta."""
     if not is_authorized(update):
         return
+    if len(context.args) < 2:
+        await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text="Uso: /escanear <id del servidor> <ruta en Plex>")
+        return
     try:
-        plex = PlexServer(server['url'], server['token'])
-        for section in plex.library.sections():
-            section.update()
-        success_message = f"¡Boom! 💥 Bibliotecas actualizadas en {server['name']}. ¡Tu contenido está más fresco que nunca! 🌟"
-        keyboard = [
-            [InlineKeyboardButton("🔙 Volver a Opciones del Servidor", callback_data=f"server_{PLEX_SERVERS.index(server)}")],
-            [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        edit_message_with_image(update, context, success_message, reply_markup)
+        server = server_by_id(context.args[0])
+        path = " ".join(context.args[1:])
+        section = await asyncio.to_thread(find_section_for_path, server.index, path)
     except Exception as e:
-        logger.error(f"Error al actualizar bibliotecas: {str(e)}")
-        error_message = f"Error al actualizar bibliotecas en {server['name']}: {str(e)}"
-        keyboard = [[InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        edit_message_with_image(update, context, error_message, reply_markup)
+        await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text=f"❌ {str(e)}")
+        return
+    if section is None:
+        await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text=f"❌ Ninguna biblioteca de {server.name} contiene la ruta {path}")
+        return
+    plans = {server.index: {str(section.key): [path]}}
+    await start_library_refresh(update, context, [server.index], server.back_markup,
+                                lambda: start_refresh([server.index], plans))
 
-def view_playing(update: Update, context: CallbackContext, server: dict) -> None:
-    logger.info(f"Mostrando reproducciones en el servidor: {server['name']}")
+async def view_playing(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server) -> None:
+    logger.info(f"Mostrando reproducciones en el servidor: {server.name}")
     if not is_authorized(update):
         return
     try:
-        plex = PlexServer(server['url'], server['token'])
-        sessions = plex.sessions()
+        sessions = await asyncio.to_thread(session_cache.get, server.index)
         if sessions:
-            message = f"🎬 ¡Acción en *{server['name']}*! Esto es lo que está pasando:\n\n"
+            message = f"🎬 ¡Acción en *{server.name}*! Esto es lo que está pasando:\n\n"
             for session in sessions:
-                message += f"👤 *Usuario:* {escape_markdown(session.usernames[0])}\n"
-                if session.type == 'episode':
-                    message += f"🎥 *Serie:* {escape_markdown(session.grandparentTitle)}\n"
-                    message += f"📺 *Episodio:* {escape_markdown(session.title)}\n"
-                else:
-                    message += f"🎥 *Título:* {escape_markdown(session.title)}\n"
-                if session.type == 'movie':
-                    session_type = 'Película'
-                elif session.type == 'episode':
-                    session_type = 'Episodio'
-                else:
-                    session_type = session.type.capitalize()
-                message += f"📺 *Tipo:* {escape_markdown(session_type)}\n"
-                message += f"⏳ *Progreso:* {session.viewOffset // 60000} minutos\n"
-                message += f"🖥️ *Reproductor:* {escape_markdown(session.player.title)}\n"
-                message += f"\n"
+                message += session_block(session) + "\n"
         else:
-            message = f"😴 Parece que {server['name']} está tomando una siesta. ¡No hay reproducciones en curso!"
+            message = f"😴 Parece que {server.name} está tomando una siesta. ¡No hay reproducciones en curso!"
     except Exception as e:
         logger.error(f"Error al obtener reproducciones: {str(e)}")
-        message = f"Error al obtener reproducciones de {server['name']}: {str(e)}"
+        message = f"Error al obtener reproducciones de {server.name}: {str(e)}"
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Volver a Opciones del Servidor", callback_data=f"server_{PLEX_SERVERS.index(server)}")],
-        [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    reply_markup = server.back_markup
+    await edit_message_with_image(update, context, message, reply_markup)
+
+def render_dashboard() -> Tuple[str, InlineKeyboardMarkup]:
+    """Panel en vivo: reproducciones de todos los servidores, con el progreso en tramos del 5 %."""
+    lines = ["📡 *Panel en vivo*"]
+    for result in session_cache.get_all():
+        name = escape_markdown(result.server.name)
+        if not result.ok:
+            # Sin el texto del error, que cambia de un intento a otro y obligaría a editar sin motivo
+            lines.append(f"\n⚠️ *{name}:* sin datos")
+            continue
+        sessions = sorted(result.value, key=lambda session: (session.username, session.session_key))
+        transcoding = sum(1 for session in sessions if session.transcode_video)
+        lines.append(f"\n🏙️ *{name}:* {len(sessions)} reproducciones, {transcoding} transcodificando")
+        for session in sessions:
+            icon = "🔄" if session.transcode_video else "▶️"
+            percent = session.view_offset * 100 // session.duration if session.duration else 0
+            lines.append(f"{icon} {escape_markdown(session.username)}: {escape_markdown(session.full_title)} "
+                         f"({percent // 5 * 5}%)")
+    text = "\n".join(lines)
+    if len(text) > DASHBOARD_MAX_LENGTH:
+        text = text[:DASHBOARD_MAX_LENGTH].rsplit("\n", 1)[0] + "\n…"
+    return text, DASHBOARD_MARKUP
+
+async def start_live_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("Activando el panel en vivo")
+    if not is_authorized(update):
+        return
+    await live_dashboard.start(context.bot, update.effective_chat.id, render_dashboard)
+    message = f"📡 Panel en vivo activado: el mensaje fijado se actualiza cada {DASHBOARD_INTERVAL:g} segundos."
+    await edit_message_with_image(update, context, message, HOME_MARKUP)
+
+async def stop_live_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("Deteniendo el panel en vivo")
+    if not is_authorized(update):
+        return
+    await live_dashboard.stop(context.bot, update.effective_chat.id)
+    # El botón está en el propio panel, que es un mensaje de texto sin imagen
+    await outbox.edit(context.bot.edit_message_text, chat_id=update.effective_chat.id,
+                      message_id=update.effective_message.message_id,
+                      text="⏹️ Panel en vivo detenido.", reply_markup=HOME_MARKUP)
 
-def show_current_streams(update: Update, context: CallbackContext) -> None:
+async def show_current_streams(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Mostrando streams actuales")
     if not is_authorized(update):
         return
     
     streams_data = {}
     
-    for server in PLEX_SERVERS:
-        try:
-            plex = PlexServer(server['url'], server['token'])
-            sessions = plex.sessions()
-            
-            streams_data[server['name']] = {
-                'sessions': []
-            }
-            
-            for session in sessions:
-                session_data = {
-                    'username': session.usernames[0],
-                    'title': session.title if session.type != 'episode' else f"{session.grandparentTitle} - {session.title}",
-                    'type': 'Película' if session.type == 'movie' else 'Episodio' if session.type == 'episode' else session.type.capitalize(),
-                    'progress': session.viewOffset // 60000,
-                    'player': session.player.title,
-                    'transcoding': any(ts.videoDecision == 'transcode' or ts.audioDecision == 'transcode' for ts in session.transcodeSessions)
+    for result in await asyncio.to_thread(session_cache.get_all):
+        server = result.server
+        if not result.ok:
+            streams_data[server.name] = {'error': result.error}
+            continue
+        streams_data[server.name] = {
+            'sessions': [
+                {
+                    'username': session.username,
+                    'title': session.full_title,
+                    'type': session.type_label,
+                    'progress': session.progress_minutes,
+                    'player': session.player_title,
+                    'transcoding': session.transcoding
                 }
-                streams_data[server['name']]['sessions'].append(session_data)
-        except Exception as e:
-            logger.error(f"Error al conectar con {server['name']}: {str(e)}")
-            streams_data[server['name']] = {'error': str(e)}
-    
-    html_content = generate_streams_html(streams_data)
-    
-    # Crear un archivo temporal para guardar el HTML
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix='.html', encoding='utf-8') as temp_file:
-        temp_file.write(html_content)
-        temp_file_path = temp_file.name
-    
-    # Enviar el archivo HTML
-    with open(temp_file_path, 'rb') as file:
-        context.bot.send_document(chat_id=update.effective_chat.id, document=file, filename="streams_actuales.html")
+                for session in result.value
+            ]
+        }
     
-    # Eliminar el archivo temporal
-    os.unlink(temp_file_path)
+    # El informe se genera en memoria y se envía directamente, sin fichero temporal
+    report = await asyncio.to_thread(render_streams_report, streams_data)
+    await outbox.send(context.bot.send_document, chat_id=update.effective_chat.id, document=report, filename="streams_actuales.html")
     
     # Enviar un mensaje corto
     message = "Se ha generado un informe HTML con los streams actuales. Por favor, revisa el archivo adjunto para más detalles."
-    keyboard = [[InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    context.bot.send_message(chat_id=update.effective_chat.id, text=message, reply_markup=reply_markup)
+    reply_markup = HOME_MARKUP
+    await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text=message, reply_markup=reply_markup)
 
 
-def get_glances_data(url):
-    try:
-        # Intenta primero con la API v3
-        cpu_url = f"{url}/api/3/cpu"
-        mem_url = f"{url}/api/3/mem"
-        ip_url = f"{url}/api/3/ip"
-        uptime_url = f"{url}/api/3/uptime"
-        
-        cpu_response = requests.get(cpu_url, timeout=5)
-        mem_response = requests.get(mem_url, timeout=5)
-        ip_response = requests.get(ip_url, timeout=5)
-        uptime_response = requests.get(uptime_url, timeout=5)
-        
-        if cpu_response.status_code == 404 or mem_response.status_code == 404 or ip_response.status_code == 404 or uptime_response.status_code == 404:
-            # Si obtenemos un 404, intentamos con la API v4
-            cpu_url = f"{url}/api/4/cpu"
-            mem_url = f"{url}/api/4/mem"
-            ip_url = f"{url}/api/4/ip"
-            uptime_url = f"{url}/api/4/uptime"
-            
-            cpu_response = requests.get(cpu_url, timeout=5)
-            mem_response = requests.get(mem_url, timeout=5)
-            ip_response = requests.get(ip_url, timeout=5)
-            uptime_response = requests.get(uptime_url, timeout=5)
-        
-        if cpu_response.status_code == 200 and mem_response.status_code == 200 and ip_response.status_code == 200 and uptime_response.status_code == 200:
-            cpu_data = cpu_response.json()
-            mem_data = mem_response.json()
-            ip_data = ip_response.json()
-            uptime_data = uptime_response.json()
-            
-            # Manejo de diferentes estructuras de datos para CPU
-            if 'total' in cpu_data:
-                cpu_usage = cpu_data['total']
-            elif isinstance(cpu_data, list) and len(cpu_data) > 0 and 'total' in cpu_data[0]:
-                cpu_usage = cpu_data[0]['total']
-            else:
-                raise ValueError("Estructura de datos de CPU no reconocida")
-            
-            # Manejo de diferentes estructuras de datos para memoria
-            if 'used' in mem_data and 'total' in mem_data:
-                mem_usage = (mem_data['used'] / mem_data['total']) * 100
-            elif isinstance(mem_data, list) and len(mem_data) > 0 and 'used' in mem_data[0] and 'total' in mem_data[0]:
-                mem_usage = (mem_data[0]['used'] / mem_data[0]['total']) * 100
-            else:
-                raise ValueError("Estructura de datos de memoria no reconocida")
-            
-            # Manejo de diferentes estructuras de datos para IP
-            public_ip = ip_data.get('public_address', 'No disponible')
-            private_ip = ip_data.get('address', 'No disponible')
-            
-            # Manejo de diferentes estructuras de datos para uptime
-            if isinstance(uptime_data, str):
-                uptime = uptime_data
-            elif isinstance(uptime_data, dict) and 'uptime' in uptime_data:
-                uptime = uptime_data['uptime']
-            elif isinstance(uptime_data, list) and len(uptime_data) > 0:
-                uptime = uptime_data[0] if isinstance(uptime_data[0], str) else uptime_data[0].get('uptime', 'No disponible')
-            else:
-                uptime = 'No disponible'
-            
-            return f"Uso de CPU: {cpu_usage:.1f}%\nUso de RAM: {mem_usage:.1f}%\nIP Pública: {public_ip}\nIP Privada: {private_ip}\nTiempo de actividad: {uptime}"
-        else:
-            return f"Error al obtener datos. Códigos de estado - CPU: {cpu_response.status_code}, RAM: {mem_response.status_code}, IP: {ip_response.status_code}, Uptime: {uptime_response.status_code}"
-    except requests.RequestException as e:
-        return f"Error al conectar con Glances: {str(e)}"
-    except ValueError as e:
-        return f"Error al procesar datos de Glances: {str(e)}"
-
-def show_server_status(update: Update, context: CallbackContext, server: dict) -> None:
-    logger.info(f"Mostrando estado del servidor: {server['name']}")
-    if not is_authorized(update):
-        return
+def format_metric_summary(buffer: RingBuffer, unit: str = "") -> str:
+    """Línea con mínimo, media, máximo y tendencia de una serie en la ventana configurada."""
+    summary = buffer.summary(METRICS_WINDOW_MINUTES * 60)
+    if summary is None or summary.samples < 2:
+        return ""
+    spread = summary.maximum - summary.minimum
+    if summary.trend > spread * 0.2 and summary.trend > 0:
+        trend = "📈"
+    elif summary.trend < -spread * 0.2 and summary.trend < 0:
+        trend = "📉"
+    else:
+        trend = "➡️"
+    return (f"   {trend} {METRICS_WINDOW_MINUTES} min: mín {summary.minimum:.1f}{unit} · "
+            f"media {summary.average:.1f}{unit} · máx {summary.maximum:.1f}{unit}\n")
+
+def build_server_status(server: Server) -> str:
+    """Compone el mensaje de estado del servidor; hace E/S bloqueante, se llama desde un hilo."""
+    server_index = server.index
     try:
-        plex = PlexServer(server['url'], server['token'])
+        plex = plex_pool.get(server_index)
         status = "🟢 En línea"
         
-        message = f"📊 *Estado del servidor {escape_markdown(server['name'])}:*\n\n"
+        message = f"📊 *Estado del servidor {escape_markdown(server.name)}:*\n\n"
         message += f"*Estado:* {status}\n"
         message += f"*Versión:* {plex.version}\n"
         message += f"*Plataforma:* {escape_markdown(plex.platform)}\n"
@@ -394,10 +467,22 @@ def show_server_status(update: Update, context: CallbackContext, server: dict) -
         if hasattr(plex, 'friendlyName'):
             message += f"*Nombre amigable:* {plex.friendlyName}\n"
         
-        # Obtener información de Glances
-        glances_server = next((s for s in GLANCES_SERVERS if s['name'].lower() == server['name'].lower()), None)
-        if glances_server:
-            glances_data = get_glances_data(glances_server['url'])
+        # Información de Glances: la última muestra en memoria, o una consulta si aún no hay ninguna
+        metrics = metrics_poller.get(server_index)
+        glances_url = server.glances_url
+        if glances_url and metrics.glances:
+            stats = metrics.glances
+            message += f"\n💻 *Uso de CPU: {stats['cpu']:.1f}%*\n"
+            message += format_metric_summary(metrics.cpu, "%")
+            message += f"🧠 *Uso de RAM: {stats['mem']:.1f}%*\n"
+            message += format_metric_summary(metrics.mem, "%")
+            message += f"🌐 *IP Pública: {stats['public_ip']}*\n"
+            message += f"🏠 *IP Privada: {stats['private_ip']}*\n"
+            message += f"⏱️ *Tiempo de actividad: {stats['uptime']}*\n"
+        elif glances_url and metrics.glances_error:
+            message += f"\n⚠️ Error al obtener datos de Glances: {metrics.glances_error}\n"
+        elif glances_url:
+            glances_data = get_glances_data(glances_url)
             if not glances_data.startswith("Error"):
                 cpu_usage, ram_usage, public_ip, private_ip, uptime = glances_data.split('\n')
                 message += f"\n💻 *{cpu_usage}*\n"
@@ -408,42 +493,68 @@ def show_server_status(update: Update, context: CallbackContext, server: dict) -
             else:
                 message += f"\n⚠️ {glances_data}\n"
         else:
-            message += f"\n⚠️ No se encontró configuración de Glances para el servidor {escape_markdown(server['name'])}\n"
+            message += f"\n⚠️ No se encontró configuración de Glances para el servidor {escape_markdown(server.name)}\n"
 
-        sessions = plex.sessions()
-        active_streams = len(sessions)
-        message += f"\n*Streams activos:* {active_streams}\n"
+        if len(metrics.streams) and metrics.plex_error is None:
+            message += f"\n*Streams activos:* {int(metrics.streams.last())}\n"
+            message += format_metric_summary(metrics.streams)
+        else:
+            message += f"\n*Streams activos:* {len(session_cache.get(server_index))}\n"
         
-        libraries = plex.library.sections()
+        # Con la caché de estadísticas fría se piden solo los nombres: calcularlas ahora tardaría minutos
+        summary = library_stats.cached(server_index)
+        if summary is not None and summary.error is None:
+            titles = [section.title for section in summary.sections]
+        else:
+            titles = [section.title for section in plex_pool.run(server_index, lambda plex: plex.library.sections())]
         library_info = "\n*Bibliotecas:*\n"
-        for lib in libraries:
-            library_info += f"- *{escape_markdown(lib.title)}*\n"
+        for title in titles:
+            library_info += f"- *{escape_markdown(title)}*\n"
         message += library_info
 
     except Exception as e:
         logger.error(f"Error al obtener el estado del servidor: {str(e)}")
         status = "🔴 Fuera de línea"
-        message = f"📊 *Estado del servidor {escape_markdown(server['name'])}:*\n\n"
+        message = f"📊 *Estado del servidor {escape_markdown(server.name)}:*\n\n"
         message += f"*Estado:* {status}\n"
         message += f"Error: No se pudo conectar al servidor o obtener información. Detalles: {str(e)}\n"
+    return message
+
+async def show_server_status(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server) -> None:
+    logger.info(f"Mostrando estado del servidor: {server.name}")
+    if not is_authorized(update):
+        return
+    message = await asyncio.to_thread(build_server_status, server)
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Volver a Opciones del Servidor", callback_data=f"server_{PLEX_SERVERS.index(server)}")],
-        [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    reply_markup = server.back_markup
+    await edit_message_with_image(update, context, message, reply_markup)
 
-def show_library_stats(update: Update, context: CallbackContext, server: dict) -> None:
-    logger.info(f"Mostrando estadísticas de la biblioteca: {server['name']}")
+ITEM_UNITS = {'movie': 'películas', 'show': 'episodios', 'artist': 'pistas', 'photo': 'fotos'}
+
+def format_size(size: int) -> str:
+    """Bytes en la unidad más legible (KB, MB, GB, TB)."""
+    value = float(size)
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if value < 1024 or unit == 'TB':
+            return f"{value:.1f} {unit}" if unit != 'B' else f"{int(value)} B"
+        value /= 1024
+
+def format_counts(counts: List[tuple], limit: int = 4) -> str:
+    """'4k: 120 · 1080: 900 · ...' con los valores más frecuentes."""
+    return " · ".join(f"{name}: {count}" for name, count in counts[:limit])
+
+async def show_library_stats(update: Update, context: ContextTypes.DEFAULT_TYPE, server: Server) -> None:
+    logger.info(f"Mostrando estadísticas de la biblioteca: {server.name}")
     if not is_authorized(update):
         return
     try:
-        plex = PlexServer(server['url'], server['token'])
-        message = f"📚 *Bibliotecas de {escape_markdown(server['name'])}:*\n\n"
+        # Las cifras salen de la caché que se sincroniza en segundo plano; solo la primera vez se espera a Plex
+        stats = await asyncio.to_thread(library_stats.get, server.index)
+        header = f"📚 *Bibliotecas de {escape_markdown(server.name)}:*\n\n"
+        items = []
         
-        for section in plex.library.sections():
-            message += f"📁 *{escape_markdown(section.title)}:*\n"
+        for section in stats.sections:
+            message = f"📁 *{escape_markdown(section.title)}:*\n"
             if section.type == 'movie':
                 section_type = 'Película'
             elif section.type == 'show':
@@ -451,19 +562,33 @@ def show_library_stats(update: Update, context: CallbackContext, server: dict) -
             else:
                 section_type = section.type.capitalize()
             message += f"   - *Tipo:* {escape_markdown(section_type)}\n"
-            message += f"   - *Total de elementos:* {section.totalSize}\n\n"
+            if section.type in ITEM_UNITS:
+                message += f"   - *Total de {ITEM_UNITS[section.type]}:* {section.total}\n"
+                message += f"   - *Tamaño en disco:* {format_size(section.size)}\n"
+            if section.resolutions:
+                message += f"   - *Resoluciones:* {escape_markdown(format_counts(section.resolutions))}\n"
+            if section.codecs:
+                message += f"   - *Códecs:* {escape_markdown(format_counts(section.codecs))}\n"
+            items.append(PageItem(message + "\n"))
+        
+        if stats.recently_added:
+            message = "🆕 *Añadido recientemente:*\n"
+            for section_title, item in stats.recently_added:
+                message += f"   - {escape_markdown(item.title)} ({escape_markdown(section_title)})\n"
+            items.append(PageItem(message + "\n"))
+        if stats.error:
+            items.append(PageItem(f"⚠️ Datos de la última sincronización correcta: {escape_markdown(stats.error)}\n"))
+        if stats.updated_at:
+            items.append(PageItem(f"_Actualizado hace {int((time.time() - stats.updated_at) // 60)} min_"))
     except Exception as e:
         logger.error(f"Error al obtener estadísticas de la biblioteca: {str(e)}")
-        message = f"Error al obtener estadísticas de la biblioteca {escape_markdown(server['name'])}: {str(e)}"
+        message = f"Error al obtener estadísticas de la biblioteca {escape_markdown(server.name)}: {str(e)}"
+        await edit_message_with_image(update, context, message, server.back_markup)
+        return
     
-    keyboard = [
-        [InlineKeyboardButton("🔙 Volver a Opciones del Servidor", callback_data=f"server_{PLEX_SERVERS.index(server)}")],
-        [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    await show_paged_view(update, context, paginate(header, items, server.back_markup.inline_keyboard))
 
-def show_help(update: Update, context: CallbackContext) -> None:
+async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Mostrando ayuda")
     if not is_authorized(update):
         return
@@ -471,346 +596,539 @@ def show_help(update: Update, context: CallbackContext) -> None:
         "🦸‍♂️ ¡Centro de Ayuda del Bot! 🦸‍♀️\n\n"
         "Aquí tienes una guía rápida de lo que puedo hacer:\n\n"
         "🖥️ *Ver servidores:* Muestra una lista de tus servidores Plex y permite acceder a opciones específicas de cada servidor.\n"
-        "🔄 *Actualizar bibliotecas:* Actualiza todas las bibliotecas en un servidor específico.\n"
+        "🔄 *Actualizar bibliotecas:* Actualiza todas las bibliotecas de un servidor, una sola sección o solo las carpetas que han cambiado.\n"
+        "🔄 *Actualizar todas las bibliotecas:* Escanea a la vez las bibliotecas de todos los servidores e informa del progreso.\n"
+        "📂 */escanear <servidor> <ruta>:* Escanea solo una carpeta concreta.\n"
         "👀 *Ver reproducciones:* Muestra qué se está reproduciendo actualmente en un servidor.\n"
         "📊 *Informe Streams:* Genera un informe detallado de todos los streams activos en tus servidores Plex.\n"
         "📊 *Estado del servidor:* Muestra información sobre el estado y la versión del servidor.\n"
         "📚 *Bibliotecas:* Muestra las bibliotecas del servidor.\n"
         "🔄 *Usuarios transcodificando:* Muestra los usuarios que están realizando transcodificación.\n"
+        "📡 *Panel en vivo:* Fija un mensaje con las reproducciones de todos los servidores y lo mantiene al día.\n"
+        "📜 *Historial:* Usuarios que más transcodifican y picos de reproducciones simultáneas de la última semana.\n"
         "🛠️ *Modo Mantenimiento:* Permite realizar tareas de mantenimiento en los servidores.\n\n"
         "👥 *Usuarios con múltiples streams:* Muestra información sobre usuarios que están reproduciendo contenido en más de un dispositivo.\n\n"
         "¡No dudes en contactar conmigo si tienes dudas @SinCracK ! 🎉"
     )
-    keyboard = [[InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, help_text, reply_markup)
+    reply_markup = HOME_MARKUP
+    await edit_message_with_image(update, context, help_text, reply_markup)
 
-def show_transcoding_users(update: Update, context: CallbackContext) -> None:
+async def show_transcoding_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Mostrando usuarios transcodificando")
     if not is_authorized(update):
         return
     
-    message = "🔄 *Usuarios realizando transcodificación de video:*\n\n"
+    items = []
+    errors = []
     total_transcoding_video = 0
     total_transcoding_audio = 0
-    keyboard = []
     
-    for server_index, server in enumerate(PLEX_SERVERS):
-        try:
-            plex = PlexServer(server['url'], server['token'])
-            sessions = plex.sessions()
-            
-            server_transcoding_video = 0
-            server_transcoding_audio = 0
-            server_message = f"*Servidor {escape_markdown(server['name'])}:*\n"
-            
-            for session in sessions:
-                if session.transcodeSessions:
-                    is_transcoding_video = False
-                    is_transcoding_audio = False
-                    for transcode_session in session.transcodeSessions:
-                        if transcode_session.videoDecision == 'transcode':
-                            is_transcoding_video = True
-                        if transcode_session.audioDecision == 'transcode':
-                            is_transcoding_audio = True
-                    
-                    if is_transcoding_video:
-                        server_transcoding_video += 1
-                        server_message += f"👤 *Usuario:* {escape_markdown(session.usernames[0])}\n"
-                        if session.type == 'episode':
-                            server_message += f"🎥 *Serie:* {escape_markdown(session.grandparentTitle)}\n"
-                            server_message += f"📺 *Episodio:* {escape_markdown(session.title)}\n"
-                        else:
-                            server_message += f"🎥 *Título:* {escape_markdown(session.title)}\n"
-                        
-                        if session.type == 'movie':
-                            session_type = 'Película'
-                        elif session.type == 'episode':
-                            session_type = 'Episodio'
-                        else:
-                            session_type = session.type.capitalize()
-                        
-                        server_message += f"📺 *Tipo:* {escape_markdown(session_type)}\n"
-                        server_message += f"⏳ *Progreso:* {session.viewOffset // 60000} minutos\n"
-                        server_message += f"🖥️ *Reproductor:* {escape_markdown(session.player.title)}\n"
-                        
-                        transcode_type = []
-                        if is_transcoding_video:
-                            transcode_type.append('Video')
-                        if is_transcoding_audio:
-                            transcode_type.append('Audio')
-                        
-                        server_message += f"🔄 *Transcodificando:* {' y '.join(transcode_type)}\n"
-                        
-                        # Modificar el botón para que llame a una nueva función
-                        keyboard.append([InlineKeyboardButton(f"❌ Detener reproducción de {session.usernames[0]}", 
-                                                              callback_data=f"confirm_stop_{server_index}_{session.sessionKey}")])
-                        
-                        server_message += "\n"  # Agregar una línea en blanco entre usuarios
-                    
-                    if is_transcoding_audio:
-                        server_transcoding_audio += 1
-            
-            if server_transcoding_video > 0:
-                message += server_message
-                total_transcoding_video += server_transcoding_video
-                total_transcoding_audio += server_transcoding_audio
-            elif server_transcoding_audio > 0:
-                message += f"Servidor {escape_markdown(server['name'])}: Solo transcodificación de audio.\n\n"
-            else:
-                message += f"Servidor {escape_markdown(server['name'])}: No hay usuarios transcodificando.\n\n"
+    for result in await asyncio.to_thread(session_cache.get_all):
+        server = result.server
+        if not result.ok:
+            errors.append(PageItem(f"⚠️ Error al conectar con {escape_markdown(server.name)}: {escape_markdown(result.error)}\n"))
+            continue
         
-        except Exception as e:
-            logger.error(f"Error al conectar con {escape_markdown(server['name'])}: {str(e)}")
-            message += f"Error al conectar con {escape_markdown(server['name'])}: {str(e)}\n\n"
+        transcoding = [session for session in result.value if session.transcode_video]
+        server_transcoding_audio = sum(1 for session in result.value if session.transcode_audio)
+        if transcoding:
+            total_transcoding_video += len(transcoding)
+            total_transcoding_audio += server_transcoding_audio
+            for position, session in enumerate(transcoding):
+                # Cada usuario va con su botón de detener; el nombre del servidor encabeza al primero
+                text = f"*Servidor {escape_markdown(server.name)}:*\n" if position == 0 else ""
+                text += session_block(session) + transcode_summary(session) + "\n"
+                items.append(PageItem(text, [[InlineKeyboardButton(
+                    f"❌ Detener reproducción de {session.username}",
+                    callback_data=router.data('confirm_stop', action_store.stop_stream(session)))]]))
+        elif server_transcoding_audio > 0:
+            items.append(PageItem(f"Servidor {escape_markdown(server.name)}: Solo transcodificación de audio.\n\n"))
+        else:
+            items.append(PageItem(f"Servidor {escape_markdown(server.name)}: No hay usuarios transcodificando.\n\n"))
     
+    header = (f"*Transcodificando Video:* {total_transcoding_video} usuarios\n"
+              f"*Transcodificando Audio:* {total_transcoding_audio} usuarios\n\n")
     if total_transcoding_video == 0:
-        message = "😴 *No hay usuarios realizando transcodificación de video en este momento.*"
-    
-    message = (f"*Transcodificando Video:* {total_transcoding_video} usuarios\n"
-               f"*Transcodificando Audio:* {total_transcoding_audio} usuarios\n\n") + message
+        header += "😴 *No hay usuarios realizando transcodificación de video en este momento.*\n\n"
+        items = []
+    else:
+        header += "🔄 *Usuarios realizando transcodificación de video:*\n\n"
     
-    keyboard.append([InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    await show_paged_view(update, context, paginate(header, items + errors, HOME_MARKUP.inline_keyboard))
+
+# Mensaje que recibe el usuario al detenerle un transcode, a mano o desde el vigilante
+TRANSCODE_MESSAGE = (
+    "¡Atención! 🚨\n\n"
+    "Estás reproduciendo contenido con transcode, lo que no solo afecta la calidad de imagen, sino que también carga más el servidor. "
+    "Para obtener la mejor experiencia, te recomendamos ir a los ajustes de Plex y seleccionar \"Calidad máxima\" o \"Original\".\n\n"
+    "🔧 Consejo útil: Si estás usando Wi-Fi, la señal puede no ser suficiente. "
+    "¿Por qué no pruebas conectar tu dispositivo por cable para una experiencia más fluida?\n\n"
+    "¡Disfruta del contenido sin interrupciones! 🎥📶"
+)
 
-def stop_user_stream(update: Update, context: CallbackContext, server_index: int, session_key: str) -> None:
-    logger.info(f"Deteniendo reproducción del usuario en el servidor {server_index}, sesión {session_key}")
+async def stop_user_stream(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str) -> None:
     if not is_authorized(update):
         return
     
+    # La sesión viene guardada con el botón: no hace falta volver a pedir las sesiones a Plex
+    action = action_store.get(token, STOP_STREAM)
+    if action is None:
+        await edit_message_with_image(update, context, "⌛ Este botón ha caducado o ya se usó. Vuelve a abrir la lista.", TRANSCODING_BACK_MARKUP)
+        return
+    session = action.session
+    logger.info(f"Deteniendo reproducción de {session.username} en el servidor {session.server_index}, sesión {session.session_key}")
+    reply_markup = TRANSCODING_BACK_MARKUP
     try:
-        server = PLEX_SERVERS[server_index]
-        plex = PlexServer(server['url'], server['token'])
-        sessions = plex.sessions()
-        logger.info(f"Sesiones activas en el servidor: {len(sessions)}")
-        
-        session = next((s for s in sessions if str(s.sessionKey) == str(session_key)), None)
-        if session:
-            logger.info(f"Sesión encontrada: {session.title} - Usuario: {session.usernames[0]}")
-            session.stop(reason="¡Atención! 🚨\n\nEstás reproduciendo contenido con transcode, lo que no solo afecta la calidad de imagen, sino que también carga más el servidor. Para obtener la mejor experiencia, te recomendamos ir a los ajustes de Plex y seleccionar \"Calidad máxima\" o \"Original\".\n\n🔧 Consejo útil: Si estás usando Wi-Fi, la señal puede no ser suficiente. ¿Por qué no pruebas conectar tu dispositivo por cable para una experiencia más fluida?\n\n¡Disfruta del contenido sin interrupciones! 🎥📶")
-            message = f"✅ Se ha detenido la reproducción del usuario {escape_markdown(session.usernames[0])}.\n"
-            message += "Se le ha enviado un mensaje para que revise su configuración."
-        else:
-            logger.warning(f"No se encontró la sesión con clave {session_key}")
-            active_sessions ="\n".join([f"- {s.sessionKey}: {s.title} ({s.usernames[0]})" for s in sessions])
-            logger.info(f"Sesiones activas:\n{active_sessions}")
-            message = f"❌ No se encontró la sesión especificada (clave{session_key}).\n"
-            message += "Es posible que la reproducción ya haya terminado."
+        await asyncio.to_thread(stop_session, session, TRANSCODE_MESSAGE)
+        action_store.pop(token, STOP_STREAM)
+        message = f"✅ Se ha detenido la reproducción del usuario {escape_markdown(session.username)}.\n"
+        message += "Se le ha enviado un mensaje para que revise su configuración."
+    except NotFound:
+        action_store.pop(token, STOP_STREAM)
+        logger.warning(f"La sesión {session.session_key} de {session.username} ya no existía")
+        message = "❌ No se encontró la sesión especificada. Es posible que la reproducción ya haya terminado."
     except Exception as e:
         logger.error(f"Error al detener la reproducción: {str(e)}")
         message = f"❌ Error al detener la reproducción: {str(e)}"
+        # El botón sigue vigente: se puede reintentar sin volver a la lista
+        reply_markup = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("🔁 Reintentar", callback_data=router.data('stop_stream', token))]]
+            + list(TRANSCODING_BACK_MARKUP.inline_keyboard))
     
-    keyboard = [[InlineKeyboardButton("🔙 Volver a usuarios transcodificando", callback_data="transcoding_users")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    await edit_message_with_image(update, context, message, reply_markup)
 
-def show_maintenance_options(update: Update, context: CallbackContext) -> None:
+async def show_maintenance_options(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Mostrando opciones de mantenimiento")
     if not is_authorized(update):
         return
-    keyboard = [
-        [InlineKeyboardButton(f"🛠️ Mantenimiento {PLEX_SERVERS[0]['name']}", callback_data='maintenance_1')],
-        [InlineKeyboardButton(f"🛠️ Mantenimiento {PLEX_SERVERS[1]['name']}", callback_data='maintenance_2')],
-        [InlineKeyboardButton("🛠️ Mantenimiento General", callback_data='maintenance_all')],
-        [InlineKeyboardButton("🔙 Volver al Menú Principal", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, "Selecciona una opción de mantenimiento:", reply_markup)
+    await edit_message_with_image(update, context, "Selecciona una opción de mantenimiento:", MAINTENANCE_MARKUP)
 
-def confirm_maintenance(update: Update, context: CallbackContext, server_indices: List[int]) -> None:
+async def confirm_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE, server_indices: List[int]) -> None:
     logger.info(f"Solicitando confirmación para mantenimiento en servidores: {server_indices}")
     if not is_authorized(update):
         return
     
     if len(server_indices) == 1:
-        server_name = PLEX_SERVERS[server_indices[0]]['name']
+        server_name = SERVERS[server_indices[0]].name
         message = f"¿Estás seguro de que quieres realizar mantenimiento en {server_name}?\n\nEsto detendrá todas las reproducciones actuales."
     else:
         message = "¿Estás seguro de que quieres realizar mantenimiento general?\n\nEsto detendrá todas las reproducciones en todos los servidores."
     
+    # callback_data admite 64 bytes: la lista de servidores se queda en memoria y el botón lleva su token
+    confirm_data = router.data('confirm_maintenance', action_store.maintenance(server_indices))
     keyboard = [
-        [InlineKeyboardButton("✅ Sí, realizar mantenimiento", callback_data=f"confirm_maintenance_{'_'.join(map(str, server_indices))}")],
+        [InlineKeyboardButton("✅ Sí, realizar mantenimiento", callback_data=confirm_data)],
         [InlineKeyboardButton("❌ No, cancelar", callback_data="maintenance_mode")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    await edit_message_with_image(update, context, message, reply_markup)
 
-def perform_maintenance(update: Update, context: CallbackContext, server_indices: List[int]) -> None:
-    logger.info(f"Realizando mantenimiento en servidores: {server_indices}")
+MAINTENANCE_MESSAGE = (
+    "¡Atención! 🚨\n\n"
+    "Estamos realizando tareas de mantenimiento y, por ello, todas las reproducciones actuales se detendrán temporalmente. "
+    "Te pedimos disculpas por los inconvenientes y agradecemos tu comprensión mientras mejoramos la experiencia.\n\n"
+    "🔧 Consejo útil: Después de restablecer el servicio, es posible que tu sesión quede colgada. "
+    "En ese caso, te recomendamos reiniciar tu televisor o dispositivo para continuar sin problemas.\n\n"
+    "⏳ Si necesitas saber el tiempo estimado de la caída, por favor consulta a SinCracK.\n\n"
+    "¡Gracias por tu paciencia! 🙏🎥"
+)
+
+def format_stop_progress(job: BulkStopJob) -> str:
+    """Una línea por servidor con las reproducciones detenidas, las que ya no estaban y los fallos."""
+    lines = []
+    for index in job.indices:
+        name = escape_markdown(SERVERS[index].name)
+        if index in job.server_errors:
+            lines.append(f"❌ {name}: {escape_markdown(job.server_errors[index])}")
+            continue
+        if index not in job.totals:
+            lines.append(f"⏳ {name}: consultando reproducciones...")
+            continue
+        counts = job.counts(index)
+        icon = "⏳" if counts['pendientes'] else ("⚠️" if counts[STOP_FAILED] else "✅")
+        line = f"{icon} {name}: {counts[STOPPED]} detenidas"
+        if counts[GONE]:
+            line += f", {counts[GONE]} ya no estaban"
+        if counts[STOP_FAILED]:
+            line += f", {counts[STOP_FAILED]} fallidas"
+        if counts['pendientes']:
+            line += f", {counts['pendientes']} pendientes"
+        lines.append(line)
+    return "\n".join(lines)
+
+async def perform_maintenance(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str) -> None:
     if not is_authorized(update):
         return
     
-    maintenance_message = (
-        "¡Atención! 🚨\n\n"
-        "Estamos realizando tareas de mantenimiento y, por ello, todas las reproducciones actuales se detendrán temporalmente. "
-        "Te pedimos disculpas por los inconvenientes y agradecemos tu comprensión mientras mejoramos la experiencia.\n\n"
-        "🔧 Consejo útil: Después de restablecer el servicio, es posible que tu sesión quede colgada. "
-        "En ese caso, te recomendamos reiniciar tu televisor o dispositivo para continuar sin problemas.\n\n"
-        "⏳ Si necesitas saber el tiempo estimado de la caída, por favor consulta a SinCracK.\n\n"
-        "¡Gracias por tu paciencia! 🙏🎥"
-    )
-    
-    stopped_streams = 0
-    for index in server_indices:
-        try:
-            server = PLEX_SERVERS[index]
-            plex = PlexServer(server['url'], server['token'])
-            sessions = plex.sessions()
-            
-            for session in sessions:
-                session.stop(reason=maintenance_message)
-                stopped_streams += 1
-            
-            logger.info(f"Detenidas {len(sessions)} reproducciones en el servidor {server['name']}")
-        except Exception as e:
-            logger.error(f"Error al realizar mantenimiento en el servidor {index}: {str(e)}")
+    action = action_store.pop(token, MAINTENANCE)
+    if action is None:
+        await edit_message_with_image(update, context, "⌛ Este botón ha caducado o ya se usó. Vuelve a elegir el mantenimiento.", MAINTENANCE_MARKUP)
+        return
+    server_indices = list(action.server_indices)
+    logger.info(f"Realizando mantenimiento en servidores: {server_indices}")
     
     if len(server_indices) == 1:
-        server_name = PLEX_SERVERS[server_indices[0]]['name']
-        message = f"✅ Mensaje de mantenimiento enviado en {server_name}. Se detuvieron {stopped_streams} reproducciones."
+        header = f"🛠️ *Mantenimiento en {escape_markdown(SERVERS[server_indices[0]].name)}*\n\n"
     else:
-        message = f"✅ Mensaje de mantenimiento general enviado. Se detuvieron {stopped_streams} reproducciones en total."
+        header = "🛠️ *Mantenimiento general*\n\n"
     
-    keyboard = [[InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    # Las paradas van en paralelo en un hilo aparte; aquí solo se va contando cómo avanzan
+    job = BulkStopJob(server_indices, MAINTENANCE_MESSAGE)
+    stopping = asyncio.ensure_future(asyncio.to_thread(job.run))
+    text = None
+    while not stopping.done():
+        new_text = header + format_stop_progress(job)
+        # Telegram rechaza las ediciones que no cambian nada
+        if new_text != text:
+            text = new_text
+            try:
+                await outbox.edit(context.bot.edit_message_caption, chat_id=update.effective_chat.id,
+                                  message_id=update.effective_message.message_id, caption=text, parse_mode='Markdown')
+            except Exception as e:
+                logger.warning(f"No se pudo actualizar el progreso del mantenimiento: {str(e)}")
+        await asyncio.wait({stopping}, timeout=MAINTENANCE_PROGRESS_INTERVAL)
+    
+    try:
+        await stopping
+        for index in server_indices:
+            logger.info(f"Mantenimiento en {SERVERS[index].name}: {job.counts(index)}")
+        message = "✅ Mensaje de mantenimiento enviado.\n\n" + header + format_stop_progress(job)
+    except Exception as e:
+        logger.error(f"Error al realizar mantenimiento: {str(e)}")
+        message = header + f"Error al realizar mantenimiento: {str(e)}"
+    
+    reply_markup = HOME_MARKUP
+    await edit_message_with_image(update, context, message, reply_markup)
 
-def show_users_with_multiple_streams(update: Update, context: CallbackContext) -> None:
+async def show_users_with_multiple_streams(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Mostrando usuarios con múltiples streams")
     if not is_authorized(update):
         return
     
-    message = "👥 *Usuarios con múltiples streams:*\n\n"
     users_with_multiple_streams = {}
+    errors = []
     
-    for server in PLEX_SERVERS:
-        try:
-            plex = PlexServer(server['url'], server['token'])
-            sessions = plex.sessions()
-            
-            for session in sessions:
-                username = session.usernames[0]
-                ip_address = session.player.address
-                
-                if username not in users_with_multiple_streams:
-                    users_with_multiple_streams[username] = []
-                
-                users_with_multiple_streams[username].append({
-                    'server': server['name'],
-                    'ip': ip_address,
-                    'title': session.title,
-                    'type': 'Película' if session.type == 'movie' else 'Episodio' if session.type == 'episode' else session.type.capitalize()
-                })
-        except Exception as e:
-            logger.error(f"Error al obtener sesiones de {server['name']}: {str(e)}")
+    for result in await asyncio.to_thread(session_cache.get_all):
+        server = result.server
+        if not result.ok:
+            errors.append(PageItem(f"⚠️ Sin datos de {escape_markdown(server.name)}: {escape_markdown(result.error)}\n"))
+            continue
+        for session in result.value:
+            users_with_multiple_streams.setdefault(session.username, []).append(session)
     
+    items = []
     for username, streams in users_with_multiple_streams.items():
         if len(streams) > 1:
-            message += f"*Usuario:* {escape_markdown(username)}\n"
-            unique_ips = set(stream['ip'] for stream in streams)
+            text = f"*Usuario:* {escape_markdown(username)}\n"
+            unique_ips = set(stream.player_address for stream in streams)
             
             if len(unique_ips) > 1:
-                message += f"⚠️ *Reproduciendo desde {len(unique_ips)} direcciones IP diferentes*\n"
+                text += f"⚠️ *Reproduciendo desde {len(unique_ips)} direcciones IP diferentes*\n"
             else:
-                message += "✅ Todas las reproducciones desde la misma IP\n"
+                text += "✅ Todas las reproducciones desde la misma IP\n"
             
             for stream in streams:
-                message += f"  - *Servidor:* {escape_markdown(stream['server'])}\n"
-                message += f"    *IP:* {stream['ip']}\n"
-                message += f"    *Contenido:* {escape_markdown(stream['title'])} ({stream['type']})\n"
-            
-            message += "\n"
+                text += stream_origin(stream)
+            items.append(PageItem(text + "\n"))
     
-    if not any(len(streams) > 1 for streams in users_with_multiple_streams.values()):
-        message = "😴 No hay usuarios con múltiples streams en este momento."
+    if items:
+        header = "👥 *Usuarios con múltiples streams:*\n\n"
+    else:
+        header = "😴 No hay usuarios con múltiples streams en este momento.\n\n"
     
-    keyboard = [[InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    edit_message_with_image(update, context, message, reply_markup)
+    await show_paged_view(update, context, paginate(header, items + errors, MULTIPLE_STREAMS_MARKUP.inline_keyboard))
 
-def show_stream_details(update: Update, context: CallbackContext, server_index: int, session_key: str) -> None:
-    logger.info(f"Mostrando detalles del stream para confirmación: servidor {server_index}, sesión {session_key}")
+async def show_shared_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("Mostrando cuentas compartidas")
+    if not is_authorized(update):
+        return
+    
+    # Sale del índice de reproducciones que se mantiene en segundo plano, sin consultar a los servidores
+    shared = sharing_index.shared_since(SHARING_WINDOW_HOURS)
+    if not shared:
+        message = f"😴 Nadie ha reproducido a la vez desde varias IP en las últimas {SHARING_WINDOW_HOURS:g} h."
+    else:
+        message = f"🕵️ *Cuentas compartidas en las últimas {SHARING_WINDOW_HOURS:g} h:*\n\n"
+        for username, incidents in sorted(shared.items(), key=lambda item: -len(item[1])):
+            ips = sorted({ip for incident in incidents for ip in incident.ips})
+            servers = sorted({SERVERS[s.server_index].name for incident in incidents for s in incident.sightings})
+            last = incidents[-1]
+            message += f"*Usuario:* {escape_markdown(username)}\n"
+            message += f"  - *Veces:* {len(incidents)}, la última hace {int((time.time() - last.at) // 60)} min\n"
+            message += f"  - *IPs:* {', '.join(ips)}\n"
+            message += f"  - *Servidores:* {escape_markdown(', '.join(servers))}\n\n"
+    
+    reply_markup = MULTIPLE_STREAMS_BACK_MARKUP
+    await edit_message_with_image(update, context, message, reply_markup)
+
+async def show_stream_details(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str) -> None:
     if not is_authorized(update):
         return
     
     try:
-        server = PLEX_SERVERS[server_index]
-        plex = PlexServer(server['url'], server['token'])
-        sessions = plex.sessions()
-        
-        session = next((s for s in sessions if str(s.sessionKey) == str(session_key)), None)
-        if session:
+        action = action_store.get(token, STOP_STREAM)
+        if action:
+            session = action.session
+            logger.info(f"Mostrando detalles del stream para confirmación: servidor {session.server_index}, sesión {session.session_key}")
             message = f"🎬 *Detalles del stream:*\n\n"
-            message += f"👤 *Usuario:* {escape_markdown(session.usernames[0])}\n"
-            message += f"🎥 *Título:* {escape_markdown(session.title)}\n"
-            message += f"📺 *Tipo:* {'Película' if session.type == 'movie' else 'Episodio' if session.type == 'episode' else session.type.capitalize()}\n"
-            message += f"⏳ *Progreso:* {session.viewOffset // 60000} minutos\n"
-            message += f"🖥️ *Reproductor:* {escape_markdown(session.player.title)}\n\n"
+            message += session_block(session) + "\n"
             
             # Añadir información detallada sobre la transcodificación
-            if session.transcodeSessions:
-                message += "*Detalles de Transcodificación:*\n"
-                for transcode in session.transcodeSessions:
-                    message += f"🔄 *Tipo de Transcode:* "
-                    transcode_types = []
-                    if transcode.videoDecision == 'transcode':
-                        transcode_types.append("Video")
-                    if transcode.audioDecision == 'transcode':
-                        transcode_types.append("Audio")
-                    message += f"{' y '.join(transcode_types)}\n"
-                    
-                    if transcode.videoDecision == 'transcode':
-                        message += f"🎞️ *Formato de Video Original:* {getattr(transcode, 'sourceVideoCodec', 'No disponible')}\n"
-                        message += f"🎞️ *Formato de Video Transcode:* {getattr(transcode, 'videoCodec', 'No disponible')}\n"
-                        if hasattr(transcode, 'sourceVideoResolution'):
-                            message += f"📊 *Resolución Original:* {transcode.sourceVideoResolution}\n"
-                        if hasattr(transcode, 'videoResolution'):
-                            message += f"📊 *Resolución Transcode:* {transcode.videoResolution}\n"
-                    
-                    if transcode.audioDecision == 'transcode':
-                        message += f"🔊 *Formato de Audio Original:* {getattr(transcode, 'sourceAudioCodec', 'No disponible')}\n"
-                        message += f"🔊 *Formato de Audio Transcode:* {getattr(transcode, 'audioCodec', 'No disponible')}\n"
-                        message += f"🔉 *Canales de Audio Original:* {getattr(transcode, 'sourceAudioChannels', 'No disponible')}\n"
-                        message += f"🔉 *Canales de Audio Transcode:* {getattr(transcode, 'audioChannels', 'No disponible')}\n"
-                    
-                    message += f"⚙️ *Razón del Transcode:* {getattr(transcode, 'transcodeReason', 'No disponible')}\n\n"
-            else:
-                message += "*No se está realizando transcodificación para este stream.*\n\n"
+            message += transcode_details(session)
             
             message += "¿Estás seguro de que quieres detener este stream?"
             
             keyboard = [
-                [InlineKeyboardButton("✅ Sí, detener", callback_data=f"stop_stream_{server_index}_{session_key}")],
+                [InlineKeyboardButton("✅ Sí, detener", callback_data=router.data('stop_stream', token))],
                 [InlineKeyboardButton("❌ No, cancelar", callback_data="transcoding_users")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            edit_message_with_image(update, context, message, reply_markup)
+            await edit_message_with_image(update, context, message, reply_markup)
         else:
-            message = "❌ No se encontró la sesión especificada. Es posible que la reproducción ya haya terminado."
-            keyboard = [[InlineKeyboardButton("🔙 Volver a usuarios transcodificando", callback_data="transcoding_users")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            edit_message_with_image(update, context, message, reply_markup)
+            message = "⌛ Este botón ha caducado. Vuelve a abrir la lista para ver las reproducciones actuales."
+            reply_markup = TRANSCODING_BACK_MARKUP
+            await edit_message_with_image(update, context, message, reply_markup)
     except Exception as e:
         logger.error(f"Error al mostrar detalles del stream: {str(e)}")
         message = f"❌ Error al obtener detalles del stream: {str(e)}"
-        keyboard = [[InlineKeyboardButton("🔙 Volver a usuarios transcodificando", callback_data="transcoding_users")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        edit_message_with_image(update, context, message, reply_markup)
+        reply_markup = TRANSCODING_BACK_MARKUP
+        await edit_message_with_image(update, context, message, reply_markup)
+
+async def show_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("Mostrando historial de reproducciones")
+    if not is_authorized(update):
+        return
+    
+    since = time.time() - 7 * 86400
+    try:
+        transcoders, peaks = await asyncio.gather(asyncio.to_thread(history_store.top_transcoders, since),
+                                                  asyncio.to_thread(history_store.peak_concurrent, since))
+        message = "📜 *Historial de los últimos 7 días*\n\n"
+        message += "🔄 *Usuarios que más transcodifican:*\n"
+        if transcoders:
+            for user in transcoders:
+                message += f"  - {escape_markdown(user.username)}: {user.minutes:.0f} min en {user.sessions} reproducciones\n"
+        else:
+            message += "  - Nadie ha transcodificado vídeo\n"
+        message += "\n📈 *Máximo de reproducciones simultáneas:*\n"
+        names = {server.id: server.name for server in SERVERS}
+        for peak in peaks:
+            when = time.strftime('%d/%m %H:%M', time.localtime(peak.at))
+            message += f"  - {escape_markdown(names.get(peak.server_id, peak.server_id))}: {peak.streams} ({when})\n"
+        if not peaks:
+            message += "  - Todavía no hay datos\n"
+    except Exception as e:
+        logger.error(f"Error al consultar el historial: {str(e)}")
+        message = f"Error al consultar el historial: {str(e)}"
+    
+    reply_markup = HOME_MARKUP
+    await edit_message_with_image(update, context, message, reply_markup)
+
+async def show_route_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Comando /latencias: pulsaciones, errores y latencia de cada botón desde el arranque."""
+    if not is_authorized(update):
+        return
+    lines = [f"{name}: {stats.calls} pulsaciones, {stats.errors} errores, "
+             f"media {stats.average_time * 1000:.0f} ms, máx {stats.max_time * 1000:.0f} ms"
+             for name, stats in router.stats()] or ["Todavía no se ha pulsado ningún botón."]
+    dashboard = live_dashboard.stats
+    lines.append(f"\n📡 Panel en vivo: {dashboard.renders} recomposiciones, {dashboard.edits} ediciones, "
+                 f"{dashboard.skipped} sin cambios")
+    await outbox.send(context.bot.send_message, chat_id=update.effective_chat.id, text="⏱️ Latencia por botón:\n\n" + "\n".join(lines))
+
+def server_index_arg(value: str) -> int:
+    return server_by_id(value).index
+
+def scan_mode_arg(value: str) -> bool:
+    """'smart' para el escaneo inteligente, 'full' para el completo."""
+    if value not in ('smart', 'full'):
+        raise ValueError(f"Modo de escaneo desconocido: {value}")
+    return value == 'smart'
+
+def server_indices_arg(value: str) -> List[int]:
+    """'all' para todos los servidores o el id de uno solo."""
+    return [server.index for server in SERVERS] if value == 'all' else [server_index_arg(value)]
+
+router.add('main_menu', show_main_menu)
+router.add('page', show_page, str, int)
+router.add('help', show_help)
+router.add('view_servers', show_servers)
+router.add('current_streams', show_current_streams)
+router.add('multiple_streams', show_users_with_multiple_streams)
+router.add('transcoding_users', show_transcoding_users)
+router.add('shared_accounts', show_shared_accounts)
+router.add('history', show_history)
+router.add('live_on', start_live_dashboard)
+router.add('live_off', stop_live_dashboard)
+router.add('server', show_server_options, server_by_id)
+router.add('update', show_update_options, server_by_id)
+router.add('update_full', update_libraries, server_by_id)
+router.add('update_smart', update_libraries_smart, server_by_id)
+router.add('update_section', update_library_section, server_by_id, str)
+router.add('update_all', show_update_all_options)
+router.add('update_all_scan', update_all_libraries, scan_mode_arg)
+router.add('playing', view_playing, server_by_id)
+router.add('status', show_server_status, server_by_id)
+router.add('stats', show_library_stats, server_by_id)
+router.add('confirm_stop', show_stream_details, str)
+router.add('stop_stream', stop_user_stream, str)
+router.add('maintenance_mode', show_maintenance_options)
+router.add('maintenance', confirm_maintenance, server_indices_arg)
+router.add('confirm_maintenance', perform_maintenance, str)
+
+def server_rows(buttons: List[InlineKeyboardButton]) -> List[List[InlineKeyboardButton]]:
+    """Un botón por fila con pocos servidores; a dos columnas cuando la lista crece."""
+    columns = 2 if len(buttons) > 6 else 1
+    return [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
+
+# Teclados fijos: se construyen una sola vez al arrancar y se reutilizan en cada pulsación
+HOME_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]])
+TRANSCODING_BACK_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Volver a usuarios transcodificando", callback_data="transcoding_users")]])
+DASHBOARD_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("⏹️ Detener panel", callback_data="live_off")]])
+MULTIPLE_STREAMS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🕵️ Cuentas compartidas recientes", callback_data="shared_accounts")],
+    [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
+])
+MULTIPLE_STREAMS_BACK_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Volver a múltiples streams", callback_data="multiple_streams")],
+    [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
+])
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🖥️ Ver servidores", callback_data='view_servers')],
+    [InlineKeyboardButton("📊 Informe Streams", callback_data='current_streams')],
+    [InlineKeyboardButton("🔄 Actualizar todas las bibliotecas", callback_data='update_all')],
+    [InlineKeyboardButton("👥 Usuarios con múltiples streams", callback_data='multiple_streams')],
+    [InlineKeyboardButton("🔄 Usuarios transcodificando", callback_data='transcoding_users')],
+    [InlineKeyboardButton("📡 Panel en vivo", callback_data='live_on')],
+    [InlineKeyboardButton("📜 Historial", callback_data='history')],
+    [InlineKeyboardButton("🛠️ Modo Mantenimiento", callback_data='maintenance_mode')],
+    [InlineKeyboardButton("ℹ️ Obtener Ayuda", callback_data='help')]
+])
+SERVERS_MARKUP = InlineKeyboardMarkup(
+    server_rows([InlineKeyboardButton(f"🏙️ {server.name}", callback_data=router.data('server', server.id)) for server in SERVERS])
+    + [[InlineKeyboardButton("🔙 Volver al Menú Principal", callback_data="main_menu")]]
+)
+MAINTENANCE_MARKUP = InlineKeyboardMarkup(
+    server_rows([InlineKeyboardButton(f"🛠️ Mantenimiento {server.name}", callback_data=router.data('maintenance', server.id))
+                 for server in SERVERS])
+    + [[InlineKeyboardButton("🛠️ Mantenimiento General", callback_data=router.data('maintenance', 'all'))],
+       [InlineKeyboardButton("🔙 Volver al Menú Principal", callback_data="main_menu")]]
+)
+UPDATE_ALL_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Todas las secciones", callback_data=router.data('update_all_scan', 'full'))],
+    [InlineKeyboardButton("🧠 Solo lo que ha cambiado", callback_data=router.data('update_all_scan', 'smart'))],
+    [InlineKeyboardButton("🔙 Volver al Menú Principal", callback_data="main_menu")]
+])
+for server in SERVERS:
+    server.options_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Actualizar bibliotecas", callback_data=router.data('update', server.id))],
+        [InlineKeyboardButton("👀 Ver reproducciones", callback_data=router.data('playing', server.id))],
+        [InlineKeyboardButton("📊 Ver estado del servidor", callback_data=router.data('status', server.id))],
+        [InlineKeyboardButton("📚 Bibliotecas", callback_data=router.data('stats', server.id))],
+        [InlineKeyboardButton("🔙 Volver a Servidores", callback_data="view_servers")],
+        [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
+    ])
+    server.back_markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 Volver a Opciones del Servidor", callback_data=router.data('server', server.id))],
+        [InlineKeyboardButton("🏠 Volver al Menú Principal", callback_data="main_menu")]
+    ])
+
+async def report_violation(application: Application, chat_id: int, violation: Violation) -> None:
+    """Avisa al chat de administración de una infracción y, si está activado, detiene la sesión."""
+    session = violation.session
+    server = SERVERS[session.server_index]
+    message = (f"🚨 *Vigilante de transcodificación en {escape_markdown(server.name)}*\n\n"
+               f"👤 *Usuario:* {escape_markdown(session.username)}\n"
+               f"🎬 *Título:* {escape_markdown(session.full_title)}\n"
+               f"📱 *Dispositivo:* {escape_markdown(session.player_title)}\n"
+               f"⚠️ *Motivo:* {escape_markdown(', '.join(violation.reasons))}\n"
+               f"⏱️ *Desde hace:* {int((time.monotonic() - violation.since) // 60)} min\n\n")
+    reply_markup = None
+    if WATCHDOG_AUTO_STOP:
+        try:
+            await asyncio.to_thread(stop_session, session, TRANSCODE_MESSAGE)
+            message += "✅ Reproducción detenida automáticamente."
+        except Exception as e:
+            logger.error(f"El vigilante no pudo detener la sesión de {session.username}: {str(e)}")
+            message += f"❌ No se pudo detener la reproducción: {escape_markdown(str(e))}"
+    else:
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+            "🛑 Detener reproducción", callback_data=router.data('confirm_stop', action_store.stop_stream(session)))]])
+    await outbox.send(application.bot.send_message, chat_id=chat_id, text=message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def run_transcode_watchdog(application: Application) -> None:
+    """Revisa las sesiones cada WATCHDOG_INTERVAL segundos y avisa de las infracciones nuevas."""
+    chat_id = ALERT_CHAT_ID
+    while True:
+        await asyncio.sleep(WATCHDOG_INTERVAL)
+        try:
+            for violation in await asyncio.to_thread(transcode_watchdog.evaluate):
+                logger.info(f"Infracción de transcodificación: {violation.session.username} en "
+                            f"{SERVERS[violation.session.server_index].name} ({', '.join(violation.reasons)})")
+                await report_violation(application, chat_id, violation)
+        except Exception as e:
+            logger.error(f"Error en el vigilante de transcodificación: {str(e)}")
+
+async def report_sharing(application: Application, incident: SharingIncident) -> None:
+    message = (f"🕵️ *Posible cuenta compartida:* {escape_markdown(incident.username)}\n\n"
+               f"Reproduciendo a la vez desde {len(incident.ips)} IP diferentes:\n")
+    for sighting in incident.sightings:
+        message += (f"  - {escape_markdown(SERVERS[sighting.server_index].name)}: {sighting.ip} "
+                    f"({escape_markdown(sighting.device or 'Desconocido')}) - {escape_markdown(sighting.title)}\n")
+    await outbox.send(application.bot.send_message, chat_id=ALERT_CHAT_ID, text=message, parse_mode='Markdown')
+
+async def post_init(application: Application) -> None:
+    # Plex y Glances se consultan en hilos: con más hilos, un servidor lento no deja sin
+    # hueco a las pulsaciones de otros usuarios
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BOT_IO_THREADS, thread_name_prefix='bot-io')
+    )
+    if PLEX_HEALTHCHECK_INTERVAL > 0:
+        plex_pool.start_health_checks(PLEX_HEALTHCHECK_INTERVAL)
+    if HISTORY_SAMPLE_INTERVAL > 0:
+        history_store.start()
+    if PLEX_LIVE_SESSIONS:
+        live_sessions.start()
+    if METRICS_INTERVAL > 0:
+        metrics_poller.start()
+    if LIBRARY_STATS_INTERVAL > 0:
+        library_stats.start()
+    if WATCHDOG_INTERVAL > 0:
+        application.create_task(run_transcode_watchdog(application))
+    if SHARING_ALERTS:
+        # El índice se actualiza desde los hilos que consultan a Plex; el aviso se envía en el bucle del bot
+        loop = asyncio.get_running_loop()
+
+        def log_failure(future) -> None:
+            # Nadie espera este futuro: sin esto, un fallo al enviar el aviso se perdería sin dejar rastro
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"No se pudo avisar de una cuenta compartida: {str(future.exception())}")
+
+        def notify_sharing(incident: SharingIncident) -> None:
+            asyncio.run_coroutine_threadsafe(report_sharing(application, incident), loop).add_done_callback(log_failure)
+
+        sharing_index.on_incident = notify_sharing
+    # Deja descargándose el logo del informe para que la primera petición ya lo tenga
+    get_logo_base64()
+    logger.info("Bot iniciado y en ejecución")
 
 def main() -> None:
     logger.info("Iniciando el bot")
-    from config import PLEX_SERVERS, GLANCES_SERVERS
-    updater = Updater(TELEGRAM_BOT_TOKEN)
-    dp = updater.dispatcher
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .build()
+    )
 
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CallbackQueryHandler(button))
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("latencias", show_route_stats))
+    application.add_handler(CommandHandler("escanear", scan_path))
+    application.add_handler(CallbackQueryHandler(button))
 
     logger.info("Comenzando el polling")
-    updater.start_polling()
-    logger.info("Bot iniciado y en ejecución")
-    updater.idle()
+    application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -1,31 +1,201 @@
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _parse_bool(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'si', 'sí', 'on')
+
+
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Límites de envío a Telegram: mensajes por segundo en total y por chat privado (también las ediciones
+# en cualquier chat), mensajes nuevos por minuto en cada grupo, y reintentos cuando Telegram responde 429
+# (retry_after)
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_GROUP_RATE = float(os.getenv('TELEGRAM_GROUP_RATE', '20'))
+TELEGRAM_RETRIES = int(os.getenv('TELEGRAM_RETRIES', '2'))
+# Pulsaciones atendidas a la vez e hilos para las llamadas bloqueantes a Plex y Glances. Cada pulsación
+# ocupa como mucho un hilo, así que por defecto hay uno por pulsación y unos pocos más para las tareas de
+# fondo: con menos, las pulsaciones que esperan a un servidor lento acaparan los hilos y frenan al resto
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '64'))
+BOT_IO_THREADS = int(os.getenv('BOT_IO_THREADS', str(BOT_CONCURRENT_UPDATES + 8)))
+# Directorio donde el bot guarda su estado entre reinicios
+STATE_DIR = os.getenv('STATE_DIR', 'data')
 
-PLEX_SERVERS = [
-    {
-        'name': 'MiServidor1',
-        'url': os.getenv('PLEX_SERVER_1_URL'),
-        'token': os.getenv('PLEX_SERVER_1_TOKEN')
-    },
-    {
-        'name': 'MiServidor2',
-        'url': os.getenv('PLEX_SERVER_2_URL'),
-        'token': os.getenv('PLEX_SERVER_2_TOKEN')
-    }
-]
-
-GLANCES_SERVERS = [
-    {
-        'name': 'Arkham',
-        'url': os.getenv('GLANCES_SERVER_1_URL', 'http://192.168.1.100:61208'),
-    },
-    {
-        'name': 'Gotham',
-        'url': os.getenv('GLANCES_SERVER_2_URL', 'http://192.168.1.101:61208'),
+# Logo del informe HTML: fichero local (opcional) o URL que se descarga una vez y se guarda en STATE_DIR
+REPORT_LOGO_PATH = os.getenv('REPORT_LOGO_PATH')
+REPORT_LOGO_URL = os.getenv('REPORT_LOGO_URL', 'https://sincrack.com/loguito.png')
+
+# Tiempo máximo (segundos) de cada petición a Plex y espera antes de reintentar una conexión caída
+PLEX_TIMEOUT = int(os.getenv('PLEX_TIMEOUT', '10'))
+PLEX_RECONNECT_INTERVAL = int(os.getenv('PLEX_RECONNECT_INTERVAL', '30'))
+PLEX_HEALTHCHECK_INTERVAL = int(os.getenv('PLEX_HEALTHCHECK_INTERVAL', '60'))
+# Plazo máximo (segundos) que un informe espera a cada servidor al consultarlos en paralelo
+PLEX_FANOUT_DEADLINE = float(os.getenv('PLEX_FANOUT_DEADLINE', '15'))
+# Segundos durante los que se reutiliza la última lista de sesiones de cada servidor
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '5'))
+# Sesiones mantenidas con el websocket de notificaciones de Plex (sin consultar en cada vista) y
+# espera máxima (segundos) entre reintentos de conexión
+PLEX_LIVE_SESSIONS = _parse_bool(os.getenv('PLEX_LIVE_SESSIONS', 'true'))
+PLEX_LISTENER_BACKOFF_MAX = float(os.getenv('PLEX_LISTENER_BACKOFF_MAX', '300'))
+# El websocket manda un ping cada PLEX_LISTENER_PING_INTERVAL segundos y se da por caído si el pong no
+# llega en PLEX_LISTENER_PING_TIMEOUT (una conexión medio abierta no avisa de ninguna otra forma). Aun
+# conectado, las sesiones se recargan enteras cada PLEX_LIVE_RESYNC_INTERVAL segundos, y una instantánea
+# que pasa de PLEX_LIVE_MAX_AGE sin renovarse se vuelve a pedir a Plex aunque el servidor esté en vivo
+PLEX_LISTENER_PING_INTERVAL = float(os.getenv('PLEX_LISTENER_PING_INTERVAL', '30'))
+PLEX_LISTENER_PING_TIMEOUT = float(os.getenv('PLEX_LISTENER_PING_TIMEOUT', '10'))
+PLEX_LIVE_RESYNC_INTERVAL = float(os.getenv('PLEX_LIVE_RESYNC_INTERVAL', '300'))
+PLEX_LIVE_MAX_AGE = float(os.getenv('PLEX_LIVE_MAX_AGE', str(2 * PLEX_LIVE_RESYNC_INTERVAL)))
+
+GLANCES_TIMEOUT = float(os.getenv('GLANCES_TIMEOUT', '5'))
+
+# Fichero YAML opcional con la lista de servidores; si no se indica, se descubren las variables
+# PLEX_SERVER_N_* (N = 1, 2, 3...). Cada servidor Plex se enlaza con su Glances de forma
+# explícita: clave `glances_url` en el fichero o GLANCES_SERVER_N_URL con el mismo N. El `id`
+# de cada servidor (N, o la clave `id` del fichero) no cambia al añadir o reordenar servidores.
+# PLEX_SERVER_N_PATH_MAP (o `path_map`) traduce las rutas de Plex a las montadas en el bot para el
+# escaneo inteligente; sin él se asume que las rutas son las mismas.
+SERVERS_FILE = os.getenv('SERVERS_FILE')
+
+
+def _parse_path_map(value: str) -> dict:
+    """'/data=/mnt/arkham,/media=/mnt/media' -> {'/data': '/mnt/arkham', '/media': '/mnt/media'}"""
+    pairs = (item.split('=', 1) for item in value.split(',') if '=' in item)
+    return {plex_path.strip(): local_path.strip() for plex_path, local_path in pairs}
+
+
+def _server_from_env(number: int) -> dict:
+    prefix = f'PLEX_SERVER_{number}_'
+    return {
+        'id': str(number),
+        'name': os.getenv(prefix + 'NAME', f'MiServidor{number}'),
+        'url': os.getenv(prefix + 'URL'),
+        'token': os.getenv(prefix + 'TOKEN'),
+        'timeout': int(os.getenv(prefix + 'TIMEOUT', PLEX_TIMEOUT)),
+        'glances_url': os.getenv(prefix + 'GLANCES_URL') or os.getenv(f'GLANCES_SERVER_{number}_URL'),
+        'path_map': _parse_path_map(os.getenv(prefix + 'PATH_MAP', '')),
     }
-]
 
+
+def _servers_from_file(path: str) -> list:
+    import yaml  # solo hace falta si se usa SERVERS_FILE
+
+    with open(path, encoding='utf-8') as servers_file:
+        entries = yaml.safe_load(servers_file) or []
+    if isinstance(entries, dict):
+        entries = entries.get('servers', [])
+    servers = []
+    for number, entry in enumerate(entries, start=1):
+        servers.append({
+            'id': str(entry.get('id', number)),
+            'name': entry.get('name', f'MiServidor{number}'),
+            'url': entry['url'],
+            'token': entry.get('token'),
+            'timeout': int(entry.get('timeout', PLEX_TIMEOUT)),
+            'glances_url': entry.get('glances_url'),
+            'path_map': dict(entry.get('path_map') or {}),
+        })
+    return servers
+
+
+def load_plex_servers() -> list:
+    """Lista de servidores Plex configurados, en orden, cualquiera que sea su número."""
+    if SERVERS_FILE:
+        return _servers_from_file(SERVERS_FILE)
+    numbers = sorted(int(match.group(1)) for match in map(re.compile(r'PLEX_SERVER_(\d+)_URL$').match, os.environ)
+                     if match)
+    return [_server_from_env(number) for number in numbers]
+
+
+PLEX_SERVERS = load_plex_servers()
+
+# Muestreo en segundo plano de Glances y Plex: intervalo (s), muestras guardadas y ventana mostrada (min)
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', '30'))
+METRICS_HISTORY_SIZE = int(os.getenv('METRICS_HISTORY_SIZE', '2880'))
+METRICS_WINDOW_MINUTES = int(os.getenv('METRICS_WINDOW_MINUTES', '15'))
+
+# Escaneo de bibliotecas: cada cuántos segundos se consulta el progreso, cuánto se espera a que Plex
+# muestre el escaneo de una sección antes de darla por terminada (solo cuenta cuando el servidor ya no
+# tiene ningún escaneo en marcha ni en cola) y cuándo se deja de seguir
+LIBRARY_PROGRESS_INTERVAL = float(os.getenv('LIBRARY_PROGRESS_INTERVAL', '3'))
+LIBRARY_SCAN_GRACE = float(os.getenv('LIBRARY_SCAN_GRACE', '10'))
+LIBRARY_REFRESH_TIMEOUT = float(os.getenv('LIBRARY_REFRESH_TIMEOUT', '3600'))
+# Escaneo inteligente: por encima de este número de carpetas cambiadas se escanea la sección entera
+LIBRARY_SMART_MAX_PATHS = int(os.getenv('LIBRARY_SMART_MAX_PATHS', '20'))
+
+# Estadísticas de biblioteca: cada cuántos segundos se sincronizan, cada cuántos se descarga cada
+# sección entera (un borrado compensado por un elemento que Plex no marca como modificado no cambia
+# el recuento, así que solo así desaparece), elementos por página al descargarlas y cuántos
+# "añadidos recientemente" se muestran
+LIBRARY_STATS_INTERVAL = float(os.getenv('LIBRARY_STATS_INTERVAL', '900'))
+LIBRARY_STATS_FULL_SYNC_INTERVAL = float(os.getenv('LIBRARY_STATS_FULL_SYNC_INTERVAL', '86400'))
+LIBRARY_STATS_PAGE_SIZE = int(os.getenv('LIBRARY_STATS_PAGE_SIZE', '1000'))
+LIBRARY_STATS_RECENT = int(os.getenv('LIBRARY_STATS_RECENT', '5'))
+
+# Paradas masivas (mantenimiento): cuántas a la vez, reintentos ante fallos transitorios y espera inicial (s)
+STOP_PARALLELISM = int(os.getenv('STOP_PARALLELISM', '8'))
+STOP_RETRIES = int(os.getenv('STOP_RETRIES', '2'))
+STOP_RETRY_BACKOFF = float(os.getenv('STOP_RETRY_BACKOFF', '1'))
+# Cada cuántos segundos se actualiza el mensaje de progreso del mantenimiento
+MAINTENANCE_PROGRESS_INTERVAL = float(os.getenv('MAINTENANCE_PROGRESS_INTERVAL', '1.5'))
+
+
+def _parse_user_grace(value: str) -> dict:
+    """'alice=600,bob=0' -> {'alice': 600.0, 'bob': 0.0}"""
+    pairs = (item.split('=', 1) for item in value.split(',') if '=' in item)
+    return {user.strip(): float(seconds) for user, seconds in pairs}
+
+
+# Vigilante de transcodificaciones: cada cuántos segundos revisa las sesiones (0 lo desactiva)
+WATCHDOG_INTERVAL = float(os.getenv('WATCHDOG_INTERVAL', '60'))
+# Reglas: transcode de vídeo 4K, transcode que baja la resolución y CPU de Glances (%) a partir de la
+# cual cualquier transcode de vídeo cuenta como infracción (0 desactiva esta regla)
+WATCHDOG_4K_TRANSCODE = _parse_bool(os.getenv('WATCHDOG_4K_TRANSCODE', 'true'))
+WATCHDOG_DOWNGRADE = _parse_bool(os.getenv('WATCHDOG_DOWNGRADE', 'false'))
+WATCHDOG_CPU_THRESHOLD = float(os.getenv('WATCHDOG_CPU_THRESHOLD', '90'))
+# Segundos que un usuario puede incumplir las reglas antes de avisar; WATCHDOG_USER_GRACE ajusta
+# la gracia de usuarios concretos ('alice=600,bob=0')
+WATCHDOG_GRACE = float(os.getenv('WATCHDOG_GRACE', '120'))
+WATCHDOG_USER_GRACE = _parse_user_grace(os.getenv('WATCHDOG_USER_GRACE', ''))
+# Si se activa, además de avisar se detiene la reproducción con el mismo mensaje que el botón de detener
+WATCHDOG_AUTO_STOP = _parse_bool(os.getenv('WATCHDOG_AUTO_STOP', 'false'))
+# Chat al que llegan los avisos; por defecto el primero de los autorizados
+WATCHDOG_ALERT_CHAT_ID = os.getenv('WATCHDOG_ALERT_CHAT_ID')
+
+# Horas que se guardan las reproducciones por usuario para detectar cuentas compartidas y si se
+# avisa al chat de administración cuando un usuario reproduce a la vez desde varias IP
+SHARING_WINDOW_HOURS = float(os.getenv('SHARING_WINDOW_HOURS', '24'))
+SHARING_ALERTS = _parse_bool(os.getenv('SHARING_ALERTS', 'true'))
+# Segundos sin ver una reproducción en una instantánea de su servidor tras los que se da por terminada
+# (un servidor que deja de responder no publica instantáneas que la cierren)
+SHARING_STALE_AFTER = float(os.getenv('SHARING_STALE_AFTER', '600'))
+
+# Historial de reproducciones en SQLite: fichero, cada cuántos segundos se toma una muestra de las
+# sesiones de cada servidor (0 lo desactiva), cada cuántos segundos y en lotes de cuántas filas se
+# escribe, y días que se conservan (0 = siempre)
+HISTORY_DB = os.getenv('HISTORY_DB', os.path.join(STATE_DIR, 'history.db'))
+HISTORY_SAMPLE_INTERVAL = float(os.getenv('HISTORY_SAMPLE_INTERVAL', '60'))
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '10'))
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '5000'))
+HISTORY_RETENTION_DAYS = float(os.getenv('HISTORY_RETENTION_DAYS', '365'))
+
+# Panel en vivo: cada cuántos segundos se recompone y longitud máxima del texto (Telegram admite 4096)
+DASHBOARD_INTERVAL = float(os.getenv('DASHBOARD_INTERVAL', '15'))
+DASHBOARD_MAX_LENGTH = int(os.getenv('DASHBOARD_MAX_LENGTH', '3900'))
+
+# Trozos de mensaje por sesión que se guardan ya compuestos
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '4096'))
+
+# Listas paginadas: longitud máxima de cada página (Telegram admite 1024 caracteres en un pie de foto),
+# cuántas listas se guardan en memoria y durante cuántos segundos se puede pasar de página
+PAGE_CAPTION_LIMIT = int(os.getenv('PAGE_CAPTION_LIMIT', '1024'))
+PAGE_STORE_SIZE = int(os.getenv('PAGE_STORE_SIZE', '256'))
+PAGE_STORE_TTL = float(os.getenv('PAGE_STORE_TTL', '1800'))
+
+# Botones de confirmación (detener una reproducción, mantenimiento): cuántas acciones pendientes
+# se guardan en memoria y durante cuántos segundos se puede confirmar cada una
+ACTION_STORE_SIZE = int(os.getenv('ACTION_STORE_SIZE', '1024'))
+ACTION_STORE_TTL = float(os.getenv('ACTION_STORE_TTL', '3600'))
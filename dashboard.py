@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from config import DASHBOARD_INTERVAL
+from telegram_queue import outbox
+
+logger = logging.getLogger(__name__)
+
+# Función que compone el panel: texto y teclado (se ejecuta en un hilo, puede consultar a Plex)
+Renderer = Callable[[], Tuple[str, Optional[InlineKeyboardMarkup]]]
+
+
+def render_hash(text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> str:
+    markup = reply_markup.to_json() if reply_markup is not None else ''
+    return hashlib.sha1(f"{text}\0{markup}".encode('utf-8')).hexdigest()
+
+
+class DashboardStats:
+    __slots__ = ('renders', 'edits', 'skipped')
+
+    def __init__(self):
+        self.renders = 0
+        self.edits = 0
+        self.skipped = 0
+
+
+class LiveDashboard:
+    """Un mensaje fijado por chat que se vuelve a componer cada `interval` segundos.
+
+    Solo se llama a Telegram cuando cambia el hash del texto y el teclado, así
+    que mientras no pasa nada el panel no gasta ninguna llamada a la API.
+    """
+
+    def __init__(self, interval: float = DASHBOARD_INTERVAL):
+        self._interval = interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._messages: Dict[int, int] = {}
+        self.stats = DashboardStats()
+
+    def is_running(self, chat_id: int) -> bool:
+        return chat_id in self._tasks
+
+    async def _loop(self, bot: Bot, chat_id: int, message_id: int, render: Renderer, last_hash: str) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                text, reply_markup = await asyncio.to_thread(render)
+                self.stats.renders += 1
+                current = render_hash(text, reply_markup)
+                if current == last_hash:
+                    self.stats.skipped += 1
+                    continue
+                await outbox.edit(bot.edit_message_text, chat_id=chat_id, message_id=message_id,
+                                  text=text + time.strftime("\n\n_Actualizado a las %H:%M_"),
+                                  reply_markup=reply_markup, parse_mode='Markdown')
+                self.stats.edits += 1
+                last_hash = current
+            except BadRequest as e:
+                # El mensaje ya no existe o no se puede editar: el panel se da por terminado
+                logger.warning(f"Se detiene el panel en vivo del chat {chat_id}: {str(e)}")
+                self._tasks.pop(chat_id, None)
+                self._messages.pop(chat_id, None)
+                return
+            except Exception as e:
+                logger.error(f"Error al actualizar el panel en vivo del chat {chat_id}: {str(e)}")
+
+    async def start(self, bot: Bot, chat_id: int, render: Renderer) -> None:
+        """Envía y fija el panel del chat (sustituyendo al anterior si lo había) y lo mantiene al día."""
+        await self.stop(bot, chat_id)
+        text, reply_markup = await asyncio.to_thread(render)
+        message = await outbox.send(bot.send_message, chat_id=chat_id,
+                                    text=text + time.strftime("\n\n_Actualizado a las %H:%M_"),
+                                    reply_markup=reply_markup, parse_mode='Markdown')
+        try:
+            await outbox.send(bot.pin_chat_message, chat_id=chat_id, message_id=message.message_id,
+                              disable_notification=True)
+        except Exception as e:
+            logger.warning(f"No se pudo fijar el panel en vivo del chat {chat_id}: {str(e)}")
+        self._messages[chat_id] = message.message_id
+        self._tasks[chat_id] = asyncio.create_task(
+            self._loop(bot, chat_id, message.message_id, render, render_hash(text, reply_markup)))
+
+    async def stop(self, bot: Bot, chat_id: int) -> bool:
+        """Detiene el panel del chat y lo desfija; False si no había ninguno."""
+        task = self._tasks.pop(chat_id, None)
+        message_id = self._messages.pop(chat_id, None)
+        if task is None:
+            return False
+        task.cancel()
+        try:
+            await outbox.send(bot.unpin_chat_message, chat_id=chat_id, message_id=message_id)
+        except Exception as e:
+            logger.warning(f"No se pudo desfijar el panel en vivo del chat {chat_id}: {str(e)}")
+        return True
+
+
+live_dashboard = LiveDashboard()
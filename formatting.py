@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from config import RENDER_CACHE_SIZE
+from servers import SERVERS
+from sessions import SessionRecord
+
+# Caracteres de Markdown que hay que escapar, como tabla para str.translate
+_MARKDOWN_ESCAPES = str.maketrans({char: f'\\{char}' for char in '_*[]()~`>#+-='})
+
+
+def escape_markdown(text) -> str:
+    """
+    Escapa solo los caracteres especiales de Markdown necesarios en el texto.
+    """
+    return str(text).translate(_MARKDOWN_ESCAPES)
+
+
+class FragmentCache:
+    """Caché LRU de trozos de mensaje ya compuestos, con tamaño máximo."""
+
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE):
+        self._maxsize = maxsize
+        self._entries: 'OrderedDict[Hashable, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, build: Callable[[], str]) -> str:
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+        fragment = build()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = fragment
+            if len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return fragment
+
+
+fragment_cache = FragmentCache()
+
+
+def _session_key(session: SessionRecord, variant: str) -> tuple:
+    # Todos los campos que muestra algún fragmento: si cambia el reproductor o la decisión de transcode
+    # con la misma clave de sesión, el texto guardado ya no vale. El progreso solo se muestra en
+    # minutos, así que dentro del mismo minuto el texto no cambia
+    transcodes = tuple(tuple(sorted(transcode.items())) for transcode in session.transcodes or ())
+    return (variant, session.server_index, session.session_key, session.username, session.media_type,
+            session.grandparent_title, session.title, session.progress_minutes, session.player_title,
+            session.player_address, session.transcode_video, session.transcode_audio, transcodes)
+
+
+def _build_session_block(session: SessionRecord) -> str:
+    block = f"👤 *Usuario:* {escape_markdown(session.username)}\n"
+    if session.media_type == 'episode':
+        block += f"🎥 *Serie:* {escape_markdown(session.grandparent_title)}\n"
+        block += f"📺 *Episodio:* {escape_markdown(session.title)}\n"
+    else:
+        block += f"🎥 *Título:* {escape_markdown(session.title)}\n"
+    block += f"📺 *Tipo:* {escape_markdown(session.type_label)}\n"
+    block += f"⏳ *Progreso:* {session.progress_minutes} minutos\n"
+    block += f"🖥️ *Reproductor:* {escape_markdown(session.player_title)}\n"
+    return block
+
+
+def session_block(session: SessionRecord) -> str:
+    """Usuario, título, tipo, progreso y reproductor de una sesión (las mismas líneas en todas las vistas)."""
+    return fragment_cache.get(_session_key(session, 'block'), lambda: _build_session_block(session))
+
+
+def transcode_summary(session: SessionRecord) -> str:
+    """'🔄 *Transcodificando:* Video y Audio' o cadena vacía si no transcodifica."""
+    kinds = [kind for kind, active in (('Video', session.transcode_video), ('Audio', session.transcode_audio)) if active]
+    return f"🔄 *Transcodificando:* {' y '.join(kinds)}\n" if kinds else ""
+
+
+def _build_transcode_details(session: SessionRecord) -> str:
+    if not session.transcodes:
+        return "*No se está realizando transcodificación para este stream.*\n\n"
+    details = "*Detalles de Transcodificación:*\n"
+    for transcode in session.transcodes:
+        transcode_types = []
+        if transcode['video_decision'] == 'transcode':
+            transcode_types.append("Video")
+        if transcode['audio_decision'] == 'transcode':
+            transcode_types.append("Audio")
+        details += f"🔄 *Tipo de Transcode:* {' y '.join(transcode_types)}\n"
+
+        if transcode['video_decision'] == 'transcode':
+            details += f"🎞️ *Formato de Video Original:* {transcode['source_video_codec'] or 'No disponible'}\n"
+            details += f"🎞️ *Formato de Video Transcode:* {transcode['video_codec'] or 'No disponible'}\n"
+            if transcode['source_video_resolution']:
+                details += f"📊 *Resolución Original:* {transcode['source_video_resolution']}\n"
+            if transcode['video_resolution']:
+                details += f"📊 *Resolución Transcode:* {transcode['video_resolution']}\n"
+
+        if transcode['audio_decision'] == 'transcode':
+            details += f"🔊 *Formato de Audio Original:* {transcode['source_audio_codec'] or 'No disponible'}\n"
+            details += f"🔊 *Formato de Audio Transcode:* {transcode['audio_codec'] or 'No disponible'}\n"
+            details += f"🔉 *Canales de Audio Original:* {transcode['source_audio_channels'] or 'No disponible'}\n"
+            details += f"🔉 *Canales de Audio Transcode:* {transcode['audio_channels'] or 'No disponible'}\n"
+
+        details += f"⚙️ *Razón del Transcode:* {escape_markdown(transcode['transcode_reason'] or 'No disponible')}\n\n"
+    return details
+
+
+def transcode_details(session: SessionRecord) -> str:
+    """Códecs, resoluciones, canales y motivo de cada transcode de la sesión."""
+    return fragment_cache.get(_session_key(session, 'transcode'), lambda: _build_transcode_details(session))
+
+
+def stream_origin(session: SessionRecord) -> str:
+    """Servidor, IP y contenido de una reproducción, para comparar las de un mismo usuario."""
+    def build():
+        return (f"  - *Servidor:* {escape_markdown(SERVERS[session.server_index].name)}\n"
+                f"    *IP:* {session.player_address}\n"
+                f"    *Contenido:* {escape_markdown(session.title)} ({session.type_label})\n")
+    return fragment_cache.get(_session_key(session, 'origin'), build)
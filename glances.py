@@ -0,0 +1,111 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from config import GLANCES_TIMEOUT, PLEX_SERVERS
+
+logger = logging.getLogger(__name__)
+
+GLANCES_PLUGINS = ('cpu', 'mem', 'ip', 'uptime')
+GLANCES_API_VERSIONS = (3, 4)
+
+_session = requests.Session()
+_session.mount('http://', HTTPAdapter(pool_connections=max(32, len(PLEX_SERVERS)), pool_maxsize=len(GLANCES_PLUGINS)))
+_session.mount('https://', HTTPAdapter(pool_connections=max(32, len(PLEX_SERVERS)), pool_maxsize=len(GLANCES_PLUGINS)))
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='glances')
+
+# Versión de la API detectada en cada host, para no repetir el sondeo v3 -> v4
+_api_versions: Dict[str, int] = {}
+
+
+def _fetch_plugins(url: str, version: int) -> Dict[str, requests.Response]:
+    """Pide todos los plugins a la vez; la latencia total es la de la petición más lenta."""
+    futures = {
+        plugin: _executor.submit(_session.get, f"{url}/api/{version}/{plugin}", timeout=GLANCES_TIMEOUT)
+        for plugin in GLANCES_PLUGINS
+    }
+    return {plugin: future.result() for plugin, future in futures.items()}
+
+
+def _fetch_responses(url: str) -> Dict[str, requests.Response]:
+    known_version = _api_versions.get(url)
+    versions = [known_version] if known_version else []
+    versions += [v for v in GLANCES_API_VERSIONS if v != known_version]
+
+    for version in versions:
+        responses = _fetch_plugins(url, version)
+        if any(response.status_code == 404 for response in responses.values()):
+            # Esta versión de la API no existe en el host, probamos la siguiente
+            _api_versions.pop(url, None)
+            continue
+        if known_version != version:
+            logger.info(f"Glances en {url} usa la API v{version}")
+        _api_versions[url] = version
+        return responses
+    return responses
+
+
+def fetch_glances_stats(url: str) -> dict:
+    """Obtiene CPU, RAM, IPs y tiempo de actividad de Glances.
+
+    Lanza requests.RequestException si el host no responde y ValueError si la
+    respuesta no tiene un formato reconocido o algún plugin devuelve error.
+    """
+    responses = _fetch_responses(url)
+    if any(response.status_code != 200 for response in responses.values()):
+        codes = ', '.join(f"{plugin}: {response.status_code}" for plugin, response in responses.items())
+        raise ValueError(f"Códigos de estado - {codes}")
+
+    cpu_data = responses['cpu'].json()
+    mem_data = responses['mem'].json()
+    ip_data = responses['ip'].json()
+    uptime_data = responses['uptime'].json()
+
+    # Manejo de diferentes estructuras de datos para CPU
+    if 'total' in cpu_data:
+        cpu_usage = cpu_data['total']
+    elif isinstance(cpu_data, list) and len(cpu_data) > 0 and 'total' in cpu_data[0]:
+        cpu_usage = cpu_data[0]['total']
+    else:
+        raise ValueError("Estructura de datos de CPU no reconocida")
+
+    # Manejo de diferentes estructuras de datos para memoria
+    if 'used' in mem_data and 'total' in mem_data:
+        mem_usage = (mem_data['used'] / mem_data['total']) * 100
+    elif isinstance(mem_data, list) and len(mem_data) > 0 and 'used' in mem_data[0] and 'total' in mem_data[0]:
+        mem_usage = (mem_data[0]['used'] / mem_data[0]['total']) * 100
+    else:
+        raise ValueError("Estructura de datos de memoria no reconocida")
+
+    # Manejo de diferentes estructuras de datos para uptime
+    if isinstance(uptime_data, str):
+        uptime = uptime_data
+    elif isinstance(uptime_data, dict) and 'uptime' in uptime_data:
+        uptime = uptime_data['uptime']
+    elif isinstance(uptime_data, list) and len(uptime_data) > 0:
+        uptime = uptime_data[0] if isinstance(uptime_data[0], str) else uptime_data[0].get('uptime', 'No disponible')
+    else:
+        uptime = 'No disponible'
+
+    return {
+        'cpu': cpu_usage,
+        'mem': mem_usage,
+        'public_ip': ip_data.get('public_address', 'No disponible'),
+        'private_ip': ip_data.get('address', 'No disponible'),
+        'uptime': uptime,
+    }
+
+
+def get_glances_data(url: str) -> str:
+    """Resumen de Glances en texto, una línea por dato, o un mensaje que empieza por "Error"."""
+    try:
+        stats = fetch_glances_stats(url)
+    except requests.RequestException as e:
+        return f"Error al conectar con Glances: {str(e)}"
+    except ValueError as e:
+        return f"Error al procesar datos de Glances: {str(e)}"
+    return (f"Uso de CPU: {stats['cpu']:.1f}%\nUso de RAM: {stats['mem']:.1f}%\n"
+            f"IP Pública: {stats['public_ip']}\nIP Privada: {stats['private_ip']}\n"
+            f"Tiempo de actividad: {stats['uptime']}")
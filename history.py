@@ -0,0 +1,163 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+from config import (HISTORY_DB, HISTORY_SAMPLE_INTERVAL, HISTORY_FLUSH_INTERVAL, HISTORY_BATCH_SIZE,
+                    HISTORY_RETENTION_DAYS)
+from servers import SERVERS, Server
+from sessions import session_cache, SessionRecord
+
+logger = logging.getLogger(__name__)
+
+# Una fila por sesión activa en cada muestra: `ts` es el instante de la muestra, así que las filas
+# con el mismo (server_id, ts) son las reproducciones simultáneas de ese momento
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playback (
+    ts INTEGER NOT NULL,
+    server_id TEXT NOT NULL,
+    session_key TEXT NOT NULL,
+    username TEXT NOT NULL,
+    title TEXT,
+    transcode_video INTEGER NOT NULL,
+    transcode_audio INTEGER NOT NULL,
+    bitrate INTEGER,
+    player TEXT,
+    ip TEXT,
+    duration INTEGER,
+    view_offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS playback_ts ON playback (ts);
+CREATE INDEX IF NOT EXISTS playback_user_ts ON playback (username, ts);
+CREATE INDEX IF NOT EXISTS playback_server_ts ON playback (server_id, ts);
+"""
+
+Row = Tuple[int, str, str, str, Optional[str], int, int, Optional[int], Optional[str], Optional[str], int, int]
+
+
+class UserTotal(NamedTuple):
+    username: str
+    sessions: int
+    minutes: float
+
+
+class ServerPeak(NamedTuple):
+    server_id: str
+    streams: int
+    at: int
+
+
+class HistoryStore:
+    """Historial de reproducciones en SQLite (modo WAL) dentro de STATE_DIR.
+
+    Se alimenta de las instantáneas de session_cache, tomando como mucho una
+    muestra por servidor cada `sample_interval` segundos. Las filas se
+    acumulan en una cola y un único hilo escritor las guarda por lotes en una
+    transacción; las consultas abren su propia conexión de lectura, que en
+    modo WAL no espera al escritor.
+    """
+
+    def __init__(self, servers: List[Server], path: str = HISTORY_DB,
+                 sample_interval: float = HISTORY_SAMPLE_INTERVAL, flush_interval: float = HISTORY_FLUSH_INTERVAL,
+                 batch_size: int = HISTORY_BATCH_SIZE, retention_days: float = HISTORY_RETENTION_DAYS):
+        self._servers = servers
+        self._path = path
+        self._sample_interval = sample_interval
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._retention = retention_days * 86400
+        self._last_sample = [0.0] * len(servers)
+        self._queue: "queue.Queue[Row]" = queue.Queue()
+        self._started = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def observe(self, index: int, sessions: List[SessionRecord]) -> None:
+        """Encola una muestra de las sesiones del servidor si ya toca."""
+        if not self._started:
+            return
+        now = time.time()
+        if now - self._last_sample[index] < self._sample_interval:
+            return
+        self._last_sample[index] = now
+        ts = int(now)
+        server_id = self._servers[index].id
+        for session in sessions:
+            self._queue.put((ts, server_id, session.session_key, session.username, session.full_title,
+                             int(bool(session.transcode_video)), int(bool(session.transcode_audio)),
+                             session.bitrate, session.player_title, session.player_address,
+                             session.duration or 0, session.view_offset or 0))
+
+    def _drain(self, first: Row) -> List[Row]:
+        rows = [first]
+        while len(rows) < self._batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _writer(self) -> None:
+        connection = self._connect()
+        last_prune = 0.0
+        while True:
+            try:
+                rows = self._drain(self._queue.get())
+                with connection:
+                    connection.executemany('INSERT INTO playback VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                if self._retention and time.time() - last_prune > 86400:
+                    last_prune = time.time()
+                    with connection:
+                        connection.execute('DELETE FROM playback WHERE ts < ?', (int(time.time() - self._retention),))
+            except Exception as e:
+                logger.error(f"Error al guardar el historial de reproducciones: {str(e)}")
+            # Esperar agrupa en la siguiente transacción las filas que lleguen mientras tanto
+            time.sleep(self._flush_interval)
+
+    def start(self) -> threading.Thread:
+        """Crea la base de datos si hace falta y lanza el hilo escritor."""
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        connection = self._connect()
+        with connection:
+            connection.executescript(SCHEMA)
+        connection.close()
+        self._started = True
+        thread = threading.Thread(target=self._writer, name='history-writer', daemon=True)
+        thread.start()
+        return thread
+
+    def top_transcoders(self, since: float, limit: int = 10) -> List[UserTotal]:
+        """Usuarios con más tiempo transcodificando vídeo desde `since` (minutos aproximados por muestreo)."""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT username, COUNT(DISTINCT server_id || ':' || session_key), COUNT(*) FROM playback "
+                'WHERE ts >= ? AND transcode_video = 1 GROUP BY username ORDER BY COUNT(*) DESC LIMIT ?',
+                (int(since), limit)).fetchall()
+        finally:
+            connection.close()
+        return [UserTotal(username, sessions, samples * self._sample_interval / 60) for username, sessions, samples in rows]
+
+    def peak_concurrent(self, since: float) -> List[ServerPeak]:
+        """Máximo de reproducciones simultáneas de cada servidor desde `since` y cuándo se alcanzó."""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT server_id, MAX(streams), ts FROM '
+                '(SELECT server_id, ts, COUNT(*) AS streams FROM playback WHERE ts >= ? GROUP BY server_id, ts) '
+                'GROUP BY server_id',
+                (int(since),)).fetchall()
+        finally:
+            connection.close()
+        return [ServerPeak(server_id, streams, ts) for server_id, streams, ts in rows]
+
+
+history_store = HistoryStore(SERVERS)
+session_cache.subscribe(history_store.observe)
@@ -1,27 +1,78 @@
 import base64
+import io
+import logging
+import os
+import re
+import threading
+import time
 import requests
+from html import escape
 from datetime import datetime
+from typing import List, Optional
+from config import REPORT_LOGO_PATH, REPORT_LOGO_URL, STATE_DIR
 
-def get_image_as_base64(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return base64.b64encode(response.content).decode('utf-8')
-    return None
+logger = logging.getLogger(__name__)
 
-def generate_streams_html(streams_data):
-    # Obtener la imagen como base64
-    image_url = "https://sincrack.com/loguito.png"
-    image_base64 = get_image_as_base64(image_url)
-    
-    html_content = f"""
-    <!DOCTYPE html>
+LOGO_CACHE_PATH = os.path.join(STATE_DIR, 'report_logo.png')
+LOGO_DOWNLOAD_TIMEOUT = 10
+LOGO_RETRY_INTERVAL = 300
+
+# Logo en base64 compartido por todos los informes del proceso
+_logo_base64: Optional[str] = None
+_logo_lock = threading.Lock()
+_logo_download_at: Optional[float] = None
+
+def _read_base64(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as image:
+            return base64.b64encode(image.read()).decode('utf-8')
+    except OSError:
+        return None
+
+def _download_logo() -> None:
+    global _logo_base64
+    try:
+        response = requests.get(REPORT_LOGO_URL, timeout=LOGO_DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.warning(f"No se pudo descargar el logo del informe: {str(e)}")
+        return
+    _logo_base64 = base64.b64encode(response.content).decode('utf-8')
+    try:
+        os.makedirs(os.path.dirname(LOGO_CACHE_PATH) or '.', exist_ok=True)
+        with open(LOGO_CACHE_PATH, 'wb') as image:
+            image.write(response.content)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el logo del informe: {str(e)}")
+
+def get_logo_base64() -> Optional[str]:
+    """Logo del informe en base64 sin tocar la red en el camino de la petición.
+
+    Orden: caché del proceso, fichero local configurado, copia en disco de una
+    descarga anterior. Si no hay ninguno, la descarga se lanza en segundo
+    plano y este informe sale sin logo.
+    """
+    global _logo_base64, _logo_download_at
+    if _logo_base64 is not None:
+        return _logo_base64
+    with _logo_lock:
+        if _logo_base64 is None:
+            _logo_base64 = (REPORT_LOGO_PATH and _read_base64(REPORT_LOGO_PATH)) or _read_base64(LOGO_CACHE_PATH)
+        retry_due = _logo_download_at is None or time.monotonic() - _logo_download_at > LOGO_RETRY_INTERVAL
+        if _logo_base64 is None and REPORT_LOGO_URL and retry_due:
+            _logo_download_at = time.monotonic()
+            threading.Thread(target=_download_logo, name='report-logo', daemon=True).start()
+    return _logo_base64
+
+# Cabecera estática (HTML + CSS) del informe, compilada una sola vez al importar el módulo
+_REPORT_HEAD = """    <!DOCTYPE html>
     <html lang="es">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>Streams en los servidores</title>
         <style>
-            body {{
+            body {
                 font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
                 line-height: 1.4;
                 color: #333;
@@ -29,104 +80,108 @@ def generate_streams_html(streams_data):
                 margin: 0 auto;
                 padding: 20px;
                 background-color: #f0f8ff;
-            }}
-            .header {{
+            }
+            .header {
                 text-align: center;
                 margin-bottom: 20px;
-            }}
-            .header img {{
+            }
+            .header img {
                 max-width: 200px;
                 height: auto;
-            }}
-            .stats-container {{
+            }
+            .stats-container {
                 display: flex;
                 justify-content: center;
                 gap: 20px;
                 margin: 20px 0;
                 flex-wrap: wrap;
-            }}
-            .stat-box {{
+            }
+            .stat-box {
                 background-color: #ffffff;
                 border-radius: 8px;
                 padding: 15px;
                 min-width: 200px;
                 box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
                 text-align: center;
-            }}
-            .stat-box h3 {{
+            }
+            .stat-box h3 {
                 margin: 0;
                 color: #0056b3;
                 font-size: 0.9em;
                 text-transform: uppercase;
-            }}
-            .stat-box p {{
+            }
+            .stat-box p {
                 margin: 10px 0 0 0;
                 font-size: 1.5em;
                 font-weight: bold;
                 color: #003366;
-            }}
-            .server-stats {{
+            }
+            .server-stats {
                 display: flex;
                 gap: 10px;
                 margin-top: 5px;
                 font-size: 0.8em;
                 justify-content: center;
-            }}
-            h1 {{
+            }
+            h1 {
                 color: #0056b3;
                 text-align: center;
                 margin: 10px 0;
-            }}
-            .server {{
+            }
+            .server {
                 background-color: #ffffff;
                 border-radius: 10px;
                 padding: 15px;
                 margin-bottom: 20px;
                 box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            }}
-            .server h2 {{
+            }
+            .server h2 {
                 color: #0056b3;
                 margin: 0 0 10px 0;
                 border-bottom: 2px solid #0056b3;
                 padding-bottom: 5px;
-            }}
-            .stream {{
+            }
+            .stream {
                 background-color: #e6f2ff;
                 border: 1px solid #b3d9ff;
                 border-radius: 5px;
                 padding: 10px;
                 margin-bottom: 10px;
-            }}
-            .stream h3 {{
+            }
+            .stream h3 {
                 color: #003366;
                 margin: 0 0 5px 0;
-            }}
-            .stream p {{
+            }
+            .stream p {
                 margin: 3px 0;
-            }}
-            .transcoding-details {{
+            }
+            .transcoding-details {
                 margin-top: 20px;
                 background-color: #003366;
                 color: white;
                 padding: 15px;
                 border-radius: 5px;
-            }}
-            .transcoding-stream {{
+            }
+            .transcoding-stream {
                 background-color: rgba(255, 255, 255, 0.1);
                 border-radius: 5px;
                 padding: 10px;
                 margin-top: 10px;
-            }}
-            .transcoding-stream p {{
+            }
+            .transcoding-stream p {
                 margin: 3px 0;
-            }}
-            .timestamp {{
+            }
+            .error {
+                color: #b30000;
+                font-weight: bold;
+            }
+            .timestamp {
                 text-align: center;
                 font-style: italic;
                 margin: 10px 0;
                 color: #666;
-            }}
-            .footer {{
+            }
+            .footer {
                 text-align: center;
                 margin-top: 30px;
                 padding: 20px;
@@ -134,141 +189,153 @@ def generate_streams_html(streams_data):
                 color: white;
                 border-radius: 5px;
                 font-size: 0.9em;
-            }}
-            .footer p {{
+            }
+            .footer p {
                 margin: 5px 0;
-            }}
-            @media (max-width: 600px) {{
-                body {{
+            }
+            @media (max-width: 600px) {
+                body {
                     padding: 10px;
-                }}
-                .server {{
+                }
+                .server {
                     padding: 10px;
-                }}
-                .stat-box {{
+                }
+                .stat-box {
                     min-width: 150px;
-                }}
-            }}
+                }
+            }
         </style>
     </head>
     <body>
         <div class="header">
-            <img src="data:image/png;base64,{image_base64}" alt="SinCracK Cloud Logo">
+"""
+
+_REPORT_FOOTER = """
+        <div class="footer">
+            <p>Desarrollado por SinCracK</p>
+            <p>© 2025 SinCracK. Todos los derechos reservados.</p>
         </div>
-    """
+    </body>
+    </html>
+"""
+
+# Cabecera con el logo ya incrustado; se recalcula solo si cambia el logo
+_head_cache = (None, _REPORT_HEAD + "        </div>\n")
+
+def _report_head() -> str:
+    global _head_cache
+    image_base64 = get_logo_base64()
+    if _head_cache[0] != image_base64:
+        logo_html = f'            <img src="data:image/png;base64,{image_base64}" alt="SinCracK Cloud Logo">\n'
+        _head_cache = (image_base64, _REPORT_HEAD + logo_html + "        </div>\n")
+    return _head_cache[1]
+
+_needs_escape = re.compile('[&<>"\']').search
+
+def _escape(value) -> str:
+    """html.escape solo cuando hace falta: la mayoría de títulos y usuarios no tienen nada que escapar."""
+    value = str(value)
+    return escape(value) if _needs_escape(value) else value
+
+def _render_stream(session: dict) -> str:
+    return f"""
+                <div class="stream">
+                    <h3>{_escape(session['title'])}</h3>
+                    <p><strong>Usuario:</strong> {_escape(session['username'])}</p>
+                    <p><strong>Tipo:</strong> {_escape(session['type'])}</p>
+                    <p><strong>Progreso:</strong> {session['progress']} minutos</p>
+                    <p><strong>Reproductor:</strong> {_escape(session['player'])}</p>
+                    <p><strong>Transcodificando:</strong> {'Sí' if session['transcoding'] else 'No'}</p>
+                </div>
+"""
+
+def _render_transcoding_stream(server_name: str, session: dict) -> str:
+    return f"""
+            <div class="transcoding-stream">
+                <h3 style="color: white; margin: 0 0 5px 0;">{_escape(session['title'])}</h3>
+                <p><strong>Servidor:</strong> {server_name}</p>
+                <p><strong>Usuario:</strong> {_escape(session['username'])}</p>
+                <p><strong>Tipo:</strong> {_escape(session['type'])}</p>
+                <p><strong>Progreso:</strong> {session['progress']} minutos</p>
+                <p><strong>Reproductor:</strong> {_escape(session['player'])}</p>
+            </div>
+"""
+
+def render_streams_fragments(streams_data) -> List[str]:
+    """Fragmentos del informe en orden; el coste es lineal en el número de sesiones."""
+    parts = [_report_head()]
 
     # Calcular estadísticas por servidor
     total_users = 0
     total_transcoding = 0
     server_stats = {}
-
     for server_name, server_data in streams_data.items():
-        server_users = len(server_data['sessions'])
-        server_transcoding = sum(1 for session in server_data['sessions'] if session['transcoding'])
-        server_stats[server_name] = {
-            'users': server_users,
-            'transcoding': server_transcoding
-        }
+        sessions = server_data.get('sessions', [])
+        server_users = len(sessions)
+        server_transcoding = sum(1 for session in sessions if session['transcoding'])
+        server_stats[_escape(server_name)] = (server_users, server_transcoding)
         total_users += server_users
         total_transcoding += server_transcoding
 
-    # Añadir cajas de estadísticas
-    html_content += """
+    # Cajas de estadísticas: usuarios y transcodificaciones
+    parts.append(f"""
         <div class="stats-container">
-    """
-    
-    # Caja de total de streams
-    html_content += f"""
             <div class="stat-box">
                 <h3>Usuarios</h3>
                 <p>{total_users}</p>
                 <div class="server-stats">
-    """
-    for server_name, stats in server_stats.items():
-        html_content += f"<span>{server_name}: {stats['users']}</span>"
-    html_content += """
+""")
+    parts.extend(f"<span>{name}: {users}</span>" for name, (users, _) in server_stats.items())
+    parts.append(f"""
                 </div>
             </div>
-    """
-
-    # Caja de transcodificación
-    html_content += f"""
             <div class="stat-box">
                 <h3>Transcodes</h3>
                 <p>{total_transcoding}</p>
                 <div class="server-stats">
-    """
-    for server_name, stats in server_stats.items():
-        html_content += f"<span>{server_name}: {stats['transcoding']}</span>"
-    html_content += """
+""")
+    parts.extend(f"<span>{name}: {transcoding}</span>" for name, (_, transcoding) in server_stats.items())
+    parts.append(f"""
                 </div>
             </div>
         </div>
-    """
-
-    html_content += """
         <h1>DETALLES</h1>
-        <div class="timestamp">Generado el: """ + datetime.now().strftime('%Y-%m-%d %H:%M:%S') + """</div>
-    """
+        <div class="timestamp">Generado el: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>
+""")
 
     transcoding_streams = []
-
     for server_name, server_data in streams_data.items():
-        html_content += f"""
+        server_name = _escape(server_name)
+        parts.append(f"""
         <div class="server">
             <h2>Servidor: {server_name}</h2>
-        """
-
-        if server_data['sessions']:
-            for session in server_data['sessions']:
-                html_content += f"""
-                <div class="stream">
-                    <h3>{session['title']}</h3>
-                    <p><strong>Usuario:</strong> {session['username']}</p>
-                    <p><strong>Tipo:</strong> {session['type']}</p>
-                    <p><strong>Progreso:</strong> {session['progress']} minutos</p>
-                    <p><strong>Reproductor:</strong> {session['player']}</p>
-                    <p><strong>Transcodificando:</strong> {'Sí' if session['transcoding'] else 'No'}</p>
-                </div>
-                """
-                if session['transcoding']:
-                    transcoding_streams.append({
-                        'server': server_name,
-                        'session': session
-                    })
+""")
+        if 'error' in server_data:
+            parts.append(f"<p class=\"error\">No se pudo consultar el servidor: {escape(server_data['error'])}</p>")
+        elif server_data['sessions']:
+            parts.extend(map(_render_stream, server_data['sessions']))
+            transcoding_streams.extend((server_name, session) for session in server_data['sessions'] if session['transcoding'])
         else:
-            html_content += "<p>No hay reproducciones activas.</p>"
-
-        html_content += "</div>"
-
+            parts.append("<p>No hay reproducciones activas.</p>")
+        parts.append("</div>")
 
     if transcoding_streams:
-        html_content += """
+        parts.append("""
         <div class="transcoding-details">
             <h2 style="color: white; margin: 0 0 10px 0;">Usuarios Transcodificando</h2>
-        """
-        for stream in transcoding_streams:
-            html_content += f"""
-            <div class="transcoding-stream">
-                <h3 style="color: white; margin: 0 0 5px 0;">{stream['session']['title']}</h3>
-                <p><strong>Servidor:</strong> {stream['server']}</p>
-                <p><strong>Usuario:</strong> {stream['session']['username']}</p>
-                <p><strong>Tipo:</strong> {stream['session']['type']}</p>
-                <p><strong>Progreso:</strong> {stream['session']['progress']} minutos</p>
-                <p><strong>Reproductor:</strong> {stream['session']['player']}</p>
-            </div>
-            """
-        html_content += "</div>"
+""")
+        parts.extend(_render_transcoding_stream(server_name, session) for server_name, session in transcoding_streams)
+        parts.append("</div>")
 
     # Añadir el pie de página con el mensaje de copyright
-    html_content += """
-        <div class="footer">
-            <p>Desarrollado por SinCracK</p>
-            <p>© 2025 SinCracK. Todos los derechos reservados.</p>
-        </div>
-    </body>
-    </html>
-    """
+    parts.append(_REPORT_FOOTER)
+    return parts
 
-    return html_content
+def generate_streams_html(streams_data) -> str:
+    return ''.join(render_streams_fragments(streams_data))
 
+def render_streams_report(streams_data) -> io.BytesIO:
+    """Informe listo para send_document, en memoria y sin pasar por disco."""
+    buffer = io.BytesIO(generate_streams_html(streams_data).encode('utf-8'))
+    buffer.name = 'streams_actuales.html'
+    return buffer
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from config import LIBRARY_SCAN_GRACE, LIBRARY_REFRESH_TIMEOUT
+from plex_pool import plex_pool
+from scan_index import scan_index
+from servers import SERVERS
+
+logger = logging.getLogger(__name__)
+
+# Peticiones de escaneo de las secciones; va aparte del pool de plex_pool porque
+# se lanzan desde dentro de sus tareas
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='library')
+# Recorridos de carpetas del escaneo inteligente: pueden durar mucho y no deben ocupar los hilos del pool
+_walk_executor = ThreadPoolExecutor(max_workers=max(2, len(SERVERS)), thread_name_prefix='library-walk')
+
+PENDING = 'pendiente'
+SCANNING = 'escaneando'
+DONE = 'terminada'
+FAILED = 'error'
+
+# Qué escanear en un servidor: clave de sección -> None (la sección entera) o rutas de Plex concretas
+ScanPlan = Dict[str, Optional[List[str]]]
+
+
+class SectionProgress:
+    """Estado del escaneo de una sección dentro de un RefreshJob."""
+
+    __slots__ = ('server_index', 'key', 'title', 'paths', 'state', 'progress', 'error', 'requested_at')
+
+    def __init__(self, server_index: int, key: str, title: str, paths: Optional[List[str]] = None):
+        self.server_index = server_index
+        self.key = key
+        self.title = title
+        self.paths = paths
+        self.state = PENDING
+        self.progress: Optional[int] = None
+        self.error: Optional[str] = None
+        self.requested_at = time.monotonic()
+
+
+class RefreshJob:
+    """Escaneo de bibliotecas lanzado en uno o varios servidores.
+
+    start() pide el escaneo de todas las secciones a la vez y vuelve enseguida;
+    poll() consulta /activities y el estado de las secciones en cada servidor y
+    actualiza el progreso. Plex escanea las secciones de una en una y deja el
+    resto en cola sin que aparezcan en /activities, así que una sección que no
+    aparece solo se da por terminada cuando el servidor ya no escanea nada ni
+    la marca como `refreshing`, y pasados `grace` segundos desde la petición.
+
+    `plans` limita el escaneo por servidor a ciertas secciones o rutas; los
+    servidores que no aparecen se escanean enteros.
+    """
+
+    def __init__(self, indices: List[int], plans: Optional[Dict[int, ScanPlan]] = None,
+                 grace: float = LIBRARY_SCAN_GRACE):
+        self.indices = list(indices)
+        self.plans = plans or {}
+        self.grace = grace
+        self.sections: List[SectionProgress] = []
+        self.server_errors: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return all(section.state in (DONE, FAILED) for section in self.sections)
+
+    def _request_scans(self, index: int) -> List[SectionProgress]:
+        sections = plex_pool.run(index, lambda plex: plex.library.sections())
+        plan = self.plans.get(index)
+        if plan is not None:
+            sections = [section for section in sections if str(section.key) in plan]
+        # Un escaneo parcial es una petición por ruta: /library/sections/<clave>/refresh?path=...
+        futures = []
+        for section in sections:
+            paths = plan.get(str(section.key)) if plan is not None else None
+            futures.append((section, paths, [_executor.submit(section.update, path) for path in paths or [None]]))
+        progress = []
+        for section, paths, requests in futures:
+            item = SectionProgress(index, str(section.key), section.title, paths)
+            try:
+                for request in requests:
+                    request.result()
+            except Exception as e:
+                logger.error(f"Error al actualizar la sección {section.title} de {SERVERS[index].name}: {str(e)}")
+                item.state = FAILED
+                item.error = str(e)
+            progress.append(item)
+        return progress
+
+    def start(self) -> 'RefreshJob':
+        """Pide el escaneo de todas las secciones de todos los servidores en paralelo."""
+        for result in plex_pool.map_servers(self._request_scans, self.indices):
+            if result.ok:
+                self.sections.extend(result.value)
+            else:
+                self.server_errors[result.index] = result.error
+        return self
+
+    def _activities(self, index: int) -> Tuple[Dict[str, int], bool]:
+        """Progreso de los escaneos en curso en el servidor, por clave de sección, y si el servidor
+        sigue ocupado (algún escaneo activo o alguna sección marcada como `refreshing`)."""
+        scanning = {}
+        busy = False
+        for activity in plex_pool.run(index, lambda plex: plex.activities):
+            if not (activity.type or '').startswith('library.update'):
+                continue
+            busy = True
+            context = activity._data.find('Context')
+            section_key = context.attrib.get('librarySectionID') if context is not None else None
+            if section_key:
+                scanning[section_key] = activity.progress or 0
+        if not busy:
+            busy = any(section.refreshing for section in plex_pool.run(index, lambda plex: plex.library.sections()))
+        return scanning, busy
+
+    def poll(self) -> None:
+        """Actualiza el estado de cada sección con las actividades de su servidor."""
+        pending = sorted({s.server_index for s in self.sections if s.state in (PENDING, SCANNING)})
+        if not pending:
+            return
+        activities = {result.index: result.value for result in plex_pool.map_servers(self._activities, pending)
+                      if result.ok}
+        now = time.monotonic()
+        with self._lock:
+            for section in self.sections:
+                if section.state not in (PENDING, SCANNING) or section.server_index not in activities:
+                    continue
+                scanning, busy = activities[section.server_index]
+                progress = scanning.get(section.key)
+                if progress is not None:
+                    section.state = SCANNING
+                    section.progress = progress
+                elif busy and (section.state == PENDING or len(section.paths or ()) > 1):
+                    # Sigue en la cola de Plex: aún no ha empezado o le quedan rutas por escanear
+                    continue
+                elif section.state == SCANNING or now - section.requested_at >= self.grace:
+                    section.state = DONE
+                    section.progress = 100
+
+
+def start_refresh(indices: List[int], plans: Optional[Dict[int, ScanPlan]] = None) -> RefreshJob:
+    """Lanza el escaneo de las bibliotecas de los servidores indicados, entero o según `plans`."""
+    return RefreshJob(indices, plans).start()
+
+
+def start_smart_refresh(indices: List[int]) -> RefreshJob:
+    """Escanea solo las carpetas que han cambiado desde el último escaneo de cada sección."""
+    def plan(index: int):
+        sections = plex_pool.run(index, lambda plex: plex.library.sections())
+        return scan_index.plan(SERVERS[index], sections)
+
+    plans: Dict[int, ScanPlan] = {}
+    snapshots = {}
+    # Recorrer las carpetas puede tardar bastante más que una consulta normal a Plex
+    for result in plex_pool.map_servers(plan, indices, deadline=LIBRARY_REFRESH_TIMEOUT, executor=_walk_executor):
+        if result.ok:
+            plans[result.index], snapshots[result.index] = result.value
+        else:
+            logger.warning(f"No se pudo preparar el escaneo inteligente de {result.server.name}, se escanea entero: "
+                           f"{result.error}")
+
+    job = RefreshJob(indices, plans).start()
+    for index, server_snapshots in snapshots.items():
+        if index in job.server_errors:
+            continue
+        failed = {section.key for section in job.sections if section.server_index == index and section.state == FAILED}
+        scan_index.commit(SERVERS[index], {key: snapshot for key, snapshot in server_snapshots.items() if key not in failed})
+    return job
+
+
+def find_section_for_path(index: int, plex_path: str):
+    """Sección del servidor cuya carpeta contiene `plex_path`, o None."""
+    for section in plex_pool.run(index, lambda plex: plex.library.sections()):
+        for location in section.locations:
+            if plex_path == location or plex_path.startswith(location.rstrip('/') + '/'):
+                return section
+    return None
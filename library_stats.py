@@ -0,0 +1,241 @@
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from config import (LIBRARY_STATS_INTERVAL, LIBRARY_STATS_FULL_SYNC_INTERVAL, LIBRARY_STATS_PAGE_SIZE,
+                    LIBRARY_STATS_RECENT)
+from plex_pool import plex_pool
+from servers import SERVERS, Server
+
+logger = logging.getLogger(__name__)
+
+# Tipo de elemento que se cuenta en cada tipo de sección (películas, episodios, pistas, fotos)
+ITEM_TYPES = {'movie': 1, 'show': 4, 'artist': 10, 'photo': 13}
+
+
+class ItemRecord(NamedTuple):
+    """Lo que hace falta de cada elemento para las estadísticas."""
+    title: str
+    added_at: int
+    size: int
+    resolution: Optional[str]
+    codec: Optional[str]
+
+
+class SectionStats:
+    """Estadísticas de una sección mantenidas de forma incremental.
+
+    Guarda un ItemRecord por ratingKey; al aplicar cambios se restan las
+    contribuciones del registro anterior y se suman las del nuevo, de modo que
+    los totales nunca exigen recorrer toda la biblioteca.
+    """
+
+    __slots__ = ('key', 'title', 'type', 'items', 'size', 'resolutions', 'codecs', 'synced_at', 'rebuilt_at')
+
+    def __init__(self, key: str, title: str, section_type: str):
+        self.key = key
+        self.title = title
+        self.type = section_type
+        self.items: Dict[str, ItemRecord] = {}
+        self.size = 0
+        self.resolutions: Counter = Counter()
+        self.codecs: Counter = Counter()
+        self.synced_at: Optional[int] = None
+        self.rebuilt_at: Optional[int] = None
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    def _account(self, record: ItemRecord, sign: int) -> None:
+        self.size += sign * record.size
+        if record.resolution:
+            self.resolutions[record.resolution] += sign
+        if record.codec:
+            self.codecs[record.codec] += sign
+
+    def upsert(self, rating_key: str, record: ItemRecord) -> None:
+        previous = self.items.get(rating_key)
+        if previous is not None:
+            self._account(previous, -1)
+        self.items[rating_key] = record
+        self._account(record, 1)
+
+    def reset(self) -> None:
+        self.items.clear()
+        self.size = 0
+        self.resolutions.clear()
+        self.codecs.clear()
+        self.synced_at = None
+        self.rebuilt_at = None
+
+    def recently_added(self, count: int) -> List[ItemRecord]:
+        return heapq.nlargest(count, self.items.values(), key=lambda record: record.added_at)
+
+
+class SectionSummary(NamedTuple):
+    title: str
+    type: str
+    total: int
+    size: int
+    resolutions: List[Tuple[str, int]]
+    codecs: List[Tuple[str, int]]
+
+
+class LibrarySummary(NamedTuple):
+    """Foto fija de las estadísticas de un servidor, segura para leer desde cualquier hilo."""
+    sections: List[SectionSummary]
+    recently_added: List[Tuple[str, ItemRecord]]  # (sección, elemento), del más reciente al más antiguo
+    updated_at: Optional[float]
+    error: Optional[str]
+
+
+def _summarize(sections: Iterable[SectionStats], updated_at: Optional[float], error: Optional[str],
+               recent: int) -> LibrarySummary:
+    sections = list(sections)
+    summaries = [
+        SectionSummary(section.title, section.type, section.total, section.size,
+                       [(name, count) for name, count in section.resolutions.most_common() if count > 0],
+                       [(name, count) for name, count in section.codecs.most_common() if count > 0])
+        for section in sections
+    ]
+    candidates = ((section.title, record) for section in sections for record in section.recently_added(recent))
+    recently_added = heapq.nlargest(recent, candidates, key=lambda item: item[1].added_at)
+    return LibrarySummary(summaries, recently_added, updated_at, error)
+
+
+def _record_from_xml(element) -> ItemRecord:
+    media = element.find('Media')
+    part = media.find('Part') if media is not None else None
+    title = element.attrib.get('title', '')
+    if element.attrib.get('grandparentTitle'):
+        title = f"{element.attrib['grandparentTitle']} - {title}"
+    return ItemRecord(
+        title=title,
+        added_at=int(element.attrib.get('addedAt', 0)),
+        size=int(part.attrib.get('size', 0)) if part is not None else 0,
+        resolution=media.attrib.get('videoResolution') if media is not None else None,
+        codec=(media.attrib.get('videoCodec') or media.attrib.get('audioCodec')) if media is not None else None,
+    )
+
+
+class LibraryStatsCache:
+    """Estadísticas de biblioteca por servidor, recalculadas en segundo plano.
+
+    La primera vez se descarga la lista completa de elementos de cada sección
+    (paginada); después solo los que Plex marca como modificados desde la
+    última sincronización (`updatedAt>>=`). Si el número de elementos no
+    cuadra (se borró algo), esa sección se vuelve a descargar entera. Pero
+    un borrado compensado por un elemento que no llega como modificado (uno
+    movido desde otra biblioteca, por ejemplo) sí cuadra, así que además cada
+    `full_sync_interval` segundos cada sección se descarga entera de todos
+    modos: es lo más que puede quedar en las estadísticas algo borrado.
+    """
+
+    def __init__(self, servers: List[Server], interval: float = LIBRARY_STATS_INTERVAL,
+                 page_size: int = LIBRARY_STATS_PAGE_SIZE, recent: int = LIBRARY_STATS_RECENT,
+                 full_sync_interval: float = LIBRARY_STATS_FULL_SYNC_INTERVAL):
+        self._servers = servers
+        self._interval = interval
+        self._full_sync_interval = full_sync_interval
+        self._page_size = page_size
+        self._recent = recent
+        self._sections: List[Dict[str, SectionStats]] = [{} for _ in servers]
+        self._summaries: List[Optional[LibrarySummary]] = [None for _ in servers]
+        self._locks = [threading.Lock() for _ in servers]
+        # Las sincronizaciones completas pueden durar minutos: van en hilos propios, no en los del pool
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(servers)), thread_name_prefix='library-stats')
+
+    def cached(self, index: int) -> Optional[LibrarySummary]:
+        """Últimas estadísticas publicadas, o None si todavía no se han calculado; nunca espera a Plex."""
+        return self._summaries[index]
+
+    def get(self, index: int) -> LibrarySummary:
+        """Últimas estadísticas publicadas; solo espera a Plex si todavía no se han calculado nunca."""
+        summary = self._summaries[index]
+        return summary if summary is not None else self.refresh(index)
+
+    def _fetch(self, plex, section: SectionStats, since: Optional[int]) -> Iterable:
+        """Elementos de la sección (solo los modificados desde `since` si se indica), por páginas."""
+        query = f"/library/sections/{section.key}/all?type={ITEM_TYPES[section.type]}"
+        if since is not None:
+            query += f"&updatedAt>>={since}"
+        start = 0
+        while True:
+            container = plex.query(query, params={'X-Plex-Container-Start': start,
+                                                  'X-Plex-Container-Size': self._page_size})
+            elements = list(container) if container is not None else []
+            yield from elements
+            start += len(elements)
+            if len(elements) < self._page_size:
+                return
+
+    def _count(self, plex, section: SectionStats) -> int:
+        container = plex.query(f"/library/sections/{section.key}/all?type={ITEM_TYPES[section.type]}",
+                               params={'X-Plex-Container-Start': 0, 'X-Plex-Container-Size': 0})
+        return int(container.attrib.get('totalSize', container.attrib.get('size', 0)))
+
+    def _rebuild_section(self, plex, section: SectionStats, started: int) -> None:
+        section.reset()
+        for element in self._fetch(plex, section, None):
+            section.upsert(element.attrib['ratingKey'], _record_from_xml(element))
+        section.rebuilt_at = started
+
+    def _sync_section(self, plex, section: SectionStats) -> None:
+        started = int(time.time())
+        since = section.synced_at
+        if since is None or started - section.rebuilt_at >= self._full_sync_interval:
+            self._rebuild_section(plex, section, started)
+        else:
+            for element in self._fetch(plex, section, since):
+                section.upsert(element.attrib['ratingKey'], _record_from_xml(element))
+            if self._count(plex, section) != section.total:
+                logger.info(f"La sección {section.title} ha perdido elementos, se recalcula entera")
+                self._rebuild_section(plex, section, started)
+        section.synced_at = started
+
+    def refresh(self, index: int) -> LibrarySummary:
+        """Sincroniza las estadísticas del servidor con Plex, solo con lo que ha cambiado, y las publica."""
+        server = self._servers[index]
+        with self._locks[index]:
+            error = None
+            try:
+                plex_sections = plex_pool.run(index, lambda plex: plex.library.sections())
+                current = {}
+                for plex_section in plex_sections:
+                    key = str(plex_section.key)
+                    section = self._sections[index].get(key) or SectionStats(key, plex_section.title, plex_section.type)
+                    section.title = plex_section.title
+                    if section.type in ITEM_TYPES:
+                        plex_pool.run(index, lambda plex: self._sync_section(plex, section))
+                    current[key] = section
+                self._sections[index] = current
+            except Exception as e:
+                logger.error(f"Error al calcular las estadísticas de biblioteca de {server.name}: {str(e)}")
+                error = str(e)
+            summary = _summarize(self._sections[index].values(), time.time(), error, self._recent)
+            self._summaries[index] = summary
+        return summary
+
+    def refresh_in_background(self, indices: Iterable[int]) -> None:
+        """Programa la sincronización de esos servidores sin esperar a que termine."""
+        for index in indices:
+            self._executor.submit(self.refresh, index)
+
+    def start(self) -> threading.Thread:
+        """Lanza el hilo que recalcula las estadísticas de todos los servidores cada `interval` segundos."""
+        def loop():
+            while True:
+                plex_pool.map_servers(self.refresh, deadline=self._interval, executor=self._executor)
+                time.sleep(self._interval)
+
+        thread = threading.Thread(target=loop, name='library-stats', daemon=True)
+        thread.start()
+        return thread
+
+
+library_stats = LibraryStatsCache(SERVERS)
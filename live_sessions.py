@@ -0,0 +1,202 @@
+import importlib.util
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from config import (PLEX_LISTENER_BACKOFF_MAX, PLEX_LISTENER_PING_INTERVAL, PLEX_LISTENER_PING_TIMEOUT,
+                    PLEX_LIVE_RESYNC_INTERVAL)
+from plex_pool import plex_pool
+from servers import SERVERS, Server
+from sessions import session_cache, SessionRecord
+
+logger = logging.getLogger(__name__)
+
+# Una conexión que aguanta al menos esto (segundos) se considera sana y reinicia la espera entre reintentos
+_STABLE_CONNECTION = 60
+# Ruta del websocket de notificaciones de Plex (la misma que usa AlertListener de plexapi)
+NOTIFICATIONS_PATH = '/:/websockets/notifications'
+
+
+class SessionListener:
+    """Tabla de sesiones de un servidor mantenida con las notificaciones de Plex.
+
+    Escucha el websocket de notificaciones: al conectar carga las sesiones
+    una vez, los avisos `playing` actualizan la posición o quitan la sesión
+    que se detuvo, y una sesión desconocida o un transcode que empieza o
+    termina provocan una recarga. Cada cambio se publica en session_cache, así que las vistas
+    leen de memoria sin llamar a Plex.
+
+    El websocket manda pings: si el pong no llega, la conexión se da por
+    caída aunque el socket siga abierto. Además, cada `resync_interval`
+    segundos se recargan las sesiones enteras. Si el websocket se cae, la
+    caché vuelve a consultar a Plex hasta que se reconecta, con una espera
+    que se duplica en cada intento.
+    """
+
+    def __init__(self, server: Server, backoff_max: float = PLEX_LISTENER_BACKOFF_MAX,
+                 ping_interval: float = PLEX_LISTENER_PING_INTERVAL, ping_timeout: float = PLEX_LISTENER_PING_TIMEOUT,
+                 resync_interval: float = PLEX_LIVE_RESYNC_INTERVAL):
+        self.server = server
+        self._backoff_max = backoff_max
+        self._ping_interval = ping_interval
+        self._ping_timeout = ping_timeout
+        self._resync_interval = resync_interval
+        self._sessions: Dict[str, SessionRecord] = {}
+        self._lock = threading.Lock()
+        # Paradas recientes numeradas: una recarga que empezó antes de una parada no debe resucitar la sesión
+        self._stops: Deque[Tuple[int, str]] = deque(maxlen=256)
+        self._stop_count = 0
+        self._stopped = threading.Event()
+        # Las recargas pedidas por un aviso las hace el hilo del listener, no el del websocket, que
+        # tiene que seguir leyendo (entre otras cosas, los pongs)
+        self._resync_wanted = threading.Event()
+        self._ws = None
+        self.connected = False
+
+    def _publish(self) -> None:
+        session_cache.publish(self.server.index, list(self._sessions.values()))
+
+    def _resync(self) -> None:
+        with self._lock:
+            stops_before = self._stop_count
+        sessions = plex_pool.run(self.server.index, lambda plex: plex.sessions())
+        records = {record.session_key: record
+                   for record in (SessionRecord.from_plex(self.server.index, s) for s in sessions)}
+        with self._lock:
+            # Las notificaciones se aplican mientras se consulta a Plex: las paradas que llegaron
+            # entretanto son más recientes que la lista recién descargada
+            for number, session_key in self._stops:
+                if number > stops_before:
+                    records.pop(session_key, None)
+            self._sessions = records
+            self._publish()
+
+    def _on_playing(self, notifications: List[dict]) -> None:
+        unknown = False
+        with self._lock:
+            for notification in notifications:
+                session_key = str(notification.get('sessionKey'))
+                if notification.get('state') == 'stopped':
+                    self._sessions.pop(session_key, None)
+                    self._stop_count += 1
+                    self._stops.append((self._stop_count, session_key))
+                elif session_key in self._sessions:
+                    # La instantánea anterior puede estar en manos de una vista o de un botón: nada de cambiarla
+                    self._sessions[session_key] = self._sessions[session_key].replace(
+                        view_offset=int(notification.get('viewOffset') or 0))
+                else:
+                    unknown = True
+            self._publish()
+        if unknown:
+            self._resync_wanted.set()
+
+    def on_message(self, data: dict) -> None:
+        try:
+            kind = data.get('type', '')
+            if kind == 'playing':
+                self._on_playing(data.get('PlaySessionStateNotification', []))
+            elif kind in ('transcodeSession.start', 'transcodeSession.end'):
+                # transcodeSession.update llega sin parar mientras dura cada transcode y no cambia nada
+                # de lo que se muestra: recargar con él consultaría a Plex más que las propias vistas
+                self._resync_wanted.set()
+        except Exception as e:
+            logger.warning(f"Error al procesar una notificación de {self.server.name}: {str(e)}")
+
+    def _on_raw_message(self, message: str) -> None:
+        try:
+            data = json.loads(message)['NotificationContainer']
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Notificación no válida de {self.server.name}: {str(e)}")
+            return
+        self.on_message(data)
+
+    def _listen_once(self) -> None:
+        import websocket
+
+        plex = plex_pool.get(self.server.index)
+        url = plex.url(NOTIFICATIONS_PATH, includeToken=True).replace('http', 'ws', 1)
+        opened = threading.Event()
+        ws = websocket.WebSocketApp(
+            url,
+            on_open=lambda ws: opened.set(),
+            on_message=lambda ws, message: self._on_raw_message(message),
+            on_error=lambda ws, error: logger.warning(f"Error en el websocket de {self.server.name}: {str(error)}"))
+        self._ws = ws
+        thread = threading.Thread(target=ws.run_forever, name=f'session-websocket-{self.server.id}', daemon=True,
+                                  kwargs={'ping_interval': self._ping_interval, 'ping_timeout': self._ping_timeout})
+        thread.start()
+        try:
+            # Se carga la tabla con el websocket ya abierto, para no perder avisos entre medias
+            deadline = time.monotonic() + self.server.timeout
+            while not opened.wait(0.1):
+                if not thread.is_alive():
+                    return
+                if time.monotonic() >= deadline:
+                    logger.warning(f"El websocket de {self.server.name} no se abrió en {self.server.timeout} s")
+                    return
+            self._resync_wanted.clear()
+            self._resync()
+            self.connected = True
+            session_cache.set_live(self.server.index, True)
+            logger.info(f"Escuchando las notificaciones de sesiones de {self.server.name}")
+            # Además de las recargas que piden los avisos, cada cierto tiempo se recarga todo: un aviso
+            # perdido no se queda para siempre
+            next_resync = time.monotonic() + self._resync_interval
+            while thread.is_alive():
+                if self._resync_wanted.wait(1.0) or time.monotonic() >= next_resync:
+                    self._resync_wanted.clear()
+                    self._resync()
+                    next_resync = time.monotonic() + self._resync_interval
+        finally:
+            ws.close()
+
+    def run(self) -> None:
+        backoff = 1.0
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self._listen_once()
+            except Exception as e:
+                logger.warning(f"No se pudo escuchar las notificaciones de {self.server.name}: {str(e)}")
+            self.connected = False
+            session_cache.set_live(self.server.index, False)
+            if time.monotonic() - started >= _STABLE_CONNECTION:
+                backoff = 1.0
+            if self._stopped.is_set():
+                return
+            logger.info(f"Reconectando con las notificaciones de {self.server.name} en {backoff:.0f} s")
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, self._backoff_max)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name=f'session-listener-{self.server.id}', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        """Cierra el websocket y deja de reconectar."""
+        self._stopped.set()
+        if self._ws is not None:
+            self._ws.close()
+
+
+class LiveSessions:
+    """Un SessionListener por servidor."""
+
+    def __init__(self, servers: List[Server]):
+        self.listeners = [SessionListener(server) for server in servers]
+
+    def start(self) -> bool:
+        """Lanza los listeners; devuelve False si falta websocket-client y las sesiones se siguen consultando."""
+        if importlib.util.find_spec('websocket') is None:
+            logger.warning("websocket-client no está instalado; las sesiones se seguirán consultando a Plex")
+            return False
+        for listener in self.listeners:
+            listener.start()
+        return True
+
+
+live_sessions = LiveSessions(SERVERS)
@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from array import array
+from typing import List, NamedTuple, Optional
+
+from config import METRICS_INTERVAL, METRICS_HISTORY_SIZE
+from glances import fetch_glances_stats
+from plex_pool import plex_pool
+from servers import SERVERS, Server
+from sessions import session_cache
+
+logger = logging.getLogger(__name__)
+
+
+class MetricSummary(NamedTuple):
+    """Resumen de una serie en una ventana de tiempo."""
+    last: float
+    minimum: float
+    average: float
+    maximum: float
+    trend: float  # media de la segunda mitad de la ventana menos la de la primera
+    samples: int
+
+
+class RingBuffer:
+    """Serie temporal de tamaño fijo guardada en dos array('d') (instantes y valores)."""
+
+    __slots__ = ('_times', '_values', '_size', '_next', '_count', '_lock')
+
+    def __init__(self, size: int):
+        self._times = array('d', bytes(8 * size))
+        self._values = array('d', bytes(8 * size))
+        self._size = size
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, value: float) -> None:
+        with self._lock:
+            self._times[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self._size
+            self._count = min(self._count + 1, self._size)
+
+    def last(self) -> Optional[float]:
+        with self._lock:
+            return self._values[(self._next - 1) % self._size] if self._count else None
+
+    def window(self, seconds: float, now: Optional[float] = None) -> List[float]:
+        """Valores de los últimos `seconds` segundos, del más antiguo al más reciente."""
+        since = (time.time() if now is None else now) - seconds
+        with self._lock:
+            values = []
+            start = (self._next - self._count) % self._size
+            for offset in range(self._count):
+                i = (start + offset) % self._size
+                if self._times[i] >= since:
+                    values.append(self._values[i])
+            return values
+
+    def summary(self, seconds: float) -> Optional[MetricSummary]:
+        values = self.window(seconds)
+        if not values:
+            return None
+        half = len(values) // 2
+        trend = (sum(values[half:]) / (len(values) - half) - sum(values[:half]) / half) if half else 0.0
+        return MetricSummary(values[-1], min(values), sum(values) / len(values), max(values), trend, len(values))
+
+
+class ServerMetrics:
+    """Series y último estado conocido de un servidor."""
+
+    __slots__ = ('cpu', 'mem', 'streams', 'transcodes', 'glances', 'glances_error', 'plex_error', 'sampled_at')
+
+    def __init__(self, size: int):
+        self.cpu = RingBuffer(size)
+        self.mem = RingBuffer(size)
+        self.streams = RingBuffer(size)
+        self.transcodes = RingBuffer(size)
+        self.glances: Optional[dict] = None
+        self.glances_error: Optional[str] = None
+        self.plex_error: Optional[str] = None
+        self.sampled_at: Optional[float] = None
+
+
+class MetricsPoller:
+    """Muestrea Glances y las sesiones de Plex de cada servidor cada `interval` segundos."""
+
+    def __init__(self, servers: List[Server], interval: float = METRICS_INTERVAL, size: int = METRICS_HISTORY_SIZE):
+        self._servers = servers
+        self._interval = interval
+        self._metrics = [ServerMetrics(size) for _ in servers]
+
+    def get(self, index: int) -> ServerMetrics:
+        return self._metrics[index]
+
+    def sample(self, index: int) -> None:
+        server = self._servers[index]
+        metrics = self._metrics[index]
+        now = time.time()
+
+        if server.glances_url:
+            try:
+                stats = fetch_glances_stats(server.glances_url)
+                metrics.cpu.append(now, stats['cpu'])
+                metrics.mem.append(now, stats['mem'])
+                metrics.glances = stats
+                metrics.glances_error = None
+            except Exception as e:
+                logger.warning(f"No se pudieron obtener métricas de Glances para {server.name}: {str(e)}")
+                metrics.glances = None
+                metrics.glances_error = str(e)
+
+        try:
+            # Reutiliza la instantánea compartida, que así queda caliente para las vistas
+            sessions = session_cache.get(index)
+            metrics.streams.append(now, len(sessions))
+            metrics.transcodes.append(now, sum(1 for s in sessions if s.transcode_video))
+            metrics.plex_error = None
+        except Exception as e:
+            logger.warning(f"No se pudieron obtener sesiones de {server.name}: {str(e)}")
+            metrics.plex_error = str(e)
+
+        metrics.sampled_at = now
+
+    def sample_all(self) -> None:
+        plex_pool.map_servers(self.sample, deadline=self._interval)
+
+    def start(self) -> threading.Thread:
+        """Lanza el hilo de muestreo en segundo plano."""
+        def loop():
+            while True:
+                started = time.monotonic()
+                self.sample_all()
+                time.sleep(max(0.0, self._interval - (time.monotonic() - started)))
+
+        thread = threading.Thread(target=loop, name='metrics-poller', daemon=True)
+        thread.start()
+        return thread
+
+
+metrics_poller = MetricsPoller(SERVERS)
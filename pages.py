@@ -0,0 +1,150 @@
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import PAGE_CAPTION_LIMIT, PAGE_STORE_SIZE, PAGE_STORE_TTL
+from tokens import TokenStore
+
+ButtonRows = List[List[InlineKeyboardButton]]
+
+
+class PageItem(NamedTuple):
+    """Un elemento de la lista: su texto y los botones que le acompañan en la página."""
+    text: str
+    buttons: ButtonRows = []
+
+
+class PagedView(NamedTuple):
+    """Resultado completo de una vista, ya repartido en páginas que caben en un pie de foto."""
+    header: str
+    pages: List[Tuple[str, ButtonRows]]
+    footer: ButtonRows
+
+
+def _text_length(text: str) -> int:
+    """Longitud tal como la cuenta Telegram: en unidades UTF-16 (un emoji suele valer 2)."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def paginate(header: str, items: List[PageItem], footer: ButtonRows, limit: int = PAGE_CAPTION_LIMIT) -> PagedView:
+    """Agrupa los elementos en páginas para que cabecera + elementos + 'Página i/n' no pasen de `limit`."""
+    # Reserva para la línea de página ('\n_Página 99/99_')
+    budget = limit - _text_length(header) - 20
+    # Con una cabecera que ya se pasa del límite no hay página que quepa: un elemento entero por página
+    # antes que trocearlos carácter a carácter
+    whole_items = budget < 1
+    budget = max(1, budget)
+    pages: List[Tuple[str, ButtonRows]] = []
+    text, buttons = "", []
+    for item in items:
+        # Un elemento que no cabe en una página sigue en las siguientes; sus botones van con el primer trozo
+        for number, item_text in enumerate([item.text] if whole_items else _split_text(item.text, budget)):
+            if text and _text_length(text) + _text_length(item_text) > budget:
+                pages.append((text, buttons))
+                text, buttons = "", []
+            text += item_text
+            if number == 0:
+                buttons = buttons + item.buttons
+    if text or not pages:
+        pages.append((text, buttons))
+    return PagedView(header, pages, [list(row) for row in footer])
+
+
+def _split_text(text: str, size: int) -> List[str]:
+    """Parte `text` en trozos de como mucho `size` unidades, por líneas enteras siempre que se pueda."""
+    if _text_length(text) <= size:
+        return [text]
+    chunks: List[str] = []
+    chunk = ""
+    for line in text.splitlines(keepends=True):
+        while _text_length(line) > size:
+            piece, line = _split_line(line, size)
+            if chunk:
+                chunks.append(chunk)
+                chunk = ""
+            chunks.append(piece)
+        if chunk and _text_length(chunk) + _text_length(line) > size:
+            chunks.append(chunk)
+            chunk = ""
+        chunk += line
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _split_line(line: str, size: int) -> Tuple[str, str]:
+    """Corta una línea demasiado larga sin romper el Markdown.
+
+    El corte nunca separa un carácter escapado de su '\\'. Si cae dentro de
+    *negrita*, _cursiva_ o `código`, la marca se cierra al final del trozo y se
+    vuelve a abrir en el resto; un enlace no se parte: se corta antes de él.
+    """
+    # Sitio para el salto de línea y para cerrar una marca abierta; `limit` pasa de unidades a caracteres
+    limit, units = 0, 0
+    for char in line:
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > size - 2:
+            break
+        limit += 1
+    limit = max(1, limit)
+    cut = line.rfind(" ", limit // 2, limit) + 1 or limit
+    marker, start, index = "", 0, 0
+    while index < cut:
+        char = line[index]
+        if char == "\\" and marker != "`":
+            if index + 1 >= cut:
+                cut = index
+                break
+            index += 1
+        elif marker == "" and char == "[":
+            marker, start = "[", index
+        elif marker == "[" and char == ")":
+            marker = ""
+        elif char in "*_`" and marker in ("", char):
+            marker, start = ("" if marker else char), index
+        index += 1
+    if marker == "[":
+        # Si el enlace empieza la línea no hay dónde cortar antes: se deja entero
+        cut = start or line.find(")", cut) + 1 or len(line)
+        marker = ""
+    elif marker and cut == start + 1:
+        # La marca se abre justo en el corte: mejor pasarla entera al resto
+        cut, marker = start, ""
+    if cut <= 0:
+        # Solo con un tamaño de página casi nulo: se avanza aunque se parta una marca
+        cut, marker = limit, ""
+    head, rest = line[:cut].rstrip(" "), line[cut:].lstrip(" ")
+    return head + marker + "\n", marker + rest
+
+
+class PageCache:
+    """Vistas paginadas guardadas bajo un token: pasar de página no vuelve a consultar a Plex."""
+
+    def __init__(self, maxsize: int = PAGE_STORE_SIZE, ttl: float = PAGE_STORE_TTL):
+        self._store: TokenStore[PagedView] = TokenStore(maxsize, ttl)
+
+    def store(self, view: PagedView) -> str:
+        return self._store.put(view)
+
+    def get(self, token: str) -> Optional[PagedView]:
+        return self._store.get(token)
+
+    @staticmethod
+    def render(view: PagedView, page: int, page_data: Callable[[int], str]) -> Tuple[str, InlineKeyboardMarkup]:
+        """Texto y teclado de la página `page` (empezando en 0); `page_data(n)` da el callback_data de la página n."""
+        page = max(0, min(page, len(view.pages) - 1))
+        text, buttons = view.pages[page]
+        text = view.header + text
+        keyboard = list(buttons)
+        if len(view.pages) > 1:
+            text = text.rstrip("\n") + f"\n\n_Página {page + 1}/{len(view.pages)}_"
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton("◀️ Anterior", callback_data=page_data(page - 1)))
+            if page < len(view.pages) - 1:
+                navigation.append(InlineKeyboardButton("Siguiente ▶️", callback_data=page_data(page + 1)))
+            keyboard.append(navigation)
+        return text, InlineKeyboardMarkup(keyboard + view.footer)
+
+
+page_cache = PageCache()
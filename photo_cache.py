@@ -0,0 +1,58 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPhoto:
+    """Imagen que se sube a Telegram una sola vez y después se reenvía por su file_id.
+
+    Los bytes se leen al crear el objeto. El file_id se guarda en disco junto
+    con el hash de la imagen, de modo que sobrevive a los reinicios y se
+    descarta solo si la imagen cambia.
+    """
+
+    def __init__(self, image_path: str, cache_path: str):
+        self._cache_path = cache_path
+        self.data: Optional[bytes] = None
+        self.file_id: Optional[str] = None
+        try:
+            with open(image_path, 'rb') as image:
+                self.data = image.read()
+        except OSError as e:
+            logger.error(f"No se pudo leer la imagen {image_path}: {str(e)}")
+            return
+        self._digest = hashlib.sha256(self.data).hexdigest()
+        self.file_id = self._load_file_id()
+
+    def _load_file_id(self) -> Optional[str]:
+        try:
+            with open(self._cache_path, encoding='utf-8') as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        return cached.get('file_id') if cached.get('sha256') == self._digest else None
+
+    @property
+    def payload(self) -> Optional[Union[str, bytes]]:
+        """Lo que hay que pasar a send_photo: el file_id si lo conocemos, si no los bytes."""
+        return self.file_id or self.data
+
+    def remember(self, file_id: str) -> None:
+        """Guarda el file_id devuelto por la primera subida."""
+        if file_id == self.file_id:
+            return
+        self.file_id = file_id
+        try:
+            os.makedirs(os.path.dirname(self._cache_path) or '.', exist_ok=True)
+            with open(self._cache_path, 'w', encoding='utf-8') as cache_file:
+                json.dump({'sha256': self._digest, 'file_id': file_id}, cache_file)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el file_id de la imagen: {str(e)}")
+
+    def forget(self) -> None:
+        """Descarta un file_id que Telegram ya no acepta (por ejemplo, tras cambiar de bot)."""
+        self.file_id = None
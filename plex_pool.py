@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+from plexapi.server import PlexServer
+from config import PLEX_RECONNECT_INTERVAL, PLEX_FANOUT_DEADLINE
+from servers import SERVERS, Server
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class ServerResult(NamedTuple):
+    """Resultado de una consulta a un servidor: `value` si fue bien, `error` si no."""
+    index: int
+    server: Server
+    value: Any = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class _TimeoutSession(requests.Session):
+    """Sesión HTTP keep-alive que aplica el timeout del servidor a todas las peticiones."""
+
+    def __init__(self, timeout: int):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        # plexapi siempre pasa su timeout global (30s); imponemos el del servidor
+        kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+class PlexConnectionPool:
+    """Registro de clientes PlexServer persistentes, uno por índice de servidor.
+
+    La conexión se abre de forma perezosa en el primer uso y se reutiliza en
+    cada pulsación. Si un servidor falla, su cliente se descarta y no se
+    vuelve a intentar conectar hasta pasado el intervalo de reconexión.
+    """
+
+    def __init__(self, servers: List[Server], reconnect_interval: int = PLEX_RECONNECT_INTERVAL):
+        self._servers = servers
+        self._reconnect_interval = reconnect_interval
+        self._clients: Dict[int, PlexServer] = {}
+        self._http_sessions: Dict[int, _TimeoutSession] = {}
+        self._failures: Dict[int, float] = {}
+        self._locks = [threading.Lock() for _ in servers]
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(servers)), thread_name_prefix='plex-fanout')
+
+    def _http_session(self, index: int) -> _TimeoutSession:
+        session = self._http_sessions.get(index)
+        if session is None:
+            session = _TimeoutSession(self._servers[index].timeout)
+            self._http_sessions[index] = session
+        return session
+
+    def get(self, index: int) -> PlexServer:
+        """Devuelve el cliente del servidor, conectando si todavía no existe."""
+        client = self._clients.get(index)
+        if client is not None:
+            return client
+        with self._locks[index]:
+            client = self._clients.get(index)
+            if client is not None:
+                return client
+            server = self._servers[index]
+            failed_at = self._failures.get(index)
+            if failed_at is not None:
+                remaining = self._reconnect_interval - (time.monotonic() - failed_at)
+                if remaining > 0:
+                    raise ConnectionError(f"{server.name} no responde, se reintentará en {int(remaining) + 1}s")
+            try:
+                session = self._http_session(index)
+                client = PlexServer(server.url, server.token, session=session, timeout=session.timeout)
+            except Exception:
+                self._failures[index] = time.monotonic()
+                raise
+            logger.info(f"Conectado a {server.name} (Plex {client.version})")
+            self._failures.pop(index, None)
+            self._clients[index] = client
+            return client
+
+    def invalidate(self, index: int, failed: bool = True) -> None:
+        """Descarta el cliente del servidor para que se reconecte en el próximo uso."""
+        self._clients.pop(index, None)
+        if failed:
+            self._failures[index] = time.monotonic()
+
+    def run(self, index: int, func: Callable[[PlexServer], T]) -> T:
+        """Ejecuta func(plex) con el cliente persistente del servidor.
+
+        Si la conexión existente ha caído se reconecta una vez y se repite la
+        llamada; si vuelve a fallar, el servidor queda marcado como caído.
+        """
+        reused = index in self._clients
+        plex = self.get(index)
+        try:
+            return func(plex)
+        except requests.RequestException as e:
+            if not reused:
+                self.invalidate(index)
+                raise
+            logger.warning(f"Conexión con {self._servers[index].name} perdida, reconectando: {str(e)}")
+            self.invalidate(index, failed=False)
+        try:
+            return func(self.get(index))
+        except requests.RequestException:
+            self.invalidate(index)
+            raise
+
+    def fan_out(self, func: Callable[[PlexServer], T], indices: Optional[Iterable[int]] = None,
+                deadline: float = PLEX_FANOUT_DEADLINE) -> List[ServerResult]:
+        """Ejecuta func(plex) en todos los servidores en paralelo.
+
+        Devuelve un ServerResult por servidor, en el orden de configuración.
+        Los servidores que fallan o no responden antes de `deadline` segundos
+        llevan un mensaje en `error` en lugar de bloquear al resto.
+        """
+        return self.map_servers(lambda index: self.run(index, func), indices, deadline)
+
+    def map_servers(self, func: Callable[[int], T], indices: Optional[Iterable[int]] = None,
+                    deadline: float = PLEX_FANOUT_DEADLINE, executor: Optional[Executor] = None) -> List[ServerResult]:
+        """Como fan_out, pero func recibe el índice del servidor en lugar del cliente.
+
+        Los trabajos largos (sincronizaciones completas, recorridos de carpetas) deben pasar su propio
+        `executor`: el del pool es pequeño y lo comparten todas las vistas, que se quedarían sin hilos.
+        """
+        if indices is None:
+            indices = range(len(self._servers))
+        executor = executor or self._executor
+        futures = {index: executor.submit(func, index) for index in indices}
+        wait(futures.values(), timeout=deadline)
+
+        results = []
+        for index, future in futures.items():
+            server = self._servers[index]
+            if not future.done():
+                logger.warning(f"{server.name} no respondió en {deadline:g}s")
+                results.append(ServerResult(index, server, error=f"Sin respuesta en {deadline:g}s"))
+            elif future.exception() is not None:
+                logger.error(f"Error al conectar con {server.name}: {str(future.exception())}")
+                results.append(ServerResult(index, server, error=str(future.exception())))
+            else:
+                results.append(ServerResult(index, server, value=future.result()))
+        return results
+
+    def check_health(self) -> Dict[int, bool]:
+        """Comprueba todos los servidores con una petición ligera a /identity."""
+        return {result.index: result.ok for result in self.fan_out(lambda plex: plex.query('/identity'))}
+
+    def start_health_checks(self, interval: int) -> threading.Thread:
+        """Lanza un hilo que mantiene las conexiones calientes comprobándolas cada `interval` segundos."""
+        def loop():
+            while True:
+                self.check_health()
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name='plex-healthcheck', daemon=True)
+        thread.start()
+        return thread
+
+
+plex_pool = PlexConnectionPool(SERVERS)
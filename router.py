@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Telegram solo admite 64 bytes de callback_data por botón
+CALLBACK_DATA_LIMIT = 64
+
+
+class RouteStats:
+    """Contadores de una ruta: pulsaciones, errores y latencia acumulada y máxima (segundos)."""
+
+    __slots__ = ('calls', 'errors', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def average_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+
+class Route(NamedTuple):
+    name: str
+    handler: Callable[..., Awaitable[Any]]
+    converters: Tuple[Callable[[str], Any], ...]
+    stats: RouteStats
+
+
+class CallbackRouter:
+    """Tabla de rutas para los botones, indexada por el nombre de la ruta.
+
+    El callback_data tiene la forma `nombre` o `nombre:arg1:arg2`; el nombre se
+    busca en un diccionario y cada argumento pasa por el conversor declarado al
+    registrar la ruta (el último recibe el resto del texto, aunque tenga `:`).
+    """
+
+    SEPARATOR = ':'
+
+    def __init__(self):
+        self._routes: Dict[str, Route] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, handler: Callable[..., Awaitable[Any]], *converters: Callable[[str], Any]) -> None:
+        if self.SEPARATOR in name:
+            raise ValueError(f"El nombre de ruta no puede contener '{self.SEPARATOR}': {name}")
+        if name in self._routes:
+            raise ValueError(f"Ruta duplicada: {name}")
+        self._routes[name] = Route(name, handler, converters, RouteStats())
+
+    def data(self, name: str, *args: Any) -> str:
+        """callback_data para un botón de la ruta `name` con los argumentos dados."""
+        route = self._routes.get(name)
+        if route is None or len(args) != len(route.converters):
+            raise ValueError(f"Argumentos no válidos para la ruta {name}: {args}")
+        data = self.SEPARATOR.join([name, *map(str, args)])
+        if len(data.encode('utf-8')) > CALLBACK_DATA_LIMIT:
+            raise ValueError(f"callback_data demasiado largo ({len(data)} bytes): {data}")
+        return data
+
+    def resolve(self, data: str) -> Tuple[Route, List[Any]]:
+        """Ruta y argumentos convertidos para un callback_data; KeyError si la ruta no existe."""
+        name, _, rest = data.partition(self.SEPARATOR)
+        route = self._routes[name]
+        if not route.converters:
+            return route, []
+        raw = rest.split(self.SEPARATOR, len(route.converters) - 1)
+        if len(raw) != len(route.converters):
+            raise ValueError(f"Faltan argumentos en '{data}'")
+        return route, [convert(value) for convert, value in zip(route.converters, raw)]
+
+    async def dispatch(self, data: str, *handler_args: Any) -> bool:
+        """Ejecuta la ruta de `data` y registra su latencia; devuelve False si no hay ruta."""
+        name = data.partition(self.SEPARATOR)[0]
+        route = self._routes.get(name)
+        if route is None:
+            logger.warning(f"Botón sin ruta registrada: {data}")
+            return False
+        started = time.perf_counter()
+        failed = True
+        try:
+            _, args = self.resolve(data)
+            await route.handler(*handler_args, *args)
+            failed = False
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = route.stats
+                stats.calls += 1
+                stats.errors += failed
+                stats.total_time += elapsed
+                stats.max_time = max(stats.max_time, elapsed)
+        return True
+
+    def stats(self) -> List[Tuple[str, RouteStats]]:
+        """Rutas ya usadas, de la más lenta a la más rápida según su latencia media."""
+        used = [(name, route.stats) for name, route in self._routes.items() if route.stats.calls]
+        return sorted(used, key=lambda item: item[1].average_time, reverse=True)
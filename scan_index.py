@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import STATE_DIR, LIBRARY_SMART_MAX_PATHS
+from servers import Server
+
+logger = logging.getLogger(__name__)
+
+# Instantánea de un árbol de carpetas: ruta local -> (mtime_ns, número de entradas)
+Snapshot = Dict[str, Tuple[int, int]]
+
+
+def snapshot_tree(root: str) -> Snapshot:
+    """Recorre solo las carpetas bajo `root` y anota su mtime y cuántas entradas tienen."""
+    snapshot: Snapshot = {}
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+            snapshot[path] = (os.stat(path).st_mtime_ns, len(entries))
+        except OSError as e:
+            logger.warning(f"No se pudo leer la carpeta {path}: {str(e)}")
+            continue
+        stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+    return snapshot
+
+
+def changed_paths(old: Snapshot, new: Snapshot) -> List[str]:
+    """Carpetas mínimas que hay que reescanear para recoger los cambios entre dos instantáneas.
+
+    Una carpeta nueva se escanea entera. Una carpeta cuyo mtime cambió se escanea
+    salvo que el cambio se explique solo por subcarpetas nuevas (que ya se
+    escanean); así añadir una película no obliga a escanear la raíz de la sección.
+    """
+    new_dirs = {path for path in new if path not in old}
+    new_children: Dict[str, int] = {}
+    for path in new_dirs:
+        parent = os.path.dirname(path)
+        new_children[parent] = new_children.get(parent, 0) + 1
+
+    changed = set(new_dirs)
+    for path, (mtime, entries) in new.items():
+        previous = old.get(path)
+        if previous is None or previous[0] == mtime:
+            continue
+        added = new_children.get(path, 0)
+        if not added or entries != previous[1] + added:
+            changed.add(path)
+
+    # Si una carpeta ya se escanea, sus subcarpetas sobran
+    minimal = []
+    for path in sorted(changed):
+        parent = os.path.dirname(path)
+        while parent not in changed and parent != os.path.dirname(parent):
+            parent = os.path.dirname(parent)
+        if parent not in changed:
+            minimal.append(path)
+    return minimal
+
+
+class LibraryScanIndex:
+    """Índice de mtimes de las carpetas de cada sección, guardado en STATE_DIR entre reinicios.
+
+    plan() compara el estado actual del disco con el del último escaneo y
+    devuelve qué escanear; commit() guarda el nuevo estado una vez pedido el
+    escaneo, para que la siguiente vez solo cuenten los cambios posteriores.
+    """
+
+    def __init__(self, state_dir: str = STATE_DIR, max_paths: int = LIBRARY_SMART_MAX_PATHS):
+        self._state_dir = state_dir
+        self._max_paths = max_paths
+        self._lock = threading.Lock()
+
+    def _path(self, server: Server) -> str:
+        return os.path.join(self._state_dir, f'library_index_{server.id}.json')
+
+    def _load(self, server: Server) -> Dict[str, Snapshot]:
+        try:
+            with open(self._path(server), encoding='utf-8') as index_file:
+                stored = json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+        return {key: {path: tuple(value) for path, value in snapshot.items()} for key, snapshot in stored.items()}
+
+    def plan(self, server: Server, sections) -> Tuple[Dict[str, Optional[List[str]]], Dict[str, Snapshot]]:
+        """Qué escanear en cada sección: None para la sección entera o una lista de rutas de Plex.
+
+        Las secciones sin cambios no aparecen en el resultado. Devuelve también
+        las instantáneas nuevas, que hay que pasar a commit().
+        """
+        stored = self._load(server)
+        plan: Dict[str, Optional[List[str]]] = {}
+        snapshots: Dict[str, Snapshot] = {}
+        for section in sections:
+            key = str(section.key)
+            roots = [server.local_path(location) for location in section.locations]
+            if not roots or not all(os.path.isdir(root) for root in roots):
+                logger.info(f"Sin acceso a las carpetas de {section.title} en {server.name}, se escanea entera")
+                plan[key] = None
+                continue
+            snapshot: Snapshot = {}
+            for root in roots:
+                snapshot.update(snapshot_tree(root))
+            snapshots[key] = snapshot
+
+            old = stored.get(key)
+            if old is None:
+                plan[key] = None
+                continue
+            changed = changed_paths(old, snapshot)
+            if not changed:
+                continue
+            if len(changed) > self._max_paths or any(path in roots for path in changed):
+                plan[key] = None
+            else:
+                plan[key] = [server.plex_path(path) for path in changed]
+        return plan, snapshots
+
+    def commit(self, server: Server, snapshots: Dict[str, Snapshot]) -> None:
+        if not snapshots:
+            return
+        with self._lock:
+            stored = self._load(server)
+            stored.update(snapshots)
+            try:
+                os.makedirs(self._state_dir, exist_ok=True)
+                tmp_path = self._path(server) + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as index_file:
+                    json.dump(stored, index_file)
+                os.replace(tmp_path, self._path(server))
+            except OSError as e:
+                logger.warning(f"No se pudo guardar el índice de bibliotecas de {server.name}: {str(e)}")
+
+
+scan_index = LibraryScanIndex()
@@ -0,0 +1,59 @@
+from typing import Any, Dict, List
+
+from config import PLEX_SERVERS, PLEX_TIMEOUT
+
+
+class Server:
+    """Servidor Plex configurado.
+
+    `index` es su posición en la lista (la usan el pool y las cachés) e `id` su
+    identificador estable, el que viaja en los botones. Los teclados propios del
+    servidor se construyen una vez al arrancar y se guardan aquí.
+    """
+
+    __slots__ = ('index', 'id', 'name', 'url', 'token', 'timeout', 'glances_url', 'path_map', 'options_markup',
+                 'back_markup')
+
+    def __init__(self, index: int, config: dict):
+        self.index = index
+        self.id = config['id']
+        self.name = config['name']
+        self.url = config['url']
+        self.token = config['token']
+        self.timeout = config.get('timeout', PLEX_TIMEOUT)
+        self.glances_url = config.get('glances_url')
+        # Prefijos más largos primero, para que /data/tv gane a /data
+        self.path_map = sorted((config.get('path_map') or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.options_markup: Any = None
+        self.back_markup: Any = None
+
+    def local_path(self, plex_path: str) -> str:
+        """Ruta de Plex traducida a la ruta con la que el bot ve la misma carpeta."""
+        for plex_prefix, local_prefix in self.path_map:
+            if plex_path == plex_prefix or plex_path.startswith(plex_prefix.rstrip('/') + '/'):
+                return local_prefix.rstrip('/') + plex_path[len(plex_prefix.rstrip('/')):]
+        return plex_path
+
+    def plex_path(self, local_path: str) -> str:
+        """Inversa de local_path()."""
+        for plex_prefix, local_prefix in sorted(self.path_map, key=lambda item: len(item[1]), reverse=True):
+            if local_path == local_prefix or local_path.startswith(local_prefix.rstrip('/') + '/'):
+                return plex_prefix.rstrip('/') + local_path[len(local_prefix.rstrip('/')):]
+        return local_path
+
+    def __repr__(self) -> str:
+        return f"Server({self.id!r}, {self.name!r})"
+
+
+SERVERS: List[Server] = [Server(index, config) for index, config in enumerate(PLEX_SERVERS)]
+_servers_by_id: Dict[str, Server] = {server.id: server for server in SERVERS}
+if len(_servers_by_id) != len(SERVERS):
+    raise ValueError("Hay servidores Plex con el mismo id en la configuración")
+
+
+def server_by_id(server_id: str) -> Server:
+    """Servidor con ese id; ValueError si no existe (por ejemplo, un botón de una configuración anterior)."""
+    server = _servers_by_id.get(server_id)
+    if server is None:
+        raise ValueError(f"Servidor inexistente: {server_id}")
+    return server
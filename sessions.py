@@ -0,0 +1,364 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+from plexapi.exceptions import BadRequest, NotFound
+
+from config import SESSION_CACHE_TTL, PLEX_LIVE_MAX_AGE, STOP_PARALLELISM, STOP_RETRIES, STOP_RETRY_BACKOFF
+from plex_pool import plex_pool, ServerResult
+from servers import SERVERS, Server
+
+logger = logging.getLogger(__name__)
+
+# Resolución original de los elementos que se están transcodificando, por (servidor, ratingKey): no cambia
+# mientras dura la reproducción, así que basta con pedirla una vez
+_SOURCE_RESOLUTIONS_SIZE = 1024
+_source_resolutions: 'OrderedDict[Tuple[int, str], Optional[str]]' = OrderedDict()
+_source_resolutions_lock = threading.Lock()
+
+
+def resolution_label(width: Optional[int], height: Optional[int]) -> Optional[str]:
+    """Etiqueta de Plex ('4k', '1080', '720'...) para unas dimensiones. Manda el ancho: una película
+    panorámica en 1080p mide 1920x800."""
+    if not width and not height:
+        return None
+    width, height = width or 0, height or 0
+    if width >= 3200 or height >= 2000:
+        return '4k'
+    if width >= 1700 or height >= 1000:
+        return '1080'
+    if width >= 1200 or height >= 700:
+        return '720'
+    if height >= 576 or width >= 1000:
+        return '576'
+    if height >= 480 or width >= 700:
+        return '480'
+    return 'sd'
+
+
+def _cached_source_resolution(key: Tuple[int, str]) -> Tuple[bool, Optional[str]]:
+    with _source_resolutions_lock:
+        if key not in _source_resolutions:
+            return False, None
+        _source_resolutions.move_to_end(key)
+        return True, _source_resolutions[key]
+
+
+def source_resolution(session: 'SessionRecord') -> Optional[str]:
+    """Resolución del contenido original de la sesión.
+
+    Con transcode de vídeo, el <Media> de /status/sessions describe el stream
+    ya transcodificado, así que la original se lee de los metadatos del
+    elemento. Esa petición no se hace al extraer las sesiones (iría dentro de
+    la consulta de cada instantánea, una por transcode) sino aquí, cuando
+    alguien la necesita de verdad, y solo la primera vez.
+    """
+    if session.video_resolution or not session.transcode_video:
+        return session.video_resolution
+    key = (session.server_index, session.rating_key)
+    found, resolution = _cached_source_resolution(key)
+    if found:
+        return resolution
+    try:
+        container = plex_pool.run(session.server_index, lambda plex: plex.query(session.item_key))
+    except Exception as e:
+        # No se guarda: se vuelve a intentar la próxima vez
+        logger.warning(f"No se pudo leer la resolución original de {session.title}: {str(e)}")
+        return None
+    media = container.find('.//Media')
+    resolution = media.attrib.get('videoResolution') if media is not None else None
+    with _source_resolutions_lock:
+        _source_resolutions[key] = resolution
+        if len(_source_resolutions) > _SOURCE_RESOLUTIONS_SIZE:
+            _source_resolutions.popitem(last=False)
+    return resolution
+
+
+class SessionRecord:
+    """Datos de una reproducción extraídos una sola vez de la sesión de plexapi.
+
+    `video_resolution` es la del contenido original; la de cada transcode va en `transcodes`. Si se
+    transcodifica el vídeo y aún no se conoce (ver source_resolution), queda en None.
+    """
+
+    __slots__ = (
+        'server_index', 'session_key', 'session_id', 'rating_key', 'item_key', 'username', 'media_type', 'title',
+        'grandparent_title', 'view_offset', 'duration', 'player_title', 'player_address',
+        'player_device', 'location', 'video_resolution', 'bitrate', 'transcode_video',
+        'transcode_audio', 'transcodes',
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def replace(self, **changes) -> 'SessionRecord':
+        """Copia con algunos campos cambiados: los registros publicados no se modifican nunca."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return SessionRecord(**fields)
+
+    @classmethod
+    def from_plex(cls, server_index: int, session) -> 'SessionRecord':
+        media = session.media[0] if getattr(session, 'media', None) else None
+        player = session.player
+        video_resolution = media.videoResolution if media else None
+        if any(ts.videoDecision == 'transcode' for ts in session.transcodeSessions):
+            # La del <Media> sería la del stream transcodificado; la original solo si ya se pidió antes
+            video_resolution = _cached_source_resolution((server_index, str(session.ratingKey)))[1]
+        transcodes = [
+            {
+                'video_decision': ts.videoDecision,
+                'audio_decision': ts.audioDecision,
+                'source_video_codec': getattr(ts, 'sourceVideoCodec', None),
+                'video_codec': getattr(ts, 'videoCodec', None),
+                'source_video_resolution': video_resolution,
+                'video_resolution': resolution_label(ts.width, ts.height) if ts.videoDecision == 'transcode' else None,
+                'source_audio_codec': getattr(ts, 'sourceAudioCodec', None),
+                'audio_codec': getattr(ts, 'audioCodec', None),
+                'source_audio_channels': getattr(ts, 'sourceAudioChannels', None),
+                'audio_channels': getattr(ts, 'audioChannels', None),
+                'transcode_reason': getattr(ts, 'transcodeReason', None),
+            }
+            for ts in session.transcodeSessions
+        ]
+        return cls(
+            server_index=server_index,
+            session_key=str(session.sessionKey),
+            session_id=session.session.id if session.session else None,
+            rating_key=str(session.ratingKey),
+            item_key=session.key,
+            username=session.usernames[0] if session.usernames else 'Desconocido',
+            media_type=session.type,
+            title=session.title,
+            grandparent_title=getattr(session, 'grandparentTitle', None),
+            view_offset=session.viewOffset or 0,
+            duration=session.duration or 0,
+            player_title=player.title if player else 'Desconocido',
+            player_address=player.address if player else None,
+            player_device=(player.device or player.product) if player else None,
+            location=session.session.location if session.session else None,
+            video_resolution=video_resolution,
+            bitrate=media.bitrate if media else None,
+            transcode_video=any(t['video_decision'] == 'transcode' for t in transcodes),
+            transcode_audio=any(t['audio_decision'] == 'transcode' for t in transcodes),
+            transcodes=transcodes,
+        )
+
+    @property
+    def type_label(self) -> str:
+        if self.media_type == 'movie':
+            return 'Película'
+        if self.media_type == 'episode':
+            return 'Episodio'
+        return self.media_type.capitalize()
+
+    @property
+    def full_title(self) -> str:
+        if self.media_type == 'episode':
+            return f"{self.grandparent_title} - {self.title}"
+        return self.title
+
+    @property
+    def progress_minutes(self) -> int:
+        return self.view_offset // 60000
+
+    @property
+    def transcoding(self) -> bool:
+        return self.transcode_video or self.transcode_audio
+
+
+class SessionSnapshotCache:
+    """Instantánea de las sesiones de cada servidor con caducidad corta.
+
+    Las peticiones simultáneas para el mismo servidor comparten una única
+    consulta a Plex (single-flight). Las acciones que cambian el estado, como
+    detener una reproducción, deben llamar a invalidate().
+
+    Mientras un servidor está en modo `live` (un SessionListener le publica
+    los cambios), su instantánea dura hasta `live_max_age` sin renovarse; solo
+    max_age=0 fuerza la consulta antes. El límite cubre un listener que se
+    quede colgado sin darse cuenta de que ha perdido la conexión.
+    """
+
+    def __init__(self, servers: List[Server], ttl: float = SESSION_CACHE_TTL, live_max_age: float = PLEX_LIVE_MAX_AGE):
+        self._ttl = ttl
+        self._live_max_age = live_max_age
+        self._entries: Dict[int, Tuple[float, List[SessionRecord]]] = {}
+        self._generations = [0] * len(servers)
+        self._locks = [threading.Lock() for _ in servers]
+        self._live = [False] * len(servers)
+        self._subscribers: List[Callable[[int, List[SessionRecord]], None]] = []
+
+    def subscribe(self, callback: Callable[[int, List[SessionRecord]], None]) -> None:
+        """Llama a `callback(índice, sesiones)` con cada instantánea nueva de un servidor."""
+        self._subscribers.append(callback)
+
+    def _notify(self, index: int, records: List[SessionRecord]) -> None:
+        for callback in self._subscribers:
+            try:
+                callback(index, records)
+            except Exception as e:
+                logger.error(f"Error al procesar la instantánea de sesiones del servidor {index}: {str(e)}")
+
+    def _fresh(self, index: int, entry, max_age: float) -> bool:
+        if entry is None:
+            return False
+        if self._live[index] and max_age > 0:
+            max_age = max(max_age, self._live_max_age)
+        return time.monotonic() - entry[0] < max_age
+
+    def get(self, index: int, max_age: Optional[float] = None) -> List[SessionRecord]:
+        """Devuelve las sesiones del servidor, consultando a Plex solo si la instantánea ha caducado."""
+        max_age = self._ttl if max_age is None else max_age
+        entry = self._entries.get(index)
+        if self._fresh(index, entry, max_age):
+            return entry[1]
+        with self._locks[index]:
+            # Otra petición pudo completar la consulta mientras esperábamos el candado
+            entry = self._entries.get(index)
+            if self._fresh(index, entry, max_age):
+                return entry[1]
+            generation = self._generations[index]
+            sessions = plex_pool.run(index, lambda plex: plex.sessions())
+            records = [SessionRecord.from_plex(index, session) for session in sessions]
+            # Si entretanto se detuvo una sesión o llegó una publicación, la consulta ya está anticuada:
+            # se devuelve a quien la pidió, pero ni se guarda ni se reparte a los suscriptores
+            current = generation == self._generations[index]
+            if current:
+                self._entries[index] = (time.monotonic(), records)
+        if current:
+            self._notify(index, records)
+        return records
+
+    def get_all(self, max_age: Optional[float] = None) -> List[ServerResult]:
+        """Sesiones de todos los servidores consultadas en paralelo, con marcas de error por servidor."""
+        return plex_pool.map_servers(lambda index: self.get(index, max_age))
+
+    def find(self, index: int, session_key: str) -> Optional[SessionRecord]:
+        """Busca una sesión por su clave, refrescando una vez si no está en la instantánea."""
+        session = next((s for s in self.get(index) if s.session_key == str(session_key)), None)
+        if session is None:
+            session = next((s for s in self.get(index, max_age=0) if s.session_key == str(session_key)), None)
+        return session
+
+    def publish(self, index: int, records: List[SessionRecord]) -> None:
+        """Sustituye la instantánea del servidor por la tabla que mantiene su SessionListener."""
+        with self._locks[index]:
+            self._generations[index] += 1
+            self._entries[index] = (time.monotonic(), records)
+        self._notify(index, records)
+
+    def set_live(self, index: int, live: bool) -> None:
+        """Activa o desactiva el modo live del servidor (al conectar o perder el websocket)."""
+        self._live[index] = live
+
+    def invalidate(self, index: Optional[int] = None) -> None:
+        """Descarta la instantánea de un servidor (o de todos) tras un cambio de estado."""
+        indices = range(len(self._generations)) if index is None else [index]
+        for i in indices:
+            self._generations[i] += 1
+            self._entries.pop(i, None)
+
+
+def stop_session(session: SessionRecord, reason: str) -> None:
+    """Detiene una reproducción y descarta la instantánea de su servidor."""
+    params = {'sessionId': session.session_id, 'reason': reason}
+    try:
+        plex_pool.run(session.server_index, lambda plex: plex.query('/status/sessions/terminate', params=params))
+    finally:
+        session_cache.invalidate(session.server_index)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Errores que merece la pena reintentar: red, timeouts y respuestas 5xx de Plex."""
+    if isinstance(error, requests.RequestException):
+        return True
+    return isinstance(error, BadRequest) and str(error).startswith('(5')
+
+
+STOPPED = 'detenida'
+GONE = 'ya no estaba'
+FAILED = 'error'
+
+
+class StopOutcome(NamedTuple):
+    session: SessionRecord
+    status: str
+    error: Optional[str] = None
+
+
+class BulkStopJob:
+    """Detiene todas las reproducciones de varios servidores a la vez.
+
+    Las sesiones se piden a Plex al empezar (sin usar la instantánea) y las
+    paradas se lanzan en paralelo con un máximo de `parallelism` a la vez. Los
+    fallos transitorios se reintentan con espera creciente; una sesión que Plex
+    ya no conoce cuenta como "ya no estaba". El progreso se puede leer desde
+    otro hilo mientras run() está en marcha.
+    """
+
+    def __init__(self, indices: List[int], reason: str, parallelism: int = STOP_PARALLELISM,
+                 retries: int = STOP_RETRIES, backoff: float = STOP_RETRY_BACKOFF):
+        self.indices = list(indices)
+        self.reason = reason
+        self.parallelism = parallelism
+        self.retries = retries
+        self.backoff = backoff
+        self.totals: Dict[int, int] = {}
+        self.outcomes: Dict[int, List[StopOutcome]] = {index: [] for index in self.indices}
+        self.server_errors: Dict[int, str] = {}
+        self.done = False
+        self._lock = threading.Lock()
+
+    def _stop(self, session: SessionRecord) -> StopOutcome:
+        for attempt in range(self.retries + 1):
+            try:
+                stop_session(session, self.reason)
+                return StopOutcome(session, STOPPED)
+            except NotFound:
+                return StopOutcome(session, GONE)
+            except Exception as e:
+                if attempt == self.retries or not _is_transient(e):
+                    logger.error(f"No se pudo detener la sesión {session.session_key} de {session.username}: {str(e)}")
+                    return StopOutcome(session, FAILED, str(e))
+                logger.warning(f"Fallo transitorio al detener la sesión {session.session_key}, reintentando: {str(e)}")
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _record(self, outcome: StopOutcome) -> None:
+        with self._lock:
+            self.outcomes[outcome.session.server_index].append(outcome)
+
+    def run(self) -> 'BulkStopJob':
+        try:
+            # El mantenimiento debe actuar sobre el estado real, no sobre una instantánea
+            sessions = []
+            for result in plex_pool.map_servers(lambda index: session_cache.get(index, max_age=0), self.indices):
+                if result.ok:
+                    self.totals[result.index] = len(result.value)
+                    sessions.extend(result.value)
+                else:
+                    self.server_errors[result.index] = result.error
+            with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix='stop') as executor:
+                for session in sessions:
+                    executor.submit(self._stop, session).add_done_callback(lambda future: self._record(future.result()))
+        finally:
+            self.done = True
+        return self
+
+    def counts(self, index: int) -> Dict[str, int]:
+        """Cuántas sesiones del servidor van detenidas, ya no estaban, han fallado o siguen pendientes."""
+        with self._lock:
+            outcomes = list(self.outcomes[index])
+        counts = {STOPPED: 0, GONE: 0, FAILED: 0}
+        for outcome in outcomes:
+            counts[outcome.status] += 1
+        counts['pendientes'] = self.totals.get(index, 0) - len(outcomes)
+        return counts
+
+
+session_cache = SessionSnapshotCache(SERVERS)
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from config import SHARING_STALE_AFTER, SHARING_WINDOW_HOURS
+from sessions import session_cache, SessionRecord
+
+logger = logging.getLogger(__name__)
+
+
+class StreamSighting:
+    """Una reproducción de un usuario: dónde, desde qué IP y dispositivo, y cuándo se vio."""
+
+    __slots__ = ('server_index', 'session_key', 'ip', 'device', 'title', 'started_at', 'seen_at', 'ended_at')
+
+    def __init__(self, session: SessionRecord, now: float):
+        self.server_index = session.server_index
+        self.session_key = session.session_key
+        self.ip = session.player_address
+        self.device = session.player_device or session.player_title
+        self.title = session.full_title
+        self.started_at = now
+        self.seen_at = now
+        self.ended_at: Optional[float] = None
+
+
+class SharingIncident(NamedTuple):
+    """Momento en que un usuario tenía reproducciones simultáneas desde varias IP."""
+    username: str
+    at: float
+    sightings: Tuple[StreamSighting, ...]
+
+    @property
+    def ips(self) -> List[str]:
+        return sorted({sighting.ip for sighting in self.sightings if sighting.ip})
+
+
+class SharingIndex:
+    """Índice de reproducciones por usuario en una ventana deslizante.
+
+    Se alimenta de cada instantánea nueva de session_cache (observe()): las
+    sesiones que aparecen abren un StreamSighting y las que desaparecen lo
+    cierran. Cuando un usuario pasa a tener reproducciones activas desde más de
+    una IP, en cualquier servidor, se registra un SharingIncident y se avisa a
+    `on_incident`. Las consultas sobre las últimas horas se responden con el
+    índice, sin volver a preguntar a los servidores.
+
+    Una reproducción que no aparece en ninguna instantánea durante
+    `stale_after` segundos se da por terminada: si su servidor deja de
+    responder, sus últimas sesiones no cuentan como activas para siempre.
+    """
+
+    def __init__(self, window_hours: float = SHARING_WINDOW_HOURS, stale_after: float = SHARING_STALE_AFTER):
+        self._window = window_hours * 3600
+        self._stale_after = stale_after
+        self._sightings: Dict[str, Dict[Tuple[int, str], StreamSighting]] = {}
+        self._active: Dict[int, Dict[str, str]] = {}  # servidor -> clave de sesión -> usuario
+        self._incidents: Deque[SharingIncident] = deque()
+        self._flagged: Dict[str, frozenset] = {}  # IPs del último aviso de cada usuario mientras dura
+        self._lock = threading.Lock()
+        self.on_incident: Optional[Callable[[SharingIncident], None]] = None
+
+    def _active_sightings(self, username: str) -> List[StreamSighting]:
+        return [s for s in self._sightings.get(username, {}).values() if s.ended_at is None]
+
+    def _expire_stale(self, now: float) -> None:
+        limit = now - self._stale_after
+        for index, active in self._active.items():
+            for session_key, username in list(active.items()):
+                sighting = self._sightings.get(username, {}).get((index, session_key))
+                if sighting is None or sighting.seen_at < limit:
+                    if sighting is not None and sighting.ended_at is None:
+                        sighting.ended_at = sighting.seen_at
+                    del active[session_key]
+
+    def _prune(self, now: float) -> None:
+        since = now - self._window
+        while self._incidents and self._incidents[0].at < since:
+            self._incidents.popleft()
+        for username in list(self._sightings):
+            sightings = self._sightings[username]
+            for key in [key for key, s in sightings.items() if s.ended_at is not None and s.ended_at < since]:
+                del sightings[key]
+            if not sightings:
+                del self._sightings[username]
+
+    def observe(self, index: int, sessions: List[SessionRecord]) -> None:
+        """Aplica la instantánea actual de un servidor al índice."""
+        now = time.time()
+        incidents = []
+        with self._lock:
+            previous = self._active.get(index, {})
+            current = {session.session_key: session.username for session in sessions}
+            touched = set(previous.values()) | set(current.values())
+            for session_key, username in previous.items():
+                if current.get(session_key) != username:
+                    sighting = self._sightings.get(username, {}).get((index, session_key))
+                    if sighting is not None:
+                        sighting.ended_at = now
+            for session in sessions:
+                user_sightings = self._sightings.setdefault(session.username, {})
+                key = (index, session.session_key)
+                if key not in user_sightings or user_sightings[key].ended_at is not None:
+                    user_sightings[key] = StreamSighting(session, now)
+                user_sightings[key].seen_at = now
+            self._active[index] = current
+            self._expire_stale(now)
+
+            for username in touched:
+                active = self._active_sightings(username)
+                ips = frozenset(s.ip for s in active if s.ip)
+                if len(ips) < 2:
+                    self._flagged.pop(username, None)
+                elif not ips <= self._flagged.get(username, frozenset()):
+                    # Solo se avisa de nuevo si aparece una IP que no estaba en el aviso anterior
+                    self._flagged[username] = ips
+                    incident = SharingIncident(username, now, tuple(active))
+                    self._incidents.append(incident)
+                    incidents.append(incident)
+            self._prune(now)
+
+        for incident in incidents:
+            logger.info(f"Posible cuenta compartida: {incident.username} desde {', '.join(incident.ips)}")
+            if self.on_incident is not None:
+                try:
+                    self.on_incident(incident)
+                except Exception as e:
+                    logger.error(f"Error al avisar de una cuenta compartida: {str(e)}")
+
+    def shared_since(self, hours: float) -> Dict[str, List[SharingIncident]]:
+        """Usuarios con reproducciones simultáneas desde varias IP en las últimas `hours` horas."""
+        since = time.time() - hours * 3600
+        shared: Dict[str, List[SharingIncident]] = {}
+        with self._lock:
+            for incident in self._incidents:
+                if incident.at >= since:
+                    shared.setdefault(incident.username, []).append(incident)
+        return shared
+
+    def history(self, username: str) -> List[StreamSighting]:
+        """Reproducciones del usuario dentro de la ventana, de la más reciente a la más antigua."""
+        with self._lock:
+            sightings = list(self._sightings.get(username, {}).values())
+        return sorted(sightings, key=lambda sighting: sighting.started_at, reverse=True)
+
+
+sharing_index = SharingIndex()
+session_cache.subscribe(sharing_index.observe)
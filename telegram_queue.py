@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram.error import BadRequest, RetryAfter
+
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+def is_not_modified(error: Exception) -> bool:
+    """Telegram responde así a una edición que deja el mensaje igual; no es un fallo real."""
+    return isinstance(error, BadRequest) and 'message is not modified' in str(error).lower()
+
+
+class TokenBucket:
+    """Cubo de fichas: admite ráfagas de `burst` envíos y después `rate` por segundo."""
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated: Optional[float] = None
+        self._blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def block(self, seconds: float) -> None:
+        """Tras un 429 no se envía nada hasta que pase `retry_after`."""
+        loop = asyncio.get_running_loop()
+        self._blocked_until = max(self._blocked_until, loop.time() + seconds)
+
+    async def acquire(self) -> None:
+        # El candado se crea dentro del bucle del bot (en Python 3.9 se ata al bucle al crearlo)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                if self._updated is not None:
+                    self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class _PendingEdit:
+    __slots__ = ('kwargs', 'future', 'owner')
+
+    def __init__(self, kwargs: dict, future: asyncio.Future, owner: object):
+        self.kwargs = kwargs
+        self.future = future
+        # Quien aportó el contenido que se acabará enviando
+        self.owner = owner
+
+
+class OutboundQueue:
+    """Todas las llamadas salientes a Telegram pasan por aquí.
+
+    Cada envío espera turno en el cubo de su chat y en el global. Los mensajes
+    nuevos en grupos tienen su propio cubo, más estricto (unos 20 por minuto);
+    las ediciones, que son las respuestas a los botones, van aparte y no
+    esperan a que se recargue el de los mensajes. Un 429 bloquea el chat y el
+    global durante `retry_after` y se reintenta. Las ediciones de un mismo
+    mensaje que esperan turno se funden en la última: quien llegó antes recibe
+    el resultado de la que se envía. Si esa edición falla, solo le llega el
+    error a quien aportó su contenido (y hace, por ejemplo, el reenvío); los
+    demás reciben None. Una edición que no cambia nada ("message is not
+    modified") se da por buena.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 group_rate: float = TELEGRAM_GROUP_RATE, retries: int = TELEGRAM_RETRIES):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._group_rate = group_rate
+        self._retries = retries
+        self._chats: Dict[Tuple[int, bool], TokenBucket] = {}
+        self._pending: Dict[Tuple[int, int, str], _PendingEdit] = {}
+        self.coalesced = 0
+        self.throttled = 0
+
+    def _bucket(self, chat_id: int, editing: bool) -> TokenBucket:
+        bucket = self._chats.get((chat_id, editing))
+        if bucket is None:
+            # Los grupos y canales (id negativo) admiten unos 20 mensajes nuevos por minuto; las ediciones
+            # y los chats privados, alrededor de 1 por segundo
+            rate = self._group_rate / 60 if chat_id < 0 and not editing else self._chat_rate
+            bucket = self._chats[(chat_id, editing)] = TokenBucket(rate, 3)
+        return bucket
+
+    async def _call(self, chat_id: int, func: Callable[..., Awaitable[Any]], get_kwargs: Callable[[], dict],
+                    on_turn: Callable[[], None] = lambda: None, editing: bool = False) -> Any:
+        bucket = self._bucket(chat_id, editing)
+        for attempt in range(self._retries + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            on_turn()
+            kwargs = get_kwargs()
+            if attempt:
+                # PTB lee los ficheros (BytesIO...) al preparar la petición: sin rebobinar se reenviarían vacíos
+                for value in kwargs.values():
+                    if hasattr(value, 'seek'):
+                        value.seek(0)
+            try:
+                return await func(**kwargs)
+            except RetryAfter as e:
+                delay = e.retry_after
+                retry_after = delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+                self.throttled += 1
+                logger.warning(f"Telegram pide esperar {retry_after:.0f} s antes de volver a escribir en {chat_id}")
+                bucket.block(retry_after)
+                self._global.block(retry_after)
+                if attempt == self._retries:
+                    raise
+
+    async def send(self, func: Callable[..., Awaitable[Any]], **kwargs) -> Any:
+        """Envía respetando los límites: `func` es el método del bot (send_message, send_photo...)."""
+        return await self._call(kwargs['chat_id'], func, lambda: kwargs)
+
+    async def edit(self, func: Callable[..., Awaitable[Any]], **kwargs) -> Any:
+        """Edita un mensaje fundiendo las ediciones pendientes del mismo; None si no había nada que cambiar."""
+        chat_id = kwargs['chat_id']
+        key = (chat_id, kwargs['message_id'], func.__name__)
+        caller = object()
+        pending = self._pending.get(key)
+        if pending is not None:
+            # Todavía no le ha llegado el turno: basta con que envíe el contenido más reciente
+            pending.kwargs = kwargs
+            pending.owner = caller
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending.future)
+            except Exception:
+                if pending.owner is caller:
+                    raise
+                return None
+
+        pending = self._pending[key] = _PendingEdit(kwargs, asyncio.get_running_loop().create_future(), caller)
+
+        def on_turn():
+            # Desde aquí, una edición nueva del mensaje ya no se puede fundir con esta
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+
+        try:
+            result = await self._call(chat_id, func, lambda: pending.kwargs, on_turn, editing=True)
+        except asyncio.CancelledError:
+            on_turn()
+            pending.future.cancel()
+            raise
+        except Exception as e:
+            on_turn()
+            if is_not_modified(e):
+                result = None
+            else:
+                pending.future.set_exception(e)
+                pending.future.exception()  # no avisar de excepción sin leer si nadie más la espera
+                if pending.owner is caller:
+                    raise
+                return None
+        pending.future.set_result(result)
+        return result
+
+
+outbox = OutboundQueue()
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from actions import ActionStore, MAINTENANCE, STOP_STREAM
+from sessions import SessionRecord
+from tokens import TokenStore
+
+
+def test_token_expires_after_ttl():
+    store = TokenStore(maxsize=10, ttl=0.1)
+    token = store.put('valor')
+    assert store.get(token) == 'valor'
+    time.sleep(0.15)
+    assert store.get(token) is None
+    assert len(store) == 0
+
+
+def test_least_recently_used_token_is_evicted_at_the_size_limit():
+    store = TokenStore(maxsize=3, ttl=60)
+    first, second, third = (store.put(value) for value in 'abc')
+    # Usar el primero lo hace reciente: el descartado es el segundo
+    assert store.get(first) == 'a'
+    fourth = store.put('d')
+    assert len(store) == 3
+    assert store.get(second) is None
+    assert [store.get(token) for token in (first, third, fourth)] == ['a', 'c', 'd']
+
+
+def test_tokens_fit_in_callback_data():
+    store = TokenStore(maxsize=10, ttl=60)
+    assert len(store.put('valor').encode('utf-8')) == 8
+
+
+def test_maintenance_action_runs_once():
+    actions = ActionStore(maxsize=10, ttl=60)
+    token = actions.maintenance([0, 2])
+    action = actions.pop(token, MAINTENANCE)
+    assert action.server_indices == (0, 2)
+    # Un segundo toque al botón no encuentra nada que hacer
+    assert actions.pop(token, MAINTENANCE) is None
+
+
+def test_stop_action_can_be_read_many_times():
+    actions = ActionStore(maxsize=10, ttl=60)
+    session = SessionRecord(server_index=1, session_key='7', username='carol')
+    token = actions.stop_stream(session)
+    assert actions.get(token, STOP_STREAM).session is session
+    assert actions.get(token, STOP_STREAM).session is session
+    assert actions.pop(token, STOP_STREAM).session is session
+    assert actions.get(token, STOP_STREAM) is None
+
+
+def test_token_of_another_kind_is_ignored():
+    actions = ActionStore(maxsize=10, ttl=60)
+    token = actions.maintenance([0])
+    assert actions.pop(token, STOP_STREAM) is None
+    # Y no se consume por haberlo pedido con otro tipo
+    assert actions.get(token, MAINTENANCE) is not None
+
+
+def test_simultaneous_taps_get_the_maintenance_action_once():
+    actions = ActionStore(maxsize=10, ttl=60)
+    token = actions.maintenance([0])
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: actions.pop(token, MAINTENANCE), range(64)))
+    assert sum(result is not None for result in results) == 1
@@ -0,0 +1,98 @@
+import threading
+import types
+
+import pytest
+import requests
+from plexapi.exceptions import BadRequest, NotFound
+
+import sessions
+from plex_pool import PlexConnectionPool
+from servers import Server
+from sessions import BulkStopJob, SessionRecord, FAILED, GONE, STOPPED
+
+
+def record(server_index: int, session_key: str) -> SessionRecord:
+    return SessionRecord(server_index=server_index, session_key=session_key, session_id=f"s{session_key}",
+                         username=f"usuario{session_key}")
+
+
+@pytest.fixture
+def env(monkeypatch):
+    servers = [Server(index, {'id': str(index), 'name': f"Servidor {index}", 'url': 'http://127.0.0.1:1',
+                              'token': 'token'}) for index in range(2)]
+    # Por servidor: lista de sesiones o excepción al pedirlas
+    tables = {0: [record(0, '1'), record(0, '2')], 1: [record(1, '3'), record(1, '4')]}
+    # Por sesión: errores que dará cada intento antes de detenerse
+    failures = {}
+    attempts = {}
+    lock = threading.Lock()
+
+    def get(index, max_age=None):
+        if isinstance(tables[index], Exception):
+            raise tables[index]
+        return tables[index]
+
+    def stop_session(session, reason):
+        with lock:
+            attempts[session.session_key] = attempts.get(session.session_key, 0) + 1
+            pending = failures.get(session.session_key, [])
+            if pending:
+                raise pending.pop(0)
+
+    monkeypatch.setattr(sessions, 'plex_pool', PlexConnectionPool(servers, reconnect_interval=0))
+    monkeypatch.setattr(sessions, 'session_cache', types.SimpleNamespace(get=get))
+    monkeypatch.setattr(sessions, 'stop_session', stop_session)
+    return types.SimpleNamespace(tables=tables, failures=failures, attempts=attempts)
+
+
+def statuses(job: BulkStopJob):
+    return {outcome.session.session_key: outcome.status for outcomes in job.outcomes.values() for outcome in outcomes}
+
+
+def test_transient_failure_is_retried_until_it_succeeds(env):
+    env.failures['2'] = [requests.ConnectionError("reset"), BadRequest("(503) service_unavailable")]
+    job = BulkStopJob([0, 1], "mantenimiento", retries=2, backoff=0.01).run()
+
+    assert job.done
+    assert job.totals == {0: 2, 1: 2}
+    assert statuses(job) == {'1': STOPPED, '2': STOPPED, '3': STOPPED, '4': STOPPED}
+    assert env.attempts['2'] == 3
+
+
+def test_partial_failure(env):
+    env.tables[1] = requests.ConnectionError("servidor caído")
+    # Un error permanente no se reintenta; uno transitorio se rinde al agotar los reintentos
+    env.failures['1'] = [BadRequest("(401) unauthorized")]
+    env.failures['2'] = [requests.Timeout("lento")] * 5
+
+    job = BulkStopJob([0, 1], "mantenimiento", retries=1, backoff=0.01).run()
+
+    assert job.done
+    assert job.totals == {0: 2}
+    assert 1 in job.server_errors
+    assert statuses(job) == {'1': FAILED, '2': FAILED}
+    assert env.attempts == {'1': 1, '2': 2}
+    errors = {outcome.session.session_key: outcome.error for outcome in job.outcomes[0]}
+    assert "(401)" in errors['1']
+
+
+def test_session_already_gone(env):
+    env.failures['3'] = [NotFound("no existe")]
+    job = BulkStopJob([1], "mantenimiento", retries=2, backoff=0.01).run()
+    assert statuses(job) == {'3': GONE, '4': STOPPED}
+    assert env.attempts['3'] == 1
+
+
+def test_progress_is_readable_while_running(env, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(sessions, 'stop_session', lambda session, reason: release.wait(5))
+    job = BulkStopJob([0, 1], "mantenimiento", parallelism=1, retries=0)
+    thread = threading.Thread(target=job.run)
+    thread.start()
+    # Con las paradas bloqueadas, el trabajo sigue en marcha y sin resultados
+    assert not job.done
+    assert not any(job.outcomes.values())
+    release.set()
+    thread.join(5)
+    assert job.done
+    assert sum(len(outcomes) for outcomes in job.outcomes.values()) == 4
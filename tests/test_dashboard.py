@@ -0,0 +1,64 @@
+import asyncio
+import types
+
+from telegram.error import BadRequest
+
+import dashboard
+from dashboard import LiveDashboard
+
+CHAT = -1001
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+        self.fail_edits = False
+
+    async def send(self, func, **kwargs):
+        self.sent.append(func.__name__)
+        return types.SimpleNamespace(message_id=42)
+
+    async def edit(self, func, **kwargs):
+        if self.fail_edits:
+            raise BadRequest("Message to edit not found")
+        self.edits.append(kwargs['text'])
+
+
+def fake_bot():
+    def method(name):
+        async def call(**kwargs):
+            pass
+        call.__name__ = name
+        return call
+    return types.SimpleNamespace(**{name: method(name) for name in (
+        'send_message', 'pin_chat_message', 'unpin_chat_message', 'edit_message_text')})
+
+
+def test_identical_renders_are_not_sent_and_bad_request_stops_the_panel(monkeypatch):
+    outbox = FakeOutbox()
+    monkeypatch.setattr(dashboard, 'outbox', outbox)
+    text = {'value': "2 reproducciones"}
+
+    async def run():
+        panel = LiveDashboard(interval=0.02)
+        await panel.start(fake_bot(), CHAT, lambda: (text['value'], None))
+        await asyncio.sleep(0.15)
+        # Mientras nada cambia, el panel se recompone pero no edita
+        unchanged = (panel.stats.renders, len(outbox.edits))
+        text['value'] = "3 reproducciones"
+        await asyncio.sleep(0.1)
+        changed = len(outbox.edits)
+        # El mensaje se ha borrado: la siguiente edición falla y el panel se detiene
+        outbox.fail_edits = True
+        text['value'] = "1 reproducción"
+        await asyncio.sleep(0.1)
+        return panel, unchanged, changed
+
+    panel, (renders, edits_before), edits_after = asyncio.run(run())
+    assert outbox.sent == ['send_message', 'pin_chat_message']
+    assert renders >= 3 and edits_before == 0
+    assert edits_after == 1 and outbox.edits[0].startswith("3 reproducciones")
+    assert panel.stats.edits == 1
+    assert panel.stats.skipped == panel.stats.renders - 2
+    assert not panel.is_running(CHAT)
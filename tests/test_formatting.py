@@ -0,0 +1,44 @@
+import pytest
+
+import formatting
+from formatting import FragmentCache, session_block, transcode_details
+from sessions import SessionRecord
+
+TRANSCODE = {
+    'video_decision': 'transcode', 'audio_decision': 'copy', 'source_video_codec': 'hevc', 'video_codec': 'h264',
+    'source_video_resolution': '4k', 'video_resolution': '1080', 'source_audio_codec': None, 'audio_codec': None,
+    'source_audio_channels': None, 'audio_channels': None, 'transcode_reason': None,
+}
+
+
+def session(**fields) -> SessionRecord:
+    base = dict(server_index=0, session_key='7', username='carol', media_type='movie', title='Dune',
+                view_offset=600000, player_title='Salon', player_address='203.0.113.7',
+                transcode_video=False, transcode_audio=False, transcodes=[])
+    return SessionRecord(**{**base, **fields})
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    cache = FragmentCache(maxsize=100)
+    monkeypatch.setattr(formatting, 'fragment_cache', cache)
+    return cache
+
+
+def test_same_session_is_served_from_the_cache(cache):
+    assert session_block(session()) == session_block(session(view_offset=620000))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize('changes', [{'player_title': 'Móvil'}, {'username': 'dave'}])
+def test_block_follows_player_and_user_changes(changes):
+    session_block(session())
+    assert list(changes.values())[0] in session_block(session(**changes))
+
+
+def test_details_follow_the_stream_decision():
+    assert "No se está realizando" in transcode_details(session())
+    details = transcode_details(session(transcode_video=True, transcodes=[TRANSCODE]))
+    assert "Resolución Transcode:* 1080" in details
+    details = transcode_details(session(transcode_video=True, transcodes=[{**TRANSCODE, 'video_resolution': '720'}]))
+    assert "Resolución Transcode:* 720" in details
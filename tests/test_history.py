@@ -0,0 +1,26 @@
+import sqlite3
+import time
+
+from history import HistoryStore, SCHEMA
+from servers import Server
+
+
+def test_top_transcoders_counts_server_and_session_pairs(tmp_path):
+    path = str(tmp_path / 'history.db')
+    servers = [Server(0, {'id': '1', 'name': 'Uno', 'url': '', 'token': ''}),
+               Server(1, {'id': '12', 'name': 'Doce', 'url': '', 'token': ''})]
+    store = HistoryStore(servers, path=path)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    now = int(time.time())
+    # Servidor 1 + sesión 23 y servidor 12 + sesión 3 son sesiones distintas aunque "1"+"23" == "12"+"3"
+    connection.executemany('INSERT INTO playback VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        (now, '1', '23', 'alice', 'Peli', 1, 0, 8000, 'TV', '10.0.0.1', 0, 0),
+        (now, '12', '3', 'alice', 'Peli', 1, 0, 8000, 'TV', '10.0.0.2', 0, 0),
+    ])
+    connection.commit()
+    connection.close()
+
+    [total] = store.top_transcoders(now - 60)
+    assert total.username == 'alice'
+    assert total.sessions == 2
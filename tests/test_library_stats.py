@@ -0,0 +1,68 @@
+import types
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+import library_stats
+from library_stats import LibraryStatsCache, SectionStats
+
+
+class FakePlex:
+    """Una sección de películas: ratingKey -> updatedAt, con el filtro updatedAt>>= y la paginación de Plex."""
+
+    def __init__(self):
+        self.items = {}
+
+    def query(self, query, params):
+        since = int(query.split('updatedAt>>=')[1]) if 'updatedAt>>=' in query else None
+        keys = sorted(key for key, updated in self.items.items() if since is None or updated >= since)
+        start, size = params['X-Plex-Container-Start'], params['X-Plex-Container-Size']
+        container = ElementTree.Element('MediaContainer', totalSize=str(len(keys)))
+        for key in keys[start:start + size] if size else []:
+            video = ElementTree.SubElement(container, 'Video', ratingKey=key, title=f"Pelicula {key}",
+                                           addedAt=str(self.items[key]))
+            media = ElementTree.SubElement(video, 'Media', videoResolution='1080', videoCodec='h264')
+            ElementTree.SubElement(media, 'Part', size='1000')
+        return container
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1_000_000)
+    monkeypatch.setattr(library_stats, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def sync(cache, plex, section, clock, seconds):
+    clock.now += seconds
+    cache._sync_section(plex, section)
+
+
+def test_deletion_hidden_by_an_addition_is_dropped_by_the_full_sync(clock):
+    cache = LibraryStatsCache([], page_size=2, full_sync_interval=3600)
+    plex, section = FakePlex(), SectionStats('1', 'Películas', 'movie')
+    plex.items = {'1': clock.now - 100, '2': clock.now - 100, '3': clock.now - 100}
+    sync(cache, plex, section, clock, 0)
+    assert set(section.items) == {'1', '2', '3'} and section.size == 3000
+
+    # En la misma vuelta se borra una y aparece otra con una fecha de modificación anterior a la última
+    # sincronización (movida desde otra biblioteca, por ejemplo): el recuento cuadra
+    del plex.items['2']
+    plex.items['4'] = clock.now - 50
+    sync(cache, plex, section, clock, 900)
+    assert set(section.items) == {'1', '2', '3'}
+
+    # Pasado el intervalo de sincronización completa, lo borrado desaparece y lo nuevo aparece
+    sync(cache, plex, section, clock, 3600)
+    assert set(section.items) == {'1', '3', '4'}
+    assert section.size == 3000 and section.resolutions['1080'] == 3
+
+
+def test_deletion_that_changes_the_count_is_detected_right_away(clock):
+    cache = LibraryStatsCache([], page_size=2, full_sync_interval=3600)
+    plex, section = FakePlex(), SectionStats('1', 'Películas', 'movie')
+    plex.items = {'1': clock.now - 100, '2': clock.now - 100}
+    sync(cache, plex, section, clock, 0)
+    del plex.items['1']
+    sync(cache, plex, section, clock, 900)
+    assert set(section.items) == {'2'} and section.size == 1000
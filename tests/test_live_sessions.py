@@ -0,0 +1,286 @@
+import base64
+import hashlib
+import http.server
+import json
+import socket
+import struct
+import threading
+import time
+import types
+
+import pytest
+
+import live_sessions
+import sessions
+from live_sessions import NOTIFICATIONS_PATH, SessionListener
+from plex_pool import PlexConnectionPool
+from servers import Server
+from sessions import SessionSnapshotCache
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def sessions_xml(keys) -> bytes:
+    videos = b''.join(
+        b'<Video sessionKey="%s" ratingKey="%s" type="movie" title="Pelicula %s" viewOffset="60000" duration="7200000">'
+        b'<Media videoResolution="1080"/><User id="1" title="usuario%s"/>'
+        b'<Player title="TV" address="10.0.0.1" product="Plex"/><Session id="s%s" location="lan"/></Video>'
+        % ((key.encode(),) * 5)
+        for key in keys)
+    return b'<MediaContainer size="%d">%s</MediaContainer>' % (len(keys), videos)
+
+
+def read_frame(rfile):
+    head = rfile.read(2)
+    if len(head) < 2:
+        raise EOFError
+    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', rfile.read(8))[0]
+    mask = rfile.read(4) if head[1] & 0x80 else None
+    payload = rfile.read(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return opcode, payload
+
+
+def frame(opcode: int, payload: bytes) -> bytes:
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x80 | opcode, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, len(payload))
+    return header + payload
+
+
+class FakePlex(http.server.ThreadingHTTPServer):
+    """Plex falso en local: HTTP para /status/sessions y websocket de notificaciones en el mismo puerto."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.sessions = ['12', '13']
+        self.session_delay = 0.0
+        self.session_requests = 0
+        self.accept_websockets = True
+        self.answer_pings = True
+        self.websocket_attempts = []
+        self.clients = []
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), FakePlexHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def send(self, sock, opcode: int, payload: bytes) -> None:
+        with self.lock:
+            sock.sendall(frame(opcode, payload))
+
+    def notify(self, container: dict) -> None:
+        """Envía una notificación a todos los websockets abiertos."""
+        payload = json.dumps({'NotificationContainer': container}).encode()
+        for sock in list(self.clients):
+            self.send(sock, 0x1, payload)
+
+    def drop(self) -> None:
+        """Corta de golpe las conexiones websocket abiertas."""
+        for sock in list(self.clients):
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def close(self) -> None:
+        self.drop()
+        self.shutdown()
+        self.server_close()
+
+
+class FakePlexHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server: FakePlex = self.server
+        path = self.path.split('?')[0]
+        if path == NOTIFICATIONS_PATH:
+            return self._websocket()
+        if path == '/status/sessions':
+            server.session_requests += 1
+            # La respuesta refleja las sesiones del momento en que llegó la petición
+            body = sessions_xml(list(server.sessions))
+            time.sleep(server.session_delay)
+        elif path == '/':
+            body = b'<MediaContainer friendlyName="test" machineIdentifier="test" version="1.32.5"/>'
+        else:
+            body = b'<MediaContainer/>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _websocket(self):
+        server: FakePlex = self.server
+        server.websocket_attempts.append(time.monotonic())
+        if not server.accept_websockets:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        accept = base64.b64encode(hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WEBSOCKET_GUID).encode())
+                                  .digest()).decode()
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.wfile.flush()
+        sock = self.connection
+        server.clients.append(sock)
+        try:
+            while True:
+                opcode, payload = read_frame(self.rfile)
+                if opcode == 0x8:
+                    server.send(sock, 0x8, payload)
+                    break
+                if opcode == 0x9 and server.answer_pings:
+                    server.send(sock, 0xA, payload)
+        except (EOFError, OSError):
+            pass
+        finally:
+            server.clients.remove(sock)
+            self.close_connection = True
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("La condición no se cumplió a tiempo")
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def env(monkeypatch):
+    plex = FakePlex()
+    server = Server(0, {'id': '1', 'name': 'Prueba', 'url': plex.url, 'token': 'token', 'timeout': 2})
+    pool = PlexConnectionPool([server], reconnect_interval=0)
+    cache = SessionSnapshotCache([server], ttl=60, live_max_age=60)
+    monkeypatch.setattr(live_sessions, 'plex_pool', pool)
+    monkeypatch.setattr(live_sessions, 'session_cache', cache)
+    monkeypatch.setattr(sessions, 'plex_pool', pool)
+    listeners = []
+
+    def start(**options) -> SessionListener:
+        options = {'ping_interval': 5, 'ping_timeout': 2, 'resync_interval': 60, 'backoff_max': 8, **options}
+        listener = SessionListener(server, **options)
+        listeners.append((listener, listener.start()))
+        return listener
+
+    def keys():
+        return {record.session_key for record in cache.get(0)}
+
+    yield types.SimpleNamespace(plex=plex, cache=cache, start=start, keys=keys)
+    for listener, thread in listeners:
+        listener.stop()
+        thread.join(5)
+    plex.close()
+
+
+def test_initial_load_and_notifications(env):
+    listener = env.start()
+    wait_for(lambda: listener.connected)
+    assert env.keys() == {'12', '13'}
+    assert env.plex.session_requests == 1
+
+    env.plex.notify({'type': 'playing', 'PlaySessionStateNotification': [{'sessionKey': '13', 'state': 'stopped'}]})
+    wait_for(lambda: env.keys() == {'12'})
+    before = env.cache.get(0)
+    env.plex.notify({'type': 'playing',
+                     'PlaySessionStateNotification': [{'sessionKey': '12', 'state': 'playing', 'viewOffset': 900000}]})
+    wait_for(lambda: env.cache.get(0)[0].view_offset == 900000)
+    # La instantánea que ya tenía un lector no cambia
+    assert before[0].view_offset == 60000
+    # Los avisos de sesiones conocidas se aplican en memoria, sin consultar a Plex
+    assert env.plex.session_requests == 1
+
+    env.plex.sessions = ['12', '14']
+    env.plex.notify({'type': 'playing', 'PlaySessionStateNotification': [{'sessionKey': '14', 'state': 'playing'}]})
+    wait_for(lambda: env.keys() == {'12', '14'})
+    assert env.plex.session_requests == 2
+
+
+def test_transcode_updates_do_not_resync(env):
+    listener = env.start()
+    wait_for(lambda: listener.connected)
+    for _ in range(20):
+        env.plex.notify({'type': 'transcodeSession.update', 'TranscodeSession': [{'key': '/transcode/sessions/a'}]})
+    time.sleep(1.5)
+    assert env.plex.session_requests == 1
+
+    env.plex.notify({'type': 'transcodeSession.start', 'TranscodeSession': [{'key': '/transcode/sessions/b'}]})
+    wait_for(lambda: env.plex.session_requests == 2)
+
+
+def test_reconnects_with_growing_backoff(env):
+    listener = env.start()
+    wait_for(lambda: listener.connected)
+    env.plex.accept_websockets = False
+    env.plex.drop()
+    wait_for(lambda: not listener.connected)
+    assert not env.cache._live[0]
+    # Tras el corte se reintenta al segundo y después la espera se duplica en cada fallo (2 s, 4 s)
+    wait_for(lambda: len(env.plex.websocket_attempts) >= 4, timeout=10)
+    first, second, third = env.plex.websocket_attempts[1:4]
+    assert 1.8 < second - first < 2.8
+    assert 3.8 < third - second < 4.8
+
+    env.plex.accept_websockets = True
+    wait_for(lambda: listener.connected, timeout=10)
+    assert env.cache._live[0]
+    # Al reconectar se vuelve a cargar la tabla
+    assert env.plex.session_requests == 2
+
+
+def test_half_open_connection_is_detected_by_ping(env):
+    listener = env.start(ping_interval=0.4, ping_timeout=0.2)
+    wait_for(lambda: listener.connected)
+    # El socket sigue abierto pero ya no contesta: solo el ping puede notarlo
+    env.plex.answer_pings = False
+    wait_for(lambda: not listener.connected, timeout=3)
+    env.plex.answer_pings = True
+    wait_for(lambda: listener.connected, timeout=5)
+
+
+def test_stop_during_initial_resync_is_not_lost(env):
+    env.plex.session_delay = 1.0
+    listener = env.start()
+    # El websocket ya está abierto y la carga inicial (con la sesión 13) está en camino
+    wait_for(lambda: env.plex.clients and env.plex.session_requests == 1)
+    env.plex.sessions = ['12']
+    env.plex.notify({'type': 'playing', 'PlaySessionStateNotification': [{'sessionKey': '13', 'state': 'stopped'}]})
+    wait_for(lambda: listener.connected)
+    assert env.keys() == {'12'}
+
+
+def test_periodic_resync_while_connected(env):
+    listener = env.start(resync_interval=0.5)
+    wait_for(lambda: listener.connected)
+    env.plex.sessions = ['12', '13', '15']
+    wait_for(lambda: env.keys() == {'12', '13', '15'}, timeout=3)
+
+
+def test_live_snapshot_expires_after_max_age(env):
+    cache = SessionSnapshotCache([Server(0, {'id': '1', 'name': 'Prueba', 'url': env.plex.url, 'token': 't'})],
+                                 ttl=0.1, live_max_age=0.5)
+    cache.set_live(0, True)
+    cache.publish(0, [])
+    time.sleep(0.2)
+    # En vivo, la instantánea sigue valiendo más allá del TTL normal...
+    assert cache.get(0) == []
+    assert env.plex.session_requests == 0
+    time.sleep(0.4)
+    # ...pero no más allá de live_max_age, por si el listener se quedó colgado
+    assert {record.session_key for record in cache.get(0)} == {'12', '13'}
+    assert env.plex.session_requests == 1
@@ -0,0 +1,64 @@
+import re
+
+from telegram import InlineKeyboardButton
+
+from formatting import escape_markdown
+from pages import PageItem, paginate, _text_length
+
+
+def balanced(text: str) -> bool:
+    """Cada *, _ y ` sin escapar tiene pareja y no queda un '\\' suelto al final."""
+    if re.search(r'(?<!\\)(\\\\)*\\$', text):
+        return False
+    plain = re.sub(r'\\.', '', text)
+    return all(plain.count(marker) % 2 == 0 for marker in '*_`')
+
+
+def test_long_item_is_split_on_line_boundaries():
+    lines = [f"*Usuario {n}*: {escape_markdown('película_' + str(n))} (1080p → 720p)\n" for n in range(60)]
+    button = [[InlineKeyboardButton("Detener", callback_data='stop')]]
+    view = paginate("*Transcodificando*\n\n", [PageItem("".join(lines), button), PageItem("Fin\n")], [], limit=300)
+
+    assert len(view.pages) > 1
+    assert "".join(text for text, _ in view.pages) == "".join(lines) + "Fin\n"
+    for text, _ in view.pages:
+        assert len(view.header) + len(text) + 20 <= 300
+        assert text.endswith("\n") and balanced(text)
+    # Los botones del elemento van en la página donde empieza
+    assert view.pages[0][1] == button
+    assert all(not buttons for _, buttons in view.pages[1:])
+
+
+def test_single_long_line_keeps_markdown_valid():
+    line = "*" + " ".join(["negrita"] * 40) + "* " + escape_markdown("a_b*c " * 40) + " `" + "código largo " * 20 + "`\n"
+    view = paginate("", [PageItem(line)], [], limit=120)
+
+    assert len(view.pages) > 2
+    for text, _ in view.pages:
+        assert len(text) + 20 <= 120
+        assert balanced(text), text
+
+
+def test_pages_are_measured_in_utf16_units():
+    # Cada emoji cuenta como dos para Telegram
+    lines = [f"🎬 *{escape_markdown('𝔇𝔲𝔫𝔢')}* 👤 usuario{n} 📺 Salón\n" for n in range(80)]
+    view = paginate("🕵️ *Sesiones*\n\n", [PageItem(line) for line in lines], [], limit=300)
+    assert "".join(text for text, _ in view.pages) == "".join(lines)
+    for text, _ in view.pages:
+        assert _text_length(view.header) + _text_length(text) + 20 <= 300
+        assert len(view.header) + len(text) + 20 < 300
+
+
+def test_single_line_of_emoji_is_cut_within_the_limit():
+    line = "*" + "🎬" * 200 + "*\n"
+    view = paginate("", [PageItem(line)], [], limit=120)
+    assert len(view.pages) > 2
+    for text, _ in view.pages:
+        assert _text_length(text) + 20 <= 120
+        assert balanced(text), text
+
+
+def test_header_longer_than_the_limit_still_paginates():
+    view = paginate("x" * 200 + "\n", [PageItem("uno\n"), PageItem("dos\n")], [], limit=100)
+    assert "".join(text for text, _ in view.pages) == "uno\ndos\n"
+    assert len(view.pages) == 2
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from router import CALLBACK_DATA_LIMIT, CallbackRouter
+
+
+@pytest.fixture
+def router():
+    router = CallbackRouter()
+    calls = []
+
+    async def playing(update, server_index):
+        calls.append(('playing', server_index))
+
+    async def stop(update, server_index, session_key):
+        calls.append(('stop', server_index, session_key))
+
+    router.add('playing', playing, int)
+    router.add('stop', stop, int, str)
+    router.calls = calls
+    return router
+
+
+def test_arguments_are_converted_and_last_one_keeps_separators(router):
+    assert asyncio.run(router.dispatch('playing:2', None))
+    assert asyncio.run(router.dispatch(router.data('stop', 1, 'a:b'), None))
+    assert router.calls == [('playing', 2), ('stop', 1, 'a:b')]
+
+
+def test_callback_data_longer_than_64_bytes_is_rejected(router):
+    assert len(router.data('stop', 1, 'x' * (CALLBACK_DATA_LIMIT - len('stop:1:')))) == CALLBACK_DATA_LIMIT
+    with pytest.raises(ValueError):
+        router.data('stop', 1, 'x' * (CALLBACK_DATA_LIMIT - len('stop:1:') + 1))
+    # Se cuentan bytes, no caracteres
+    with pytest.raises(ValueError):
+        router.data('stop', 1, 'ñ' * 30)
+
+
+def test_data_checks_the_route_and_its_arguments(router):
+    with pytest.raises(ValueError):
+        router.data('unknown')
+    with pytest.raises(ValueError):
+        router.data('stop', 1)
+
+
+def test_malformed_data_fails_and_counts_as_an_error(router):
+    with pytest.raises(ValueError):
+        asyncio.run(router.dispatch('playing:abc', None))
+    with pytest.raises(ValueError):
+        asyncio.run(router.dispatch('stop:1', None))
+    assert router.calls == []
+    assert {name: (stats.calls, stats.errors) for name, stats in router.stats()} == {'playing': (1, 1), 'stop': (1, 1)}
+
+
+def test_unknown_route_is_not_dispatched(router):
+    assert asyncio.run(router.dispatch('borrado:1', None)) is False
+    with pytest.raises(KeyError):
+        router.resolve('borrado:1')
+    assert router.stats() == []
+
+
+def test_route_names_are_validated(router):
+    with pytest.raises(ValueError):
+        router.add('playing', lambda update: None)
+    with pytest.raises(ValueError):
+        router.add('a:b', lambda update: None)
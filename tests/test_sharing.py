@@ -0,0 +1,68 @@
+import types
+
+import pytest
+
+import sharing
+from sessions import SessionRecord
+from sharing import SharingIndex
+
+
+def session(server_index: int, session_key: str, username: str, ip: str) -> SessionRecord:
+    return SessionRecord(server_index=server_index, session_key=session_key, username=username,
+                         player_address=ip, player_title='TV', media_type='movie', title='Dune')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(sharing, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def index(clock):
+    index = SharingIndex(window_hours=24, stale_after=600)
+    index.incidents = []
+    index.on_incident = index.incidents.append
+    return index
+
+
+def test_two_ips_at_once_raise_one_incident(index, clock):
+    index.observe(0, [session(0, '1', 'carol', '203.0.113.7')])
+    assert index.incidents == []
+    index.observe(1, [session(1, '5', 'carol', '198.51.100.2')])
+    assert [incident.ips for incident in index.incidents] == [['198.51.100.2', '203.0.113.7']]
+    # Mientras siguen las mismas IP no se repite el aviso
+    clock.now += 60
+    index.observe(0, [session(0, '1', 'carol', '203.0.113.7')])
+    assert len(index.incidents) == 1
+    assert list(index.shared_since(1)) == ['carol']
+
+
+def test_ended_session_does_not_count(index, clock):
+    index.observe(0, [session(0, '1', 'carol', '203.0.113.7')])
+    clock.now += 60
+    index.observe(0, [])
+    index.observe(1, [session(1, '5', 'carol', '198.51.100.2')])
+    assert index.incidents == []
+    assert [s.ended_at for s in index.history('carol')] == [None, clock.now]
+
+
+def test_sessions_of_an_unreachable_server_expire(index, clock):
+    index.observe(0, [session(0, '1', 'carol', '203.0.113.7')])
+    # El servidor 0 deja de responder: no vuelve a publicar ninguna instantánea
+    for _ in range(11):
+        clock.now += 60
+        index.observe(1, [])
+    index.observe(1, [session(1, '5', 'carol', '198.51.100.2')])
+    assert index.incidents == []
+    stale = next(s for s in index.history('carol') if s.server_index == 0)
+    assert stale.ended_at == stale.started_at
+
+
+def test_sessions_seen_recently_do_not_expire(index, clock):
+    for _ in range(11):
+        index.observe(0, [session(0, '1', 'carol', '203.0.113.7')])
+        clock.now += 60
+    index.observe(1, [session(1, '5', 'carol', '198.51.100.2')])
+    assert len(index.incidents) == 1
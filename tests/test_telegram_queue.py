@@ -0,0 +1,83 @@
+import asyncio
+import io
+import time
+
+from telegram import InputFile
+from telegram.error import RetryAfter
+
+from telegram_queue import OutboundQueue
+
+GROUP_CHAT = -1001
+
+
+def test_edits_in_groups_do_not_wait_for_the_message_budget():
+    async def run():
+        outbox = OutboundQueue(global_rate=1000, chat_rate=20, group_rate=20, retries=0)
+        edited = []
+
+        async def edit_message_caption(**kwargs):
+            edited.append(kwargs['message_id'])
+
+        started = time.monotonic()
+        # Diez pulsaciones sobre mensajes distintos del mismo grupo
+        await asyncio.gather(*(outbox.edit(edit_message_caption, chat_id=GROUP_CHAT, message_id=number, caption='x')
+                               for number in range(10)))
+        return edited, time.monotonic() - started
+
+    edited, elapsed = asyncio.run(run())
+    assert sorted(edited) == list(range(10))
+    # Con el cubo de mensajes de grupo (20 por minuto, ráfaga de 3) tardaría más de 20 s
+    assert elapsed < 1.5
+
+
+def test_only_the_caller_whose_edit_was_sent_gets_the_error():
+    async def run():
+        outbox = OutboundQueue(global_rate=1000, chat_rate=1, group_rate=20, retries=0)
+        calls = []
+
+        async def edit_message_caption(**kwargs):
+            calls.append(kwargs['caption'])
+            raise RuntimeError("mensaje borrado")
+
+        async def caller(caption):
+            try:
+                await outbox.edit(edit_message_caption, chat_id=GROUP_CHAT, message_id=1, caption=caption)
+                return 'ok'
+            except RuntimeError:
+                return 'error'
+
+        async def edit_other(**kwargs):
+            pass
+
+        # Gasta la ráfaga de ediciones del chat para que las tres siguientes esperen turno y se fundan
+        for number in range(2, 5):
+            await outbox.edit(edit_other, chat_id=GROUP_CHAT, message_id=number, caption='x')
+        first = asyncio.ensure_future(caller('a'))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(caller('b'))
+        third = asyncio.ensure_future(caller('c'))
+        return calls, await asyncio.gather(first, second, third)
+
+    calls, outcomes = asyncio.run(run())
+    assert calls == ['c']
+    # Solo el último, cuyo contenido se llegó a enviar, ve el fallo (y haría el reenvío)
+    assert outcomes == ['ok', 'ok', 'error']
+
+
+def test_document_is_uploaded_whole_after_a_retry():
+    async def run():
+        outbox = OutboundQueue(global_rate=1000, chat_rate=1000, group_rate=60000, retries=1)
+        uploads = []
+
+        async def send_document(**kwargs):
+            # Como PTB: el fichero se lee al construir la petición, también la que recibe el 429
+            uploads.append(InputFile(kwargs['document']).input_file_content)
+            if len(uploads) == 1:
+                raise RetryAfter(0)
+
+        await outbox.send(send_document, chat_id=GROUP_CHAT, document=io.BytesIO(b'<html></html>'))
+        return uploads, outbox.throttled
+
+    uploads, throttled = asyncio.run(run())
+    assert throttled == 1
+    assert uploads == [b'<html></html>', b'<html></html>']
@@ -0,0 +1,138 @@
+import http.server
+import threading
+from collections import OrderedDict
+
+import pytest
+from plexapi.server import PlexServer
+
+import sessions
+from plex_pool import PlexConnectionPool
+from servers import Server
+from sessions import SessionRecord, resolution_label, source_resolution
+from transcode_watchdog import TranscodeWatchdog
+
+# /status/sessions de un Plex real con una película 4K HDR transcodificada a 1080p: el <Media> de la
+# sesión describe el stream de salida y el <TranscodeSession> trae las dimensiones del transcode
+SESSIONS_XML = b'''<MediaContainer size="1">
+<Video addedAt="1700000000" duration="9360000" key="/library/metadata/4242" librarySectionID="1"
+       ratingKey="4242" sessionKey="37" title="Dune" type="movie" viewOffset="1200000" year="2021">
+  <Media id="9001" audioChannels="2" audioCodec="aac" bitrate="10000" container="mpegts" duration="9360000"
+         height="800" protocol="hls" videoCodec="h264" videoFrameRate="24p" videoResolution="1080" width="1920"
+         selected="1">
+    <Part id="9001" decision="transcode" protocol="hls" selected="1">
+      <Stream id="1" streamType="1" codec="h264" decision="transcode" height="800" width="1920" location="segments-video"/>
+    </Part>
+  </Media>
+  <User id="7" thumb="" title="carol"/>
+  <Player address="203.0.113.7" device="Android" machineIdentifier="tv-1" platform="Android" product="Plex for Android (TV)"
+          state="playing" title="Salon" local="0"/>
+  <Session id="y1m4v1k1n8x" bandwidth="11000" location="wan"/>
+  <TranscodeSession key="/transcode/sessions/a1b2" throttled="0" complete="0" progress="12.5" size="-22" speed="1.8"
+                    duration="9360000" remaining="260" context="streaming" sourceVideoCodec="hevc"
+                    sourceAudioCodec="truehd" videoDecision="transcode" audioDecision="transcode" protocol="hls"
+                    container="mpegts" videoCodec="h264" audioCodec="aac" audioChannels="2" width="1920" height="800"/>
+</Video>
+</MediaContainer>'''
+
+# Los metadatos del elemento sí describen el fichero original
+METADATA_XML = b'''<MediaContainer size="1">
+<Video key="/library/metadata/4242" ratingKey="4242" title="Dune" type="movie">
+  <Media id="9001" videoResolution="4k" width="3840" height="1600" videoCodec="hevc" bitrate="52000"/>
+</Video>
+</MediaContainer>'''
+
+
+class FakePlex(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        self.metadata_requests = 0
+        self.metadata_status = 200
+        super().__init__(('127.0.0.1', 0), FakePlexHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class FakePlexHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server: FakePlex = self.server
+        path = self.path.split('?')[0]
+        status = 200
+        if path == '/library/metadata/4242':
+            server.metadata_requests += 1
+            status = server.metadata_status
+        body = {
+            '/': b'<MediaContainer friendlyName="test" machineIdentifier="test" version="1.32.5"/>',
+            '/status/sessions': SESSIONS_XML,
+            '/library/metadata/4242': METADATA_XML,
+        }.get(path, b'<MediaContainer/>')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def plex(monkeypatch):
+    fake = FakePlex()
+    url = f"http://127.0.0.1:{fake.server_port}"
+    pool = PlexConnectionPool([Server(0, {'id': '1', 'name': 'Prueba', 'url': url, 'token': 'token'})],
+                              reconnect_interval=0)
+    monkeypatch.setattr(sessions, 'plex_pool', pool)
+    monkeypatch.setattr(sessions, '_source_resolutions', OrderedDict())
+    plex = PlexServer(url, 'token')
+    plex.fake = fake
+    yield plex
+    fake.shutdown()
+    fake.server_close()
+
+
+def test_record_extraction_does_not_query_metadata(plex):
+    record = SessionRecord.from_plex(0, plex.sessions()[0])
+    assert plex.fake.metadata_requests == 0
+    # Sin pedirla aún, la original se desconoce: el <Media> de la sesión es el del stream de salida
+    assert record.video_resolution is None
+    assert record.transcodes[0]['video_resolution'] == '1080'
+
+
+def test_source_resolution_is_fetched_once_from_metadata(plex):
+    record = SessionRecord.from_plex(0, plex.sessions()[0])
+    assert source_resolution(record) == '4k'
+    assert source_resolution(record) == '4k'
+    assert plex.fake.metadata_requests == 1
+    # Las instantáneas siguientes ya la traen de la caché
+    record = SessionRecord.from_plex(0, plex.sessions()[0])
+    assert record.video_resolution == '4k'
+    assert record.transcodes[0]['source_video_resolution'] == '4k'
+    assert plex.fake.metadata_requests == 1
+
+
+def test_failed_metadata_query_is_not_cached(plex, monkeypatch):
+    monkeypatch.setattr('transcode_watchdog.WATCHDOG_4K_TRANSCODE', True)
+    monkeypatch.setattr('transcode_watchdog.WATCHDOG_DOWNGRADE', True)
+    plex.fake.metadata_status = 500
+    record = SessionRecord.from_plex(0, plex.sessions()[0])
+    # Sin la resolución original no se acusa a nadie
+    assert TranscodeWatchdog([], grace=0).check(record, cpu=None) == []
+    plex.fake.metadata_status = 200
+    assert source_resolution(record) == '4k'
+    assert plex.fake.metadata_requests == 2
+
+
+def test_4k_to_1080p_transcode_breaks_both_rules(plex, monkeypatch):
+    monkeypatch.setattr('transcode_watchdog.WATCHDOG_4K_TRANSCODE', True)
+    monkeypatch.setattr('transcode_watchdog.WATCHDOG_DOWNGRADE', True)
+    record = SessionRecord.from_plex(0, plex.sessions()[0])
+    reasons = TranscodeWatchdog([], grace=0).check(record, cpu=None)
+    assert "transcode de vídeo 4K" in reasons
+    assert "baja la resolución a 1080" in reasons
+
+
+@pytest.mark.parametrize('width, height, label', [
+    (3840, 2160, '4k'), (3840, 1600, '4k'), (1920, 1080, '1080'), (1920, 800, '1080'),
+    (1280, 720, '720'), (720, 576, '576'), (720, 480, '480'), (480, 360, 'sd'), (None, None, None),
+])
+def test_resolution_label(width, height, label):
+    assert resolution_label(width, height) == label
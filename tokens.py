@@ -0,0 +1,54 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class TokenStore(Generic[T]):
+    """Valores guardados en memoria bajo un token corto y opaco.
+
+    Sirve para que un botón lleve solo el token en su callback_data. Caben
+    como mucho `maxsize` entradas (se descartan las menos usadas) y cada una
+    caduca a los `ttl` segundos de crearse.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[float, T]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, value: T) -> str:
+        """Guarda el valor y devuelve su token (8 caracteres seguros para callback_data)."""
+        token = secrets.token_urlsafe(6)
+        with self._lock:
+            self._entries[token] = (time.monotonic() + self._ttl, value)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return token
+
+    def get(self, token: str) -> Optional[T]:
+        """El valor del token, o None si no existe o ha caducado."""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry[1]
+
+    def pop(self, token: str) -> Optional[T]:
+        """Como get, pero quita el token: de dos llamadas simultáneas solo una recibe el valor."""
+        with self._lock:
+            entry = self._entries.pop(token, None)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
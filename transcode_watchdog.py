@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from config import (METRICS_INTERVAL, WATCHDOG_4K_TRANSCODE, WATCHDOG_DOWNGRADE, WATCHDOG_CPU_THRESHOLD,
+                    WATCHDOG_GRACE, WATCHDOG_USER_GRACE)
+from glances import fetch_glances_stats
+from metrics import metrics_poller
+from plex_pool import plex_pool
+from servers import SERVERS, Server
+from sessions import session_cache, source_resolution, SessionRecord
+
+logger = logging.getLogger(__name__)
+
+# Orden de las resoluciones de Plex para saber si un transcode baja la calidad
+RESOLUTION_RANK = {'sd': 0, '480': 1, '576': 2, '720': 3, '1080': 4, '2k': 5, '4k': 6}
+
+
+def _rank(resolution: Optional[str]) -> Optional[int]:
+    return RESOLUTION_RANK.get(str(resolution).lower()) if resolution else None
+
+
+class Violation(NamedTuple):
+    """Sesión que incumple alguna regla y lleva más que su periodo de gracia haciéndolo."""
+    session: SessionRecord
+    reasons: List[str]
+    since: float
+
+
+class TranscodeWatchdog:
+    """Revisa las sesiones de todos los servidores contra las reglas de transcodificación.
+
+    Reglas (cada una se desactiva desde config.py): transcode de vídeo de un
+    contenido 4K, transcode que baja la resolución y transcode de vídeo con la
+    CPU del servidor (Glances) por encima del umbral. Un usuario solo se
+    reporta cuando lleva incumpliendo las reglas más que su periodo de gracia, y
+    cada sesión se reporta una sola vez.
+    """
+
+    def __init__(self, servers: List[Server], grace: float = WATCHDOG_GRACE,
+                 user_grace: Optional[Dict[str, float]] = None):
+        self._servers = servers
+        self._grace = grace
+        self._user_grace = WATCHDOG_USER_GRACE if user_grace is None else user_grace
+        # (servidor, usuario) -> instante en que empezó a incumplir
+        self._offending_since: Dict[Tuple[int, str], float] = {}
+        # (servidor, clave de sesión) ya reportadas
+        self._reported: Set[Tuple[int, str]] = set()
+        self._lock = threading.Lock()
+
+    def _cpu(self, index: int) -> Optional[float]:
+        """CPU del servidor: la última muestra del MetricsPoller si es reciente, si no se pide a Glances."""
+        metrics = metrics_poller.get(index)
+        if metrics.sampled_at and time.time() - metrics.sampled_at < 2 * METRICS_INTERVAL:
+            return metrics.cpu.last() if metrics.glances else None
+        server = self._servers[index]
+        if not server.glances_url:
+            return None
+        try:
+            return fetch_glances_stats(server.glances_url)['cpu']
+        except Exception as e:
+            logger.warning(f"No se pudo leer la CPU de {server.name} para el vigilante: {str(e)}")
+            return None
+
+    def check(self, session: SessionRecord, cpu: Optional[float]) -> List[str]:
+        """Reglas que incumple la sesión; lista vacía si ninguna. La primera vez que ve un transcode
+        puede pedir a Plex la resolución original (source_resolution)."""
+        if not session.transcode_video:
+            return []
+        reasons = []
+        source = _rank(source_resolution(session)) if WATCHDOG_4K_TRANSCODE or WATCHDOG_DOWNGRADE else None
+        if WATCHDOG_4K_TRANSCODE and source == RESOLUTION_RANK['4k']:
+            reasons.append("transcode de vídeo 4K")
+        if WATCHDOG_DOWNGRADE:
+            for transcode in session.transcodes:
+                target = _rank(transcode['video_resolution'])
+                if source is not None and target is not None and target < source:
+                    reasons.append(f"baja la resolución a {transcode['video_resolution']}")
+                    break
+        if WATCHDOG_CPU_THRESHOLD > 0 and cpu is not None and cpu >= WATCHDOG_CPU_THRESHOLD:
+            reasons.append(f"CPU del servidor al {cpu:.0f}%")
+        return reasons
+
+    def _evaluate_server(self, index: int) -> List[Tuple[SessionRecord, List[str]]]:
+        sessions = session_cache.get(index)
+        cpu = self._cpu(index) if any(session.transcode_video for session in sessions) else None
+        return [(session, reasons) for session in sessions for reasons in [self.check(session, cpu)] if reasons]
+
+    def evaluate(self) -> List[Violation]:
+        """Revisa todos los servidores y devuelve las infracciones nuevas que ya agotaron su gracia."""
+        now = time.monotonic()
+        offending: Dict[Tuple[int, str], List[Tuple[SessionRecord, List[str]]]] = {}
+        checked = set()
+        for result in plex_pool.map_servers(self._evaluate_server):
+            if not result.ok:
+                continue
+            checked.add(result.index)
+            for session, reasons in result.value:
+                offending.setdefault((result.index, session.username), []).append((session, reasons))
+
+        violations = []
+        with self._lock:
+            # Los servidores que no respondieron conservan su estado hasta la siguiente vuelta
+            for key in [key for key in self._offending_since if key[0] in checked and key not in offending]:
+                del self._offending_since[key]
+            live = {(session.server_index, session.session_key) for items in offending.values() for session, _ in items}
+            self._reported = {key for key in self._reported if key[0] not in checked or key in live}
+
+            for user_key, items in offending.items():
+                since = self._offending_since.setdefault(user_key, now)
+                if now - since < self._user_grace.get(user_key[1], self._grace):
+                    continue
+                for session, reasons in items:
+                    session_key = (session.server_index, session.session_key)
+                    if session_key not in self._reported:
+                        self._reported.add(session_key)
+                        violations.append(Violation(session, reasons, since))
+        return violations
+
+
+transcode_watchdog = TranscodeWatchdog(SERVERS)